@@ -0,0 +1,42 @@
+"""
+Shows how bulk expansion scales with the number of worker processes, by
+expanding every generator of a model over 18 months with 1, 2, 4 and 8
+workers. The times should fall roughly in proportion, up to the number of
+cores (and as far as the database keeps up).
+
+Run it with your project's settings, naming a generator model:
+
+    DJANGO_SETTINGS_MODULE=myproject.settings python benchmarks/benchmark_bulk.py myapp LectureOccurrenceGenerator
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from django.db.models import get_model
+
+from eventtools.bulk import bulk_occurrences_between
+
+WORKERS = [1, 2, 4, 8]
+
+
+def run(app_label, model_name, start=None, days=548):
+    GeneratorModel = get_model(app_label, model_name)
+    if start is None:
+        start = datetime.now()
+    end = start + timedelta(days=days)
+    print "%d generators, %s to %s" % (GeneratorModel.objects.count(), start.date(), end.date())
+    print "%8s %12s %10s %8s" % ("workers", "occurrences", "seconds", "speedup")
+    baseline = None
+    for workers in WORKERS:
+        began = time.time()
+        count = 0
+        for row in bulk_occurrences_between(GeneratorModel.objects.all(), start, end, workers=workers):
+            count += 1
+        seconds = time.time() - began
+        if baseline is None:
+            baseline = seconds
+        print "%8d %12d %10.2f %8.2f" % (workers, count, seconds, baseline / seconds)
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:3])
@@ -0,0 +1,41 @@
+"""
+Shows how long it takes to expand a rule over a month as its first occurrence
+moves further into the past, with and without fast-forwarding. The
+fast-forwarded times should stay flat.
+
+Run it with your project's settings:
+
+    DJANGO_SETTINGS_MODULE=myproject.settings python benchmarks/benchmark_fastforward.py
+"""
+import timeit
+from datetime import datetime, timedelta
+
+from eventtools.models import Rule
+from eventtools.rrule_cache import get_rrule
+from eventtools import fastforward
+
+RULES = [
+    Rule(frequency="DAILY"),
+    Rule(frequency="WEEKLY", params="byweekday:0,2,4"),
+    Rule(frequency="HOURLY", params="interval:6"),
+    Rule(frequency="MONTHLY", params="byweekday:4;bysetpos:-1"),
+]
+AGES = [0, 365, 2 * 365, 6 * 365, 20 * 365]
+
+
+def run(repeat=20):
+    start = datetime(2030, 3, 1)
+    end = start + timedelta(days=31)
+    print "%-35s %8s %12s %12s" % ("rule", "age", "dateutil ms", "fast ms")
+    for rule in RULES:
+        for age in AGES:
+            dtstart = start - timedelta(days=age, hours=-9)
+            compiled = get_rrule(rule, dtstart)
+            slow = timeit.Timer(lambda: compiled.between(start, end, inc=True)).timeit(repeat)
+            fast = timeit.Timer(lambda: fastforward.between(rule, dtstart, start, end)).timeit(repeat)
+            print "%-35s %8d %12.3f %12.3f" % ("%s %s" % (rule.frequency, rule.params),
+                age, slow * 1000 / repeat, fast * 1000 / repeat)
+
+
+if __name__ == '__main__':
+    run()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from eventtools.models import Rule
+from eventtools.models import Rule, ExclusionCalendar, ExcludedPeriod
 from eventtools.adminviews import occurrences, make_exceptional_occurrence
 from django.conf.urls.defaults import *
 from django.core import urlresolvers
@@ -8,6 +8,15 @@ from django.forms import ModelForm
 
 admin.site.register(Rule)
 
+class ExcludedPeriodInline(admin.TabularInline):
+    model = ExcludedPeriod
+    extra = 3
+
+class ExclusionCalendarAdmin(admin.ModelAdmin):
+    inlines = [ExcludedPeriodInline]
+
+admin.site.register(ExclusionCalendar, ExclusionCalendarAdmin)
+
 
 def create_occurrence_admin(model_class):
     class OccurrenceAdmin(OccurrenceAdminBase):
@@ -4,6 +4,7 @@ from django.http import HttpResponseRedirect, Http404
 import datetime
 from django.core import urlresolvers
 from eventtools.periods import Month
+from eventtools.clashes import find_clashes
 from django.utils.translation import ugettext as _
 
 def occurrences(request, id, modeladmin):
@@ -38,11 +39,12 @@ def occurrences(request, id, modeladmin):
             hasnext = last > period.end
         occurrences = period.get_even_hidden_occurrences()
     title = _("Select an occurrence to change")
+    clashes = find_clashes(occurrences)
     
     admin_url_name = ('admin:%s_%s_change' % (EventModel._meta.app_label, event.OccurrenceModel.__name__)).lower()
     occ_change_url = urlresolvers.reverse(admin_url_name, args=(0,))[:-3] # we don't want a real parameter yet, so strip off the last /0/
     
-    return render_to_response('admin/eventtools/list_occurrences.html', {"event": event, 'occurrences': occurrences, 'period': period, 'hasprev': hasprev, 'hasnext': hasnext, 'title': title, 'occ_change_url': occ_change_url, 'opts': EventModel._meta }, context_instance=RequestContext(request))
+    return render_to_response('admin/eventtools/list_occurrences.html', {"event": event, 'occurrences': occurrences, 'period': period, 'hasprev': hasprev, 'hasnext': hasnext, 'title': title, 'occ_change_url': occ_change_url, 'clashes': clashes, 'opts': EventModel._meta }, context_instance=RequestContext(request))
 
 def make_exceptional_occurrence(request, event_id, gen_id, year, month, day, hour, minute, second, modeladmin):
     
@@ -55,7 +57,7 @@ def make_exceptional_occurrence(request, event_id, gen_id, year, month, day, hou
     occurrence = generator.get_occurrence(datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second)))
 
     occurrence.save()
-    OccurrenceModel = occurrence.__class__
+    OccurrenceModel = generator.OccurrenceModel
     admin_url_name = ('admin:%s_%s_change' % (OccurrenceModel._meta.app_label, OccurrenceModel.__name__)).lower()
     event_change_url = urlresolvers.reverse(admin_url_name, args=(occurrence.id,))
     return HttpResponseRedirect(event_change_url)
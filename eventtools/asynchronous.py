@@ -0,0 +1,179 @@
+"""
+Occurrence queries for asynchronous views.
+
+Expanding rules is CPU-bound and loading generators and exceptions means ORM
+queries, so calling ``get_occurrences`` or ``occurrences_between`` from an
+event loop blocks it. The ``a``-prefixed counterparts:
+
+* ``EventBase.aget_occurrences(start, end)``
+* ``EventQuerySetBase.aoccurrences_between(start, end)`` (and the manager's)
+* ``EventQuerySetBase.aoccurrences_after(after)`` (and the manager's)
+
+do the work in a bounded pool of threads (ASYNC_OCCURRENCE_WORKERS of them).
+Django's database connections are per thread, so each worker uses its own,
+and closes it when the job is done. Concurrent requests for the same
+occurrences share the job that is already running, rather than each
+starting their own.
+
+The first two return an AsyncResult, which can be awaited from asyncio code,
+or waited on with ``result()`` from anywhere else:
+
+>>> occurrences = await Lecture.objects.aoccurrences_between(start, end)
+>>> occurrences = event.aget_occurrences(start, end).result(timeout=5)
+
+``aoccurrences_after`` returns an asynchronous iterator, which fetches the
+merged occurrence stream from the pool a batch at a time:
+
+>>> async for occurrence in Lecture.objects.aoccurrences_after(now):
+...     ...
+
+Since results are shared, don't modify the lists you are given. This needs the
+``concurrent.futures`` module (the ``futures`` package on Python 2).
+"""
+import threading
+from itertools import islice
+
+try:
+    from concurrent.futures import Future, ThreadPoolExecutor
+except ImportError:
+    Future = ThreadPoolExecutor = None
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError: # Python < 3.5
+    class StopAsyncIteration(Exception):
+        pass
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from eventtools.conf.settings import ASYNC_OCCURRENCE_WORKERS
+
+_executor = None
+_lock = threading.RLock()
+_in_flight = {}
+
+
+def get_executor():
+    """ The (shared) pool of worker threads, started when it is first needed. """
+    global _executor
+    if ThreadPoolExecutor is None:
+        raise ImproperlyConfigured("The asynchronous occurrence API needs the concurrent.futures "
+            "module (pip install futures).")
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_OCCURRENCE_WORKERS)
+        return _executor
+
+
+class AsyncResult(object):
+    """
+    The eventual result of a job in the pool: a concurrent.futures Future that asyncio code can
+    await, too.
+    """
+
+    def __init__(self, future):
+        self.future = future
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def __await__(self):
+        # shielded, so that a cancelled request doesn't cancel a job other requests are sharing
+        return asyncio.shield(asyncio.wrap_future(self.future)).__await__()
+
+
+def _run(function, args):
+    try:
+        return function(*args)
+    finally:
+        # this thread's connection, not the caller's
+        connection.close()
+
+
+def _forget(key, future):
+    with _lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+def submit(key, function, *args):
+    """
+    Runs ``function(*args)`` in the pool and returns an AsyncResult. While it is running, calls with
+    the same (hashable) ``key`` get the same job's result instead of starting another.
+    """
+    with _lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = get_executor().submit(_run, function, args)
+            _in_flight[key] = future
+            future.add_done_callback(lambda f: _forget(key, f))
+    return AsyncResult(future)
+
+
+def _completed(value=None, exception=None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(value)
+    return AsyncResult(future)
+
+
+class AsyncOccurrenceIterator(object):
+    """
+    An asynchronous iterator over the iterator that ``make_iterator()`` returns (it is called, like
+    every fetch, in the pool). Items are fetched ``batch_size`` at a time.
+    """
+
+    def __init__(self, make_iterator, batch_size=50):
+        self.make_iterator = make_iterator
+        self.batch_size = batch_size
+        self._iterator = None
+        self._batch = []
+        self._exhausted = False
+
+    def _fetch(self):
+        if self._iterator is None:
+            self._iterator = self.make_iterator()
+        batch = list(islice(self._iterator, self.batch_size))
+        batch.reverse()
+        return batch
+
+    def next_batch(self):
+        """ An AsyncResult of the next list of (up to batch_size) items, empty at the end. """
+        return AsyncResult(get_executor().submit(_run, self._fetch, ()))
+
+    def __aiter__(self):
+        return self
+
+    def _pop(self, future):
+        self._batch = future.result()
+        if not self._batch:
+            self._exhausted = True
+            raise StopAsyncIteration
+        return self._batch.pop()
+
+    def __anext__(self):
+        if self._batch:
+            return _completed(self._batch.pop())
+        if self._exhausted:
+            return _completed(exception=StopAsyncIteration())
+        # chain a future that pops the first item of the fetched batch
+        fetched = self.next_batch().future
+        popped = Future()
+        def pop(future):
+            try:
+                popped.set_result(self._pop(future))
+            except BaseException as e:
+                popped.set_exception(e)
+        fetched.add_done_callback(pop)
+        return AsyncResult(popped)
@@ -0,0 +1,187 @@
+"""
+Expanding very many generators at once, across processes, for feeds and
+exports.
+
+``occurrences_between`` on a queryset of 100,000 generators runs on one core.
+``bulk_occurrences_between`` splits the ids of the generators that can have
+occurrences in the window into shards, and the window into slices of
+``slice_days`` days, and hands the shards to a ProcessPoolExecutor. Each
+worker opens its own database connection and loads its shard's generators,
+rules and exclusions once. Then it expands them a slice at a time (as
+``occurrences_between`` does, loading only the exceptions that can affect
+that slice), and sends back each slice's compact tuples, sorted, as soon as
+it has them. The shards of each slice are merged in the parent, and yielded
+as soon as every shard has done that slice:
+
+>>> for row in bulk_occurrences_between(LectureOccurrenceGenerator.objects.all(),
+...         start, end, workers=8):
+...     start, generator_id, unvaried_start, end, occurrence_id, flags = row
+
+So the first rows come out after one slice's work (for each shard), and only
+the rows of slices that some shards have finished ahead of the others are
+held in memory.
+
+``occurrence_id`` is 0 for an occurrence that isn't saved in the database and
+``flags`` is a combination of CANCELLED, HIDDEN, FULL and VARIED (it has a
+variation event). Rows are ordered by start, generator id and unvaried start,
+which is their natural (tuple) order.
+
+Without the ``concurrent.futures`` module (the ``futures`` package on Python
+2), or with ``workers=1``, the shards are expanded in this process, a slice
+of each at a time. (So must they be with an in-memory SQLite database, which the
+workers can't see.)
+"""
+import heapq
+from datetime import timedelta
+from multiprocessing import Manager
+from Queue import Empty
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+from django.db import connection
+from django.db.models import get_model
+
+CANCELLED = 1
+HIDDEN = 2
+FULL = 4
+VARIED = 8
+
+SHARD_SIZE = 500
+SLICE_DAYS = 31
+
+# how often (in seconds) the parent checks for workers that have failed, while it waits for rows
+POLL_SECONDS = 1
+
+
+def occurrence_row(occurrence):
+    """ The compact tuple for an occurrence. """
+    flags = 0
+    if occurrence.cancelled:
+        flags |= CANCELLED
+    if occurrence.hide_from_lists:
+        flags |= HIDDEN
+    if occurrence.full:
+        flags |= FULL
+    if getattr(occurrence, '_varied_event_id', None):
+        flags |= VARIED
+    return (occurrence.start, occurrence.generator.pk, occurrence.unvaried_start,
+        occurrence.end, occurrence.id or 0, flags)
+
+
+def expand_shard(app_label, model_name, pks, slices, hide_hidden=True):
+    """
+    Expands the generators with ids ``pks`` over each of ``slices``, a list of
+    (start, end) windows. The generators, their rules and their exclusions are
+    loaded once, and the exceptions of each slice as it is reached. Yields a
+    sorted list of occurrence rows for each slice. This is what the workers
+    run.
+    """
+    from eventtools.models.exclusions import exclusions_for
+    from eventtools.models.occurrencegenerators import expand_generators
+    GeneratorModel = get_model(app_label, model_name)
+    generators = list(GeneratorModel.objects.filter(pk__in=pks).select_related('rule', 'event'))
+    exclusions = exclusions_for(generators)
+    for start, end in slices:
+        rows = [occurrence_row(occurrence) for occurrence in
+            expand_generators(generators, start, end, hide_hidden, exclusions)]
+        rows.sort()
+        yield rows
+
+
+def _stream_shard(expand, queue, n, args):
+    """ Puts (n, slice index, rows) on ``queue`` for each slice ``expand(*args)`` yields. """
+    for i, rows in enumerate(expand(*args)):
+        queue.put((n, i, rows))
+
+
+def _shards(pks, shard_size):
+    for i in range(0, len(pks), shard_size):
+        yield pks[i:i + shard_size]
+
+
+def _slices(start, end, slice_days):
+    """ (start, end) slices of the window, of ``slice_days`` days (or one, if None) """
+    if slice_days is None:
+        return [(start, end)]
+    slices = []
+    while start + timedelta(days=slice_days) < end:
+        slices.append((start, start + timedelta(days=slice_days)))
+        start += timedelta(days=slice_days)
+    slices.append((start, end))
+    return slices
+
+
+def _slice_rows(results, slices, i):
+    """
+    Merges the shards' rows for slice ``i``. An occurrence that overlaps more than one slice is
+    only given by the one it starts in (or the first, if it starts before the window).
+    """
+    slice_start, slice_end = slices[i]
+    first, last = i == 0, i == len(slices) - 1
+    for row in heapq.merge(*results):
+        if (first or row[0] >= slice_start) and (last or row[0] < slice_end):
+            yield row
+
+
+def iter_rows(expand, app_label, model_name, pks, start, end, hide_hidden=True,
+    workers=None, shard_size=SHARD_SIZE, slice_days=SLICE_DAYS):
+    """
+    Yields the rows of ``expand(app_label, model_name, shard, slices, hide_hidden)``, which yields
+    a list of rows for each of the slices of the window, for each shard of ``pks``, in order, slice
+    by slice. Each shard is expanded once, by one worker, and a slice is yielded as soon as every
+    shard has done it.
+    """
+    slices = _slices(start, end, slice_days)
+    shards = list(_shards(pks, shard_size))
+
+    if ProcessPoolExecutor is None or workers == 1 or len(shards) < 2:
+        streams = [iter(expand(app_label, model_name, shard, slices, hide_hidden)) for shard in shards]
+        for i in range(len(slices)):
+            for row in _slice_rows([stream.next() for stream in streams], slices, i):
+                yield row
+        return
+
+    # the workers are forked from this process, and must each open
+    # their own connection rather than share this one
+    connection.close()
+    manager = Manager()
+    queue = manager.Queue()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(_stream_shard, expand, queue, n,
+            (app_label, model_name, shard, slices, hide_hidden)) for n, shard in enumerate(shards)]
+        done = {} # {slice index: {shard index: rows}}, for the slices not yielded yet
+        for i in range(len(slices)):
+            while len(done.get(i, ())) < len(shards):
+                try:
+                    n, j, rows = queue.get(timeout=POLL_SECONDS)
+                except Empty:
+                    for future in futures:
+                        if future.done():
+                            future.result() # raises a worker's exception
+                    continue
+                done.setdefault(j, {})[n] = rows
+            results = done.pop(i)
+            for row in _slice_rows([results[n] for n in range(len(shards))], slices, i):
+                yield row
+    finally:
+        executor.shutdown()
+        manager.shutdown()
+
+
+def bulk_occurrences_between(generators, start, end, hide_hidden=True,
+    workers=None, shard_size=SHARD_SIZE, slice_days=SLICE_DAYS):
+    """
+    Returns an iterator of the occurrence rows of a queryset of generators
+    between two datetimes, in order, expanded by ``workers`` processes
+    (default: one per CPU) in shards of ``shard_size`` generators and slices
+    of ``slice_days`` days (None for the whole window at once).
+    """
+    opts = generators.model._meta
+    pks = list(generators.potentially_between(start, end)
+        .order_by('pk').values_list('pk', flat=True))
+    return iter_rows(expand_shard, opts.app_label, opts.object_name, pks, start, end,
+        hide_hidden, workers, shard_size, slice_days)
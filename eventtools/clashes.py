@@ -0,0 +1,116 @@
+"""
+Clashes between the occurrences of an event's generators.
+
+Two generators of an event clash when they have occurrences that start at the
+same time (the same occurrence, given twice) or that overlap in time (the
+event would be on twice at once). ``find_clashes`` finds both in a list of
+occurrences with a sweep line: the occurrences are sorted by start, and each
+one is checked against the ones that haven't ended by the time it starts,
+which are kept in a heap by end. That is O(n log n), plus the number of
+overlapping pairs, rather than a query or a scan for each occurrence:
+
+>>> report = lecture.get_clashes(start, end)
+>>> report.start_clashes
+[[<LectureOccurrence: ...>, <LectureOccurrence: ...>], ...]
+>>> report.overlaps
+[(<LectureOccurrence: ...>, <LectureOccurrence: ...>), ...]
+>>> report.clashing_starts()
+set([datetime(2010, 3, 1, 10, 0), ...])
+
+Occurrences that touch (one ends as the next starts) don't overlap, and nor
+do the occurrences of one generator, unless you ask for them with
+``same_source=True``. Cancelled occurrences aren't on, so they don't clash.
+"""
+from heapq import heappush, heappop
+from itertools import count
+
+
+def _generator_of(occurrence):
+    return occurrence.generator.pk
+
+
+class ClashReport(object):
+    """
+    The clashes in a list of occurrences:
+
+    * ``start_clashes``: lists of the occurrences that start at the same time, in order
+    * ``overlaps``: (earlier, later) pairs of occurrences that overlap in time, but don't start at
+      the same time, in order of the later one's start
+    """
+    __slots__ = ('start_clashes', 'overlaps', 'source')
+
+    def __init__(self, start_clashes, overlaps, source=_generator_of):
+        self.start_clashes = start_clashes
+        self.overlaps = overlaps
+        self.source = source
+
+    def __len__(self):
+        return len(self.start_clashes) + len(self.overlaps)
+
+    def __nonzero__(self):
+        return bool(self.start_clashes or self.overlaps)
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return '<ClashReport: %d start clashes, %d overlaps>' % (len(self.start_clashes), len(self.overlaps))
+
+    def clashing_starts(self):
+        """ The starts that more than one occurrence has. """
+        return set([group[0].start for group in self.start_clashes])
+
+    def clashing_occurrences(self):
+        """ Every occurrence that clashes with another, in order. """
+        occurrences = {}
+        for group in self.start_clashes:
+            for occurrence in group:
+                occurrences[id(occurrence)] = occurrence
+        for pair in self.overlaps:
+            for occurrence in pair:
+                occurrences[id(occurrence)] = occurrence
+        return sorted(occurrences.values(), key=lambda occurrence: (occurrence.start, occurrence.end))
+
+    def sources(self):
+        """ The sources (by default, the generator pks) of the clashing occurrences. """
+        return set([self.source(occurrence) for occurrence in self.clashing_occurrences()])
+
+
+def find_clashes(occurrences, source=_generator_of, same_source=False, show_cancelled=False):
+    """
+    Returns the ClashReport of a list of occurrences (anything with a start and an end).
+
+    ``source(occurrence)`` says where an occurrence comes from (by default, its generator's pk):
+    occurrences from the same source don't clash with each other unless ``same_source``.
+    Cancelled occurrences are left out unless ``show_cancelled``.
+    """
+    if not show_cancelled:
+        occurrences = [occurrence for occurrence in occurrences if not getattr(occurrence, 'cancelled', False)]
+    occurrences = sorted(occurrences, key=lambda occurrence: (occurrence.start, occurrence.end))
+
+    def clash(a, b):
+        return same_source or source(a) != source(b)
+
+    start_clashes, overlaps = [], []
+    active = [] # a heap of (end, sequence, occurrence) of the occurrences that haven't ended yet
+    sequence = count()
+    i, n = 0, len(occurrences)
+    while i < n:
+        # the occurrences that start at this time
+        start = occurrences[i].start
+        j = i + 1
+        while j < n and occurrences[j].start == start:
+            j += 1
+        group = occurrences[i:j]
+        if len(group) > 1 and (same_source or len(set([source(occurrence) for occurrence in group])) > 1):
+            start_clashes.append(group)
+
+        while active and active[0][0] <= start:
+            heappop(active)
+        for end, seq, earlier in active:
+            for occurrence in group:
+                if clash(earlier, occurrence):
+                    overlaps.append((earlier, occurrence))
+        for occurrence in group:
+            if occurrence.end > start:
+                heappush(active, (occurrence.end, next(sequence), occurrence))
+        i = j
+    return ClashReport(start_clashes, overlaps, source)
@@ -0,0 +1,185 @@
+"""
+A compact encoding for windows of occurrences.
+
+Pickling a list of occurrences pickles every occurrence's generator, rule and
+event along with it, so a cached month view is slow to store and load, and
+tens of KB in size. An OccurrenceWindow keeps the occurrences as columns in
+arrays instead:
+
+* the generator id
+* the (varied) start, in seconds since 1970-01-01
+* the (varied) duration, in seconds
+* the unvaried start's offset from the start, and the unvaried duration
+  (both 0 and the duration, for occurrences that haven't been moved)
+* the occurrence's id, or 0 if it isn't saved in the database
+* the id of its variation, or 0
+* its flags: a combination of CANCELLED, HIDDEN, FULL and VARIED (see
+  eventtools.bulk)
+
+and serializes them as a short header followed by the arrays, little-endian,
+at a few dozen bytes an occurrence:
+
+>>> data = encode(event.get_occurrences(start, end))
+>>> occurrences = decode(data, dict((g.pk, g) for g in event.generators.all()))
+
+Occurrences are decoded into VirtualOccurrences of the given generators, in
+their original order. Times are whole seconds: ``encode`` raises ValueError
+for an occurrence with microseconds (which the occurrence cache then pickles
+as before).
+"""
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+from eventtools.bulk import CANCELLED, HIDDEN, FULL, VARIED
+
+EPOCH = datetime(1970, 1, 1)
+
+FORMAT_VERSION = 1
+
+# the columns, in the order they are serialized
+COLUMNS = ('generator_ids', 'starts', 'durations', 'unvaried_offsets', 'unvaried_durations',
+    'ids', 'varied_event_ids', 'flags')
+
+_HEADER = struct.Struct('<2sBBI')
+_MAGIC = 'ET'.encode('ascii')
+
+
+def _int64_typecode():
+    for typecode in ('q', 'l'): # 'q' is Python 3.3+
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return 'l'
+
+INT = _int64_typecode()
+
+
+def _seconds(dt):
+    if dt.microsecond:
+        raise ValueError("Only occurrences at whole seconds can be encoded (%s)." % dt)
+    delta = dt - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def _duration(delta):
+    if delta.microseconds:
+        raise ValueError("Only occurrences of whole seconds can be encoded (%s)." % delta)
+    return delta.days * 86400 + delta.seconds
+
+
+def _flags(occurrence):
+    flags = 0
+    if occurrence.cancelled:
+        flags |= CANCELLED
+    if occurrence.hide_from_lists:
+        flags |= HIDDEN
+    if occurrence.full:
+        flags |= FULL
+    if getattr(occurrence, '_varied_event_id', None):
+        flags |= VARIED
+    return flags
+
+
+def _tobytes(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    if hasattr(column, 'tobytes'): # (tostring() before Python 3.2)
+        return column.tobytes()
+    return column.tostring()
+
+
+def _frombytes(typecode, data):
+    column = array(typecode)
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class OccurrenceWindow(object):
+    """ A list of occurrences, as columns (see above). """
+    __slots__ = COLUMNS
+
+    def __init__(self):
+        for name in COLUMNS:
+            setattr(self, name, array(name == 'flags' and 'B' or INT))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, occurrence):
+        start = _seconds(occurrence.start)
+        row = (occurrence.generator.pk, start, _duration(occurrence.end - occurrence.start),
+            _seconds(occurrence.unvaried_start) - start,
+            _duration(occurrence.unvaried_end - occurrence.unvaried_start),
+            occurrence.id or 0, getattr(occurrence, '_varied_event_id', None) or 0, _flags(occurrence))
+        for name, value in zip(COLUMNS, row):
+            getattr(self, name).append(value)
+
+    def from_occurrences(cls, occurrences):
+        window = cls()
+        for occurrence in occurrences:
+            window.append(occurrence)
+        return window
+    from_occurrences = classmethod(from_occurrences)
+
+    def to_occurrences(self, generators):
+        """
+        Returns VirtualOccurrences of ``generators``, a dictionary of generators keyed by pk (a
+        KeyError means that one of them is missing).
+        """
+        from eventtools.models.occurrences import VirtualOccurrence
+        second = timedelta(seconds=1)
+        occurrences = []
+        for i in range(len(self.starts)):
+            start = EPOCH + self.starts[i] * second
+            unvaried_start = start + self.unvaried_offsets[i] * second
+            flags = self.flags[i]
+            occurrences.append(VirtualOccurrence(generators[self.generator_ids[i]],
+                unvaried_start, unvaried_start + self.unvaried_durations[i] * second,
+                id=self.ids[i] or None,
+                varied_start=start, varied_end=start + self.durations[i] * second,
+                cancelled=bool(flags & CANCELLED), hide_from_lists=bool(flags & HIDDEN),
+                full=bool(flags & FULL), varied_event_id=self.varied_event_ids[i] or None))
+        return occurrences
+
+    def tostring(self):
+        header = _HEADER.pack(_MAGIC, FORMAT_VERSION, array(INT).itemsize, len(self))
+        return header + ''.encode('ascii').join([_tobytes(getattr(self, name)) for name in COLUMNS])
+
+    def fromstring(cls, data):
+        """ raises ValueError if ``data`` isn't an encoded window (of this version and word size). """
+        if len(data) < _HEADER.size:
+            raise ValueError("Not an encoded occurrence window.")
+        magic, version, itemsize, count = _HEADER.unpack(data[:_HEADER.size])
+        window = cls()
+        if magic != _MAGIC or version != FORMAT_VERSION or itemsize != array(INT).itemsize:
+            raise ValueError("Not an encoded occurrence window (of version %s)." % FORMAT_VERSION)
+        offset = _HEADER.size
+        for name in COLUMNS:
+            typecode = getattr(window, name).typecode
+            size = count * array(typecode).itemsize
+            if len(data) < offset + size:
+                raise ValueError("Truncated occurrence window.")
+            setattr(window, name, _frombytes(typecode, data[offset:offset + size]))
+            offset += size
+        return window
+    fromstring = classmethod(fromstring)
+
+
+def encode(occurrences):
+    """ Encodes a list of occurrences as a string. """
+    return OccurrenceWindow.from_occurrences(occurrences).tostring()
+
+
+def decode(data, generators):
+    """ Decodes a string made by encode(), given the occurrences' generators keyed by pk. """
+    return OccurrenceWindow.fromstring(data).to_occurrences(generators)
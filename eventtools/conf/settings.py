@@ -45,3 +45,51 @@ if not GET_EVENTS_FUNC:
 
 # URL to redirect to to after an occurrence is canceled
 OCCURRENCE_CANCEL_REDIRECT = getattr(settings, 'OCCURRENCE_CANCEL_REDIRECT', None)
+
+# Maximum number of compiled recurrence (rrule) objects kept in the
+# process-wide cache (see eventtools.rrule_cache).
+RRULE_CACHE_SIZE = getattr(settings, 'RRULE_CACHE_SIZE', 1000)
+
+# Maximum number of fast-forwarded recurrence objects (one per rule and window
+# anchor) and checkpoint lists kept in their own process-wide cache (see
+# eventtools.fastforward), so that they don't evict compiled rules.
+FASTFORWARD_CACHE_SIZE = getattr(settings, 'FASTFORWARD_CACHE_SIZE', 1000)
+
+# Use the NumPy engine in eventtools.vectorized to expand simple rules (it
+# falls back to dateutil if NumPy isn't installed, or for other rules).
+VECTORIZED_EXPANSION = getattr(settings, 'VECTORIZED_EXPANSION', True)
+
+# How many days ahead to materialize the occurrences of endless generators,
+# for event models with materialize_occurrences = True (see
+# eventtools.models.materialized).
+MATERIALIZED_OCCURRENCES_HORIZON = getattr(settings, 'MATERIALIZED_OCCURRENCES_HORIZON', 365)
+
+# Expand generators whose rules have the same signature (the same rule, time
+# of day and phase) once between them, and cache the expansions for the
+# process (see eventtools.signatures).
+SHARED_EXPANSION = getattr(settings, 'SHARED_EXPANSION', True)
+
+# Maximum number of signature expansions kept in the process-wide cache.
+SIGNATURE_CACHE_SIZE = getattr(settings, 'SIGNATURE_CACHE_SIZE', 500)
+
+# The number of threads that the asynchronous occurrence API (aget_occurrences,
+# aoccurrences_between, etc.) runs queries and expansion in (see
+# eventtools.asynchronous).
+ASYNC_OCCURRENCE_WORKERS = getattr(settings, 'ASYNC_OCCURRENCE_WORKERS', 4)
+
+# Read EventBase.get_occurrences (and so Period.occurrences) through the cache
+# (see eventtools.occurrence_cache). Off unless you turn it on: with more than
+# one process, OCCURRENCE_CACHE_BACKEND must be a shared cache.
+OCCURRENCE_CACHE_ENABLED = getattr(settings, 'OCCURRENCE_CACHE_ENABLED', False)
+
+# The cache to keep occurrences in: anything django.core.cache.get_cache
+# accepts (a backend URI, or the name of one of your CACHES on Django 1.3+).
+OCCURRENCE_CACHE_BACKEND = getattr(settings, 'OCCURRENCE_CACHE_BACKEND', 'locmem://')
+
+# How many seconds cached occurrences (and schedule versions) are kept for.
+OCCURRENCE_CACHE_TIMEOUT = getattr(settings, 'OCCURRENCE_CACHE_TIMEOUT', 60 * 60)
+
+# The most seconds the in-memory span index of a generator model (see
+# eventtools.spans) is used for before it is rebuilt, whatever the stamp in the
+# occurrence cache says.
+SPAN_INDEX_TTL = getattr(settings, 'SPAN_INDEX_TTL', 60)
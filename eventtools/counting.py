@@ -0,0 +1,220 @@
+"""
+Counting the occurrences of a rule without generating them.
+
+For the rules eventtools.vectorized can parse (DAILY, WEEKLY and MONTHLY,
+with ``interval``, ``count``, ``byweekday``, ``bymonthday`` and ``bymonth``)
+the number of occurrences up to a datetime is worked out arithmetically: the
+days that match a rule fall into a few arithmetic progressions (a residue
+modulo the interval and the week), which can be counted in constant time, a
+month at a time where months matter. Other rules are counted by streaming
+the recurrence, without building a list.
+
+>>> count_occurrences(generator.rule, generator.start, generator.repeat_until)
+1043
+
+The same counts find the last start of a rule bounded by ``count``, by
+searching for the day its last occurrence falls on:
+
+>>> last_start(generator.rule, generator.start, generator.repeat_until)
+datetime.datetime(2012, 6, 4, 10, 0)
+"""
+from datetime import datetime, timedelta
+
+from eventtools.fastforward import get_checkpoints
+from eventtools.rrule_cache import get_rrule, is_bounded
+from eventtools.vectorized import parse_rule_spec
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _count_progression(lo, hi, residue, modulus):
+    """ the number of x in [lo, hi] with x % modulus == residue """
+    return (hi - residue) // modulus - (lo - 1 - residue) // modulus
+
+
+def _weekday(ordinal):
+    # ordinal 1 (1 January, year 1) was a Monday
+    return (ordinal - 1) % 7
+
+
+class _DayCounter(object):
+    """
+    Counts the days on which a RuleSpec (starting at ``dtstart``) produces an
+    occurrence, ignoring ``count``.
+    """
+
+    def __init__(self, spec, dtstart):
+        self.spec = spec
+        self.d0 = dtstart.toordinal()
+        self.week0 = self.d0 - dtstart.weekday()
+        self.month0 = dtstart.year * 12 + dtstart.month - 1
+        self.byweekday, self.bymonthday = spec.byweekday, spec.bymonthday
+        if self.byweekday is None and self.bymonthday is None:
+            # rrule's defaults are taken from dtstart
+            if spec.frequency == 'WEEKLY':
+                self.byweekday = (dtstart.weekday(),)
+            elif spec.frequency == 'MONTHLY':
+                self.bymonthday = (dtstart.day,)
+
+        # the day-level conditions repeat with this period
+        if spec.frequency == 'DAILY':
+            period = spec.interval
+        elif spec.frequency == 'WEEKLY':
+            period = 7 * spec.interval
+        else:
+            period = 1
+        if self.byweekday is not None:
+            period = period * 7 // _gcd(period, 7)
+        self.period = period
+        self.residues = [r for r in range(period) if self._matches(r)]
+
+    def _matches(self, ordinal):
+        """ does the day pass the phase and weekday conditions? """
+        interval = self.spec.interval
+        if self.spec.frequency == 'DAILY':
+            if (ordinal - self.d0) % interval:
+                return False
+        elif self.spec.frequency == 'WEEKLY':
+            week_start = ordinal - _weekday(ordinal)
+            if (week_start - self.week0) // 7 % interval:
+                return False
+        if self.byweekday is not None:
+            return _weekday(ordinal) in self.byweekday
+        return True
+
+    def _count_range(self, lo, hi, month_start=None, month_length=None):
+        if lo > hi:
+            return 0
+        if self.bymonthday is not None:
+            days = set()
+            for monthday in self.bymonthday:
+                if monthday < 0:
+                    monthday += month_length + 1
+                if 1 <= monthday <= month_length:
+                    days.add(month_start + monthday - 1)
+            return len([d for d in days if lo <= d <= hi and self._matches(d)])
+        return sum([_count_progression(lo, hi, r, self.period)
+            for r in self.residues])
+
+    def count(self, first, last):
+        """ the number of matching days between two dates, inclusive """
+        lo = max(first.toordinal(), self.d0)
+        hi = last.toordinal()
+        spec = self.spec
+        if spec.frequency != 'MONTHLY' and self.bymonthday is None and \
+                not spec.bymonth:
+            return self._count_range(lo, hi)
+
+        # month by month
+        total = 0
+        month = first.replace(day=1)
+        while month <= last:
+            if month.month == 12:
+                next_month = month.replace(year=month.year + 1, month=1)
+            else:
+                next_month = month.replace(month=month.month + 1)
+            month_index = month.year * 12 + month.month - 1
+            if (not spec.bymonth or month.month in spec.bymonth) and \
+                    (spec.frequency != 'MONTHLY' or
+                    (month_index - self.month0) % spec.interval == 0):
+                start = month.toordinal()
+                length = next_month.toordinal() - start
+                total += self._count_range(max(lo, start),
+                    min(hi, start + length - 1), start, length)
+            month = next_month
+        return total
+
+
+def count_occurrences(rule, dtstart, until=None):
+    """
+    Returns the number of occurrences of ``rule`` (beginning at ``dtstart``)
+    that start at or before ``until``, or None if there are infinitely many.
+    """
+    spec = parse_rule_spec(rule)
+    if spec is None:
+        return _stream_count(rule, dtstart, until)
+    if until is None:
+        return spec.count
+    dtstart = dtstart.replace(microsecond=0)
+    last = _last_day(dtstart, until)
+    if last < dtstart.date():
+        return 0
+    total = _DayCounter(spec, dtstart).count(dtstart.date(), last)
+    if spec.count is not None:
+        return min(total, spec.count)
+    return total
+
+
+def _last_day(dtstart, until):
+    """ the last day whose occurrence (at dtstart's time) is at or before ``until`` """
+    last = until.date()
+    if until.time() < dtstart.time():
+        last -= timedelta(days=1)
+    return last
+
+
+def last_start(rule, dtstart, until=None):
+    """
+    Returns the start of the last occurrence of ``rule`` (beginning at
+    ``dtstart``), ``until`` if the rule goes on past it, or None if it goes on
+    for ever. Occurrences are never looked for beyond ``until``.
+    """
+    spec = parse_rule_spec(rule)
+    if spec is None:
+        return _stream_last_start(rule, dtstart, until)
+    if spec.count is None:
+        return until
+    dtstart = dtstart.replace(microsecond=0)
+    counter = _DayCounter(spec, dtstart)
+    first = dtstart.date()
+    if until is not None:
+        last = _last_day(dtstart, until)
+        if last < first or counter.count(first, last) < spec.count:
+            return until
+
+    # the first day by which there have been ``count`` occurrences: double
+    # the range until it has them, then bisect
+    try:
+        span = 1
+        while counter.count(first, first + timedelta(days=span)) < spec.count:
+            span *= 2
+    except OverflowError:
+        return _stream_last_start(rule, dtstart, until)
+    lo, hi = span // 2, span
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if counter.count(first, first + timedelta(days=mid)) < spec.count:
+            lo = mid + 1
+        else:
+            hi = mid
+    return datetime.combine(first + timedelta(days=lo), dtstart.time())
+
+
+def _stream_last_start(rule, dtstart, until):
+    checkpoints = get_checkpoints(rule, dtstart)
+    if until is not None:
+        if checkpoints.after(until) is not None:
+            return until
+    elif not is_bounded(get_rrule(rule, dtstart)):
+        return None
+    # (now that every occurrence up to until has been computed)
+    dates = checkpoints.between(datetime.min, until or datetime.max, inc=True)
+    if not dates:
+        return until
+    return dates[-1]
+
+
+def _stream_count(rule, dtstart, until):
+    compiled = get_rrule(rule, dtstart)
+    if until is None and not is_bounded(compiled):
+        return None
+    total = 0
+    for d in compiled:
+        if until is not None and d > until:
+            break
+        total += 1
+    return total
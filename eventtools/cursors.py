@@ -0,0 +1,81 @@
+"""
+Cursors for paging through a stream of occurrences.
+
+Paging through ``occurrences_after`` with ``offset`` generates (and throws
+away) every occurrence on the earlier pages. A cursor records where a page
+ended instead: the stream's ``after`` and the last occurrence's position, its
+(start, generator id, unvaried start). That is the order of the merged stream
+(occurrences with the same start come out by generator id, then unvaried
+start), so it is total and stable, and the next page can be generated from
+the position, as cheaply as the first: only the generators that haven't ended
+by then are streamed, and their exceptional occurrences are loaded from there
+on (see OccurrenceGeneratorQuerySet.occurrences_after):
+
+>>> occurrences, cursor = Lecture.objects.occurrence_page(20)
+>>> occurrences, cursor = Lecture.objects.occurrence_page(20, cursor=cursor)
+
+or, with the iterator API:
+
+>>> Lecture.objects.occurrences_after(cursor=cursor, limit=20)
+
+Cursors are opaque, URL-safe strings. ``decode_cursor`` raises ValueError for
+a string that isn't one.
+"""
+import base64
+from datetime import datetime, timedelta
+from itertools import dropwhile
+
+VERSION = '1'
+
+# the resolution of datetimes
+RESOLUTION = timedelta(microseconds=1)
+
+
+def occurrence_position(occurrence):
+    """ An occurrence's position in a merged stream of occurrences. """
+    return (occurrence.start, occurrence.generator.pk, occurrence.unvaried_start)
+
+
+def _encode_datetime(dt):
+    return '%d.%d.%d' % (dt.toordinal(), dt.hour * 3600 + dt.minute * 60 + dt.second, dt.microsecond)
+
+
+def _decode_datetime(s):
+    ordinal, seconds, microseconds = [int(n) for n in s.split('.')]
+    return datetime.fromordinal(ordinal) + timedelta(seconds=seconds, microseconds=microseconds)
+
+
+def encode_cursor(after, occurrence):
+    """ The cursor for the occurrences after ``occurrence`` in the stream of occurrences after ``after``. """
+    start, generator_id, unvaried_start = occurrence_position(occurrence)
+    value = ':'.join([VERSION, _encode_datetime(after), _encode_datetime(start), str(generator_id),
+        _encode_datetime(unvaried_start)])
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Returns the ``after`` and the position that a cursor records. """
+    try:
+        cursor = str(cursor)
+        value = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('ascii')).decode('ascii')
+        version, after, start, generator_id, unvaried_start = value.split(':')
+        if version != VERSION:
+            raise ValueError
+        return _decode_datetime(after), (_decode_datetime(start), int(generator_id), _decode_datetime(unvaried_start))
+    except (TypeError, ValueError, UnicodeError, OverflowError):
+        raise ValueError("Invalid occurrence cursor: %r" % cursor)
+
+
+def resume_from(after, position):
+    """
+    The datetime to restart a stream of the occurrences after ``after`` from, to resume it at
+    ``position``: every occurrence still to come ends after it, and few that have been seen do.
+    (Streams include the occurrences that end after their ``after``, so this is just before the
+    position's start, unless that is before ``after``.)
+    """
+    return max(after, position[0] - RESOLUTION)
+
+
+def after_position(occurrences, position):
+    """ Skips the occurrences of a stream up to and including ``position``. """
+    return dropwhile(lambda occurrence: occurrence_position(occurrence) <= position, occurrences)
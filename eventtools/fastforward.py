@@ -0,0 +1,267 @@
+"""
+Expanding a rule over a window without walking from its first occurrence.
+
+dateutil always iterates a recurrence from dtstart, so a daily generator
+created six years ago steps through 2000-odd dates to reach this month, on
+every request. Two things avoid that:
+
+* Fixed-period rules (a ``frequency`` with any ``interval`` and by-params, but
+  no ``count``) repeat every ``interval`` periods, so the recurrence is
+  restarted at the start of the latest in-phase period before the window,
+  with the by-params dtstart implies made explicit. The occurrences from there
+  on are exactly the original rule's.
+
+* Anything else (complex rules, and ``count``, which depends on every earlier
+  occurrence) is expanded once per process into a sorted list of checkpoints,
+  which is extended as later windows are asked for and bisected to find a
+  window.
+
+Both are kept in ``fastforward_cache`` (see eventtools.rrule_cache), apart
+from the compiled rules, which one entry per window anchor would otherwise
+evict.
+
+Either way the cost of a window depends on the size of the window, not the
+age of the generator:
+
+>>> between(generator.rule, generator.start, window_start, window_end)
+[datetime(2016, 3, 1, 10, 0), datetime(2016, 3, 2, 10, 0), ...]
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from dateutil import rrule
+
+from eventtools.rrule_cache import fastforward_cache, rule_fingerprint, get_rrule
+
+FIXED_PERIOD_FREQUENCIES = ('YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY', 'HOURLY')
+
+_COARSER_THAN_HOURLY = (rrule.YEARLY, rrule.MONTHLY, rrule.WEEKLY, rrule.DAILY)
+
+
+def _period_start(frequency, dt, wkst):
+    """ The start of the ``frequency`` period that contains ``dt``. """
+    if frequency == 'YEARLY':
+        return datetime(dt.year, 1, 1)
+    if frequency == 'MONTHLY':
+        return datetime(dt.year, dt.month, 1)
+    if frequency == 'WEEKLY':
+        day = datetime(dt.year, dt.month, dt.day)
+        return day - timedelta(days=(dt.weekday() - wkst) % 7)
+    if frequency == 'DAILY':
+        return datetime(dt.year, dt.month, dt.day)
+    return datetime(dt.year, dt.month, dt.day, dt.hour)
+
+
+def _periods_between(frequency, a, b):
+    """ The number of whole periods from period start ``a`` to period start ``b``. """
+    if frequency == 'YEARLY':
+        return b.year - a.year
+    if frequency == 'MONTHLY':
+        return (b.year - a.year) * 12 + b.month - a.month
+    days = (b - a).days
+    if frequency == 'WEEKLY':
+        return days // 7
+    if frequency == 'DAILY':
+        return days
+    return days * 24 + (b - a).seconds // 3600
+
+
+def _add_periods(frequency, period_start, n):
+    if frequency == 'YEARLY':
+        return period_start.replace(year=period_start.year + n)
+    if frequency == 'MONTHLY':
+        months = period_start.month - 1 + n
+        return period_start.replace(year=period_start.year + months // 12,
+            month=months % 12 + 1)
+    if frequency == 'WEEKLY':
+        return period_start + timedelta(weeks=n)
+    if frequency == 'DAILY':
+        return period_start + timedelta(days=n)
+    return period_start + timedelta(hours=n)
+
+
+def _explicit_params(frequency, params, dtstart):
+    """
+    ``params`` with the values rrule would take from dtstart filled in, so
+    that the rule means the same thing from another dtstart.
+    """
+    params = dict(params)
+    freq = getattr(rrule, frequency)
+    if not [p for p in ('byweekno', 'byyearday', 'bymonthday', 'byweekday',
+            'byeaster') if params.get(p) is not None]:
+        if freq == rrule.YEARLY:
+            if params.get('bymonth') is None:
+                params['bymonth'] = dtstart.month
+            params['bymonthday'] = dtstart.day
+        elif freq == rrule.MONTHLY:
+            params['bymonthday'] = dtstart.day
+        elif freq == rrule.WEEKLY:
+            params['byweekday'] = dtstart.weekday()
+    if params.get('byhour') is None and freq in _COARSER_THAN_HOURLY:
+        params['byhour'] = dtstart.hour
+    if params.get('byminute') is None:
+        params['byminute'] = dtstart.minute
+    if params.get('bysecond') is None:
+        params['bysecond'] = dtstart.second
+    return params
+
+
+def _fixed_period_params(rule):
+    """ ``rule``'s params, if it is a fixed-period rule, otherwise None. """
+    if rule.complex_rule or rule.frequency not in FIXED_PERIOD_FREQUENCIES:
+        return None
+    try:
+        params = rule.get_params()
+    except ValueError:
+        return None
+    if 'count' in params:
+        return None
+    interval = params.get('interval', 1)
+    if not isinstance(interval, int) or interval < 1 or \
+            not isinstance(params.get('wkst', 0), int):
+        return None
+    return params
+
+
+def fast_forward(rule, dtstart, start):
+    """
+    Returns an rrule whose occurrences from ``start`` on are the same as
+    ``rule``'s (beginning at ``dtstart``), but which begins as close before
+    ``start`` as possible. Returns None if ``rule`` isn't a fixed-period rule,
+    or if there's nothing to skip.
+    """
+    params = _fixed_period_params(rule)
+    if params is None:
+        return None
+    interval = params.get('interval', 1)
+    wkst = params.get('wkst', 0)
+
+    dtstart = dtstart.replace(microsecond=0)
+    first_period = _period_start(rule.frequency, dtstart, wkst)
+    periods = _periods_between(rule.frequency, first_period,
+        _period_start(rule.frequency, start, wkst))
+    periods -= periods % interval
+    if periods <= 0:
+        return None
+    anchor = _add_periods(rule.frequency, first_period, periods)
+
+    key = (rule.pk, rule_fingerprint(rule), dtstart, 'fast-forward', anchor)
+    compiled = fastforward_cache.get(key)
+    if compiled is None:
+        compiled = rrule.rrule(getattr(rrule, rule.frequency), dtstart=anchor,
+            **_explicit_params(rule.frequency, params, dtstart))
+        fastforward_cache.set(key, compiled)
+    return compiled
+
+
+class Checkpoints(object):
+    """
+    The occurrences of a recurrence object, computed in order as far as they
+    have been needed and kept as a sorted list, so that any window can be
+    found by bisection. Thread-safe.
+    """
+
+    def __init__(self, recurrence):
+        self.dates = []
+        self.complete = False
+        self._iter = iter(recurrence)
+        self._lock = threading.Lock()
+
+    def _extend(self):
+        try:
+            self.dates.append(next(self._iter))
+        except StopIteration:
+            self.complete = True
+
+    def _fill_past(self, dt):
+        """ compute occurrences until there's one after ``dt`` (or no more) """
+        dates = self.dates
+        if self.complete or (dates and dates[-1] > dt):
+            return
+        with self._lock:
+            while not self.complete and (not dates or dates[-1] <= dt):
+                self._extend()
+
+    def between(self, start, end, inc=False):
+        self._fill_past(end)
+        if inc:
+            return self.dates[bisect_left(self.dates, start):bisect_right(self.dates, end)]
+        return self.dates[bisect_right(self.dates, start):bisect_left(self.dates, end)]
+
+    def after(self, dt, inc=False):
+        self._fill_past(dt)
+        if inc:
+            i = bisect_left(self.dates, dt)
+        else:
+            i = bisect_right(self.dates, dt)
+        if i < len(self.dates):
+            return self.dates[i]
+        return None
+
+    def iter_from(self, dt):
+        """ iterates over the occurrences at or after ``dt`` """
+        self._fill_past(dt)
+        i = bisect_left(self.dates, dt)
+        while True:
+            if i >= len(self.dates):
+                if self.complete:
+                    return
+                with self._lock:
+                    if i >= len(self.dates) and not self.complete:
+                        self._extend()
+                continue
+            yield self.dates[i]
+            i += 1
+
+
+def get_checkpoints(rule, dtstart):
+    """ The (shared) Checkpoints for ``rule`` beginning at ``dtstart``. """
+    key = (rule.pk, rule_fingerprint(rule), dtstart, 'checkpoints')
+    checkpoints = fastforward_cache.get(key)
+    if checkpoints is None:
+        checkpoints = Checkpoints(get_rrule(rule, dtstart))
+        fastforward_cache.set(key, checkpoints)
+    return checkpoints
+
+
+def _recurrence(rule, dtstart, start):
+    """
+    Something with between(), after() and iteration that is right from
+    ``start`` on.
+    """
+    compiled = fast_forward(rule, dtstart, start)
+    if compiled is not None:
+        return compiled
+    if _fixed_period_params(rule) is not None:
+        # there's nothing to skip
+        return get_rrule(rule, dtstart)
+    return get_checkpoints(rule, dtstart)
+
+
+def between(rule, dtstart, start, end):
+    """
+    The starts of the occurrences of ``rule`` (beginning at ``dtstart``)
+    between ``start`` and ``end`` inclusive. The same as
+    ``get_rrule(rule, dtstart).between(start, end, inc=True)``.
+    """
+    return _recurrence(rule, dtstart, start).between(start, end, inc=True)
+
+
+def after(rule, dtstart, dt, inc=False):
+    """
+    The start of the first occurrence of ``rule`` after ``dt`` (or None). The
+    same as ``get_rrule(rule, dtstart).after(dt, inc)``.
+    """
+    return _recurrence(rule, dtstart, dt).after(dt, inc)
+
+
+def iter_from(rule, dtstart, dt):
+    """
+    Iterates over the starts of the occurrences of ``rule`` (beginning at
+    ``dtstart``) at or after ``dt``.
+    """
+    recurrence = _recurrence(rule, dtstart, dt)
+    if isinstance(recurrence, Checkpoints):
+        return recurrence.iter_from(dt)
+    return (d for d in recurrence if d >= dt)
@@ -0,0 +1,85 @@
+"""
+Free/busy time: when do some events' occurrences keep a venue (or a
+programme, or a person) busy, and when is it free?
+
+``freebusy`` turns a list of occurrences into the merged intervals they cover
+within a window, and the free intervals between them. The occurrences are
+reduced to a list of (start, end) pairs, sorted by start (which is nearly free
+for the sorted lists that ``occurrences_between`` returns) and merged in one
+sweep, so 50,000 occurrences take a few tens of milliseconds:
+
+>>> result = Lecture.objects.filter(venue=hall).freebusy(start, end)
+>>> result.busy
+[(datetime(2010, 3, 1, 10, 0), datetime(2010, 3, 1, 13, 0)), ...]
+>>> result.free
+[(datetime(2010, 3, 1, 0, 0), datetime(2010, 3, 1, 10, 0)), ...]
+
+Intervals that touch are merged. As in Period.classify_occurrence, cancelled
+occurrences only count as busy if SHOW_CANCELLED_OCCURRENCES is set, and
+hidden ones are left out (by ``occurrences_between``).
+"""
+from operator import itemgetter
+
+from eventtools.conf.settings import SHOW_CANCELLED_OCCURRENCES
+
+
+class FreeBusy(object):
+    """ The busy and the free intervals of a window: lists of (start, end) datetimes, in order. """
+    __slots__ = ('start', 'end', 'busy', 'free')
+
+    def __init__(self, start, end, busy, free):
+        self.start = start
+        self.end = end
+        self.busy = busy
+        self.free = free
+
+    def __repr__(self):
+        return '<FreeBusy %s-%s: %d busy, %d free>' % (self.start, self.end, len(self.busy), len(self.free))
+
+
+def merge_intervals(intervals):
+    """
+    Merges a list of (start, end) pairs (of any sortable values), sorting it by start in place.
+    Returns the merged intervals, in order. Intervals that touch are merged.
+    """
+    if not intervals:
+        return []
+    intervals.sort(key=itemgetter(0))
+    merged = []
+    iterator = iter(intervals)
+    current_start, current_end = next(iterator)
+    for start, end in iterator:
+        if start > current_end:
+            merged.append((current_start, current_end))
+            current_start, current_end = start, end
+        elif end > current_end:
+            current_end = end
+    merged.append((current_start, current_end))
+    return merged
+
+
+def freebusy(occurrences, start, end, show_cancelled=None):
+    """
+    Returns the FreeBusy of some occurrences in the window from ``start`` to ``end``. Cancelled
+    occurrences are ignored unless ``show_cancelled`` (default: SHOW_CANCELLED_OCCURRENCES).
+    """
+    if show_cancelled is None:
+        show_cancelled = SHOW_CANCELLED_OCCURRENCES
+    intervals = [(occurrence.start, occurrence.end) for occurrence in occurrences
+        if show_cancelled or not occurrence.cancelled]
+    busy, free = [], []
+    previous_end = start
+    for busy_start, busy_end in merge_intervals(intervals):
+        # clip to the window (an interval that only touches it, or is empty, keeps nothing busy)
+        if busy_end <= start or busy_start >= end:
+            continue
+        busy_start, busy_end = max(busy_start, start), min(busy_end, end)
+        if busy_start == busy_end:
+            continue
+        if busy_start > previous_end:
+            free.append((previous_end, busy_start))
+        busy.append((busy_start, busy_end))
+        previous_end = busy_end
+    if previous_end < end:
+        free.append((previous_end, end))
+    return FreeBusy(start, end, busy, free)
@@ -0,0 +1,22 @@
+import sys
+
+from django.db.models import get_model, get_models
+from django.core.management.base import NoArgsCommand
+
+from eventtools.models import EventBase
+from eventtools.models.materialized import refresh_materialized
+
+
+class Command(NoArgsCommand):
+    help = 'Extends the materialized occurrences of event models with materialize_occurrences = True to the horizon.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        for model in get_models():
+            if not issubclass(model, EventBase) or not model.materialize_occurrences:
+                continue
+            GeneratorModel = get_model(model._meta.app_label, model._generator_model_name)
+            refreshed = refresh_materialized(GeneratorModel)
+            if verbosity > 0:
+                sys.stdout.write('%s.%s: %d generators extended\n' % (
+                    model._meta.app_label, model._meta.object_name.lower(), refreshed))
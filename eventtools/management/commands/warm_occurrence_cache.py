@@ -0,0 +1,55 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+
+from eventtools import occurrence_cache
+from eventtools.models import EventBase
+from eventtools.warming import CHUNK_SIZE, warm_occurrence_cache
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--months', action='store', type='int', dest='months', default=3,
+            help='How many months, from this one, to warm the month pages of (default: 3).'),
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=CHUNK_SIZE,
+            help='How many events to warm at a time (default: %d).' % CHUNK_SIZE),
+        make_option('--workers', action='store', type='int', dest='workers', default=1,
+            help='How many processes to warm chunks with (default: 1).'),
+    )
+    help = 'Caches the occurrences of events for the month pages of the next few months.'
+    args = '[app_label.EventModel ...]'
+
+    def handle(self, *labels, **options):
+        models = None
+        if labels:
+            models = []
+            for label in labels:
+                try:
+                    app_label, model_name = label.split('.')
+                except ValueError:
+                    raise CommandError('Give event models as app_label.EventModel, not %r.' % label)
+                model = get_model(app_label, model_name)
+                if model is None or not issubclass(model, EventBase):
+                    raise CommandError('%s is not an installed event model.' % label)
+                models.append(model)
+
+        verbosity = int(options.get('verbosity', 1))
+        if not occurrence_cache.enabled:
+            if verbosity > 0:
+                sys.stdout.write('The occurrence cache is off (see OCCURRENCE_CACHE_ENABLED); nothing to warm.\n')
+            return
+        events = warmed = skipped = 0
+        seconds = 0.0
+        for report in warm_occurrence_cache(models, months=options['months'],
+                chunk_size=options['chunk_size'], workers=options['workers']):
+            if verbosity > 1:
+                sys.stdout.write('%s\n' % report)
+            events += report.events
+            warmed += report.warmed
+            skipped += report.skipped
+            seconds += report.seconds
+        if verbosity > 0:
+            sys.stdout.write('%d events, %d windows (%d cached, %d already cached) in %.2fs\n' % (
+                events, warmed + skipped, warmed, skipped, seconds))
@@ -0,0 +1,173 @@
+"""
+Weekday and time-of-day masks of generators, for prefiltering day and
+time-slot queries in SQL.
+
+Most generators only ever produce occurrences on some days of the week, at
+some times of day: a weekly Tuesday evening class never has anything on a
+Saturday, or on a Tuesday morning. Each generator stores two masks, computed
+from its first occurrence and its rule's frequency and params when it is
+saved (and when its rule is):
+
+* ``weekday_mask``: bit ``n`` is set if an occurrence can be on weekday ``n``
+  (Monday is 0), including the days that occurrences run on into;
+* ``time_mask``: bit ``n`` is set if an occurrence can be on during the
+  ``n``th TIME_BUCKET_HOURS-hour bucket of the day (midnight to 3am is 0).
+
+Either is ALL (every bit) when the rule doesn't allow it to be worked out:
+complex rules, hourly rules without ``byhour``, monthly and yearly rules
+without ``byweekday``, and so on. Windows shorter than a week (or a day) have
+masks too, and a generator can only have occurrences in a window if its masks
+share a bit with the window's, so ``occurrences_between`` for a Saturday
+evening only loads roughly the generators that are on on Saturday evenings:
+
+>>> Lecture.objects.occurrences_between(datetime(2010, 3, 6, 18, 0), datetime(2010, 3, 6, 23, 59))
+
+The masks are compared with ``__in`` lookups on the (few hundred at most)
+mask values that share a bit with the window's, so the filter is plain,
+portable SQL.
+"""
+from datetime import timedelta
+
+from eventtools.fastforward import _explicit_params
+
+WEEKDAYS = 7
+TIME_BUCKET_HOURS = 3
+TIME_BUCKETS = 24 // TIME_BUCKET_HOURS
+
+ALL_WEEKDAYS = (1 << WEEKDAYS) - 1
+ALL_TIMES = (1 << TIME_BUCKETS) - 1
+
+_DAY = 24 * 60 * 60
+_BUCKET = TIME_BUCKET_HOURS * 60 * 60
+
+# the most start times of day a rule can have for its time mask to be worked out
+MAX_START_TIMES = 24 * 60
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _params(rule):
+    """ the rule's params, or None if the masks can't be worked out from them """
+    if rule.complex_rule:
+        return None
+    try:
+        return rule.get_params()
+    except ValueError:
+        return None
+
+
+def _start_weekdays(rule, dtstart, params):
+    """ the weekdays occurrences can start on, or None for any """
+    if rule is None:
+        return set([dtstart.weekday()])
+    if params.get('byweekday') is not None:
+        return set([day % WEEKDAYS for day in _as_list(params['byweekday'])])
+    if rule.frequency == 'WEEKLY':
+        # rrule only takes the weekday from dtstart if no other by-param picks the days
+        # (as fastforward._explicit_params)
+        if [p for p in ('byweekno', 'byyearday', 'bymonthday', 'byeaster') if params.get(p) is not None]:
+            return None
+        return set([dtstart.weekday()])
+    if rule.frequency == 'DAILY' and params.get('interval', 1) % WEEKDAYS == 0:
+        return set([dtstart.weekday()])
+    return None
+
+
+def _start_times(rule, dtstart, params):
+    """ the times of day occurrences can start at, in seconds, or None for any """
+    if rule is None:
+        return [dtstart.hour * 3600 + dtstart.minute * 60 + dtstart.second]
+    params = _explicit_params(rule.frequency, params, dtstart)
+    if params.get('byhour') is None:
+        return None # an hourly rule
+    hours, minutes, seconds = [_as_list(params[p]) for p in ('byhour', 'byminute', 'bysecond')]
+    if len(hours) * len(minutes) * len(seconds) > MAX_START_TIMES:
+        return None
+    return [h * 3600 + m * 60 + s for h in hours for m in minutes for s in seconds]
+
+
+def _duration(delta):
+    return delta.days * _DAY + delta.seconds + (delta.microseconds and 1 or 0)
+
+
+def generator_masks(rule, start, end):
+    """
+    Returns the (weekday_mask, time_mask) of a generator whose first occurrence is from ``start``
+    to ``end``, repeating by ``rule`` (or None, for a one-off).
+    """
+    params = {}
+    if rule is not None:
+        params = _params(rule)
+        if params is None:
+            return ALL_WEEKDAYS, ALL_TIMES
+    duration = max(_duration(end - start), 0)
+    weekdays = _start_weekdays(rule, start, params)
+    times = _start_times(rule, start, params)
+    # (the first occurrence, in case the rule doesn't generate it)
+    if weekdays is not None:
+        weekdays.add(start.weekday())
+    if times is not None:
+        times.append(start.hour * 3600 + start.minute * 60 + start.second)
+
+    # occurrences are on from their start to their end, inclusive
+    weekday_mask = 0
+    if weekdays is None:
+        weekday_mask = ALL_WEEKDAYS
+    else:
+        latest = times is None and _DAY - 1 or max(times)
+        days = (latest + duration) // _DAY # the number of days an occurrence can run on into
+        if days >= WEEKDAYS - 1:
+            weekday_mask = ALL_WEEKDAYS
+        else:
+            for weekday in weekdays:
+                for day in range(days + 1):
+                    weekday_mask |= 1 << ((weekday + day) % WEEKDAYS)
+
+    time_mask = 0
+    if times is None or duration >= _DAY:
+        time_mask = ALL_TIMES
+    else:
+        for t in times:
+            for bucket in range(t // _BUCKET, (t + duration) // _BUCKET + 1):
+                time_mask |= 1 << (bucket % TIME_BUCKETS)
+    return weekday_mask, time_mask
+
+
+def window_masks(start, end):
+    """ Returns the (weekday_mask, time_mask) of the window from ``start`` to ``end`` (inclusive). """
+    days = (end.date() - start.date()).days
+    if days >= WEEKDAYS - 1:
+        weekday_mask = ALL_WEEKDAYS
+    else:
+        weekday_mask = 0
+        for day in range(days + 1):
+            weekday_mask |= 1 << ((start.weekday() + day) % WEEKDAYS)
+    if end - start >= timedelta(days=1):
+        time_mask = ALL_TIMES
+    else:
+        first = (start.hour * 3600 + start.minute * 60 + start.second) // _BUCKET
+        last = (end.hour * 3600 + end.minute * 60 + end.second) // _BUCKET + days * TIME_BUCKETS
+        time_mask = 0
+        for bucket in range(first, last + 1):
+            time_mask |= 1 << (bucket % TIME_BUCKETS)
+    return weekday_mask, time_mask
+
+
+_matching = {}
+
+
+def matching_values(mask, all_bits):
+    """
+    The values of a mask field (of ``all_bits``) that share a bit with ``mask``, or None if
+    ``mask`` is all the bits (so there is nothing to filter out).
+    """
+    if mask == all_bits:
+        return None
+    key = (mask, all_bits)
+    if key not in _matching:
+        _matching[key] = [value for value in range(1, all_bits + 1) if value & mask]
+    return _matching[key]
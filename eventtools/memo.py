@@ -0,0 +1,180 @@
+"""
+Memoizing generator expansions and exception lookups for the duration of a
+request.
+
+On one page the view's Period, and then the month_calendar, week_calendar and
+daily_table tags, each ask the same events for their occurrences, for windows
+that overlap (a month, then the weeks and days in it), so the same generators
+are expanded and their exceptional occurrences loaded three or four times. An
+OccurrenceMemo remembers, while it is active:
+
+* the starts each rule (beginning at each dtstart) was expanded to, and
+* the exceptional occurrences loaded for each generator (as rows),
+
+with the window they were found for, and answers a request for any window
+inside one by slicing it, without expanding or querying again:
+
+>>> with occurrence_memo() as memo:
+...     month = Month(events, date)
+...     occurrences = month.get_occurrences()
+...     days = [event.get_occurrences(day.start, day.end) for day in month.get_days()]
+>>> memo.expansions_saved
+124
+
+Add ``eventtools.middleware.OccurrenceMemoMiddleware`` to MIDDLEWARE_CLASSES
+to have a memo for each request (``request.occurrence_memo``). Memos can be
+nested; the outermost one is used. A generator's exceptional occurrences are
+forgotten when one of them is saved or deleted, and expansions are keyed by
+the rule's fingerprint, so changes made during a request are seen.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+
+from eventtools.rrule_cache import rule_fingerprint
+
+_local = threading.local()
+
+
+def _covers(window, start, end):
+    """ True if a (start, end) window, where None is unbounded, covers another. """
+    window_start, window_end = window
+    return (window_start is None or start is not None and window_start <= start) and \
+        (window_end is None or end is not None and window_end >= end)
+
+
+def _remember(windows, start, end, value):
+    # the windows a new one covers are no use any more
+    windows[:] = [entry for entry in windows if not _covers((start, end), entry[0], entry[1])]
+    windows.append((start, end, value))
+
+
+class OccurrenceMemo(object):
+    """
+    Expansions and exception lookups, by window. The counters say how much work it has done
+    (``expansions``, ``exception_lookups``) and saved (``expansions_saved``,
+    ``exception_lookups_saved``).
+    """
+
+    def __init__(self):
+        self._starts = {} # (rule pk, rule fingerprint, dtstart) -> [(start, end, starts)]
+        self._exceptions = {} # (generator model, pk) -> [(start, end, rows)]
+        self.expansions = 0
+        self.expansions_saved = 0
+        self.exception_lookups = 0
+        self.exception_lookups_saved = 0
+
+    def __repr__(self):
+        return '<OccurrenceMemo: %d expansions (%d saved), %d exception lookups (%d saved)>' % (
+            self.expansions, self.expansions_saved, self.exception_lookups, self.exception_lookups_saved)
+
+    def _starts_key(self, rule, dtstart):
+        return (rule.pk, rule_fingerprint(rule), dtstart)
+
+    def get_starts(self, rule, dtstart, start, end):
+        """
+        The starts of ``rule`` (beginning at ``dtstart``) between ``start`` and ``end`` inclusive,
+        sliced from an earlier expansion, or None if there isn't one that covers the window.
+        """
+        for window_start, window_end, starts in self._starts.get(self._starts_key(rule, dtstart), ()):
+            if window_start <= start and window_end >= end:
+                self.expansions_saved += 1
+                lo = bisect_left(starts, start)
+                return starts[lo:bisect_right(starts, end, lo)]
+        return None
+
+    def set_starts(self, rule, dtstart, start, end, starts):
+        """ Remembers an expansion of ``rule`` (see get_starts). """
+        self.expansions += 1
+        _remember(self._starts.setdefault(self._starts_key(rule, dtstart), []), start, end, list(starts))
+
+    def get_exception_rows(self, generator, start=None, end=None):
+        """
+        The rows of the exceptional occurrences of ``generator`` loaded for a window that covers
+        ``start`` to ``end`` (None for no limit), or None. They can include some that don't affect
+        the window, which is harmless: occurrences are only replaced or added if they are in it.
+        """
+        if generator.pk is None:
+            return None
+        for window_start, window_end, rows in self._exceptions.get((generator.__class__, generator.pk), ()):
+            if _covers((window_start, window_end), start, end):
+                self.exception_lookups_saved += 1
+                return rows
+        return None
+
+    def set_exception_rows(self, generator, start, end, rows):
+        """ Remembers the exceptional occurrences of ``generator`` for a window (see get_exception_rows). """
+        self.exception_lookups += 1
+        if generator.pk is None:
+            return
+        _remember(self._exceptions.setdefault((generator.__class__, generator.pk), []), start, end, rows)
+
+    def forget_exceptions(self, GeneratorModel, generator_id):
+        self._exceptions.pop((GeneratorModel, generator_id), None)
+
+
+class occurrence_memo(object):
+    """
+    A context manager that makes an OccurrenceMemo active for its duration (typically one
+    request), and returns it.
+    """
+
+    def __enter__(self):
+        self.outermost = getattr(_local, 'memo', None) is None
+        if self.outermost:
+            _local.memo = OccurrenceMemo()
+        return _local.memo
+
+    def __exit__(self, *exc_info):
+        if self.outermost:
+            _local.memo = None
+        return False
+
+
+def current_memo():
+    """ The active OccurrenceMemo, or None. """
+    return getattr(_local, 'memo', None)
+
+
+def forget_exceptions(GeneratorModel, generator_id):
+    """ Makes the active memo (if any) forget the exceptional occurrences of a generator. """
+    memo = current_memo()
+    if memo is not None:
+        memo.forget_exceptions(GeneratorModel, generator_id)
+
+
+def memoized_expand(rule, dtstart, start, end, expand):
+    """ ``expand(rule, dtstart, start, end)``, through the active memo if there is one. """
+    memo = current_memo()
+    if memo is None:
+        return expand(rule, dtstart, start, end)
+    starts = memo.get_starts(rule, dtstart, start, end)
+    if starts is None:
+        starts = expand(rule, dtstart, start, end)
+        memo.set_starts(rule, dtstart, start, end, starts)
+    return starts
+
+
+def memoized_expand_batch(items, expand_batch):
+    """
+    ``expand_batch(items)`` for a batch of (key, rule, dtstart, start, end) tuples (see
+    eventtools.vectorized), through the active memo if there is one: only the items it can't
+    answer are expanded.
+    """
+    memo = current_memo()
+    if memo is None:
+        return expand_batch(items)
+    result = {}
+    missing = []
+    for item in items:
+        key, rule, dtstart, start, end = item
+        starts = memo.get_starts(rule, dtstart, start, end)
+        if starts is None:
+            missing.append(item)
+        else:
+            result[key] = starts
+    if missing:
+        expanded = expand_batch(missing)
+        for key, rule, dtstart, start, end in missing:
+            memo.set_starts(rule, dtstart, start, end, expanded[key])
+        result.update(expanded)
+    return result
@@ -0,0 +1,47 @@
+from django.conf import settings
+
+from eventtools.signatures import expansion_scope
+from eventtools.memo import occurrence_memo
+
+
+class SharedExpansionMiddleware(object):
+    """
+    Caches the shared rule expansions (see eventtools.signatures) for the
+    duration of each request, so that the views and template tags that ask
+    for the same occurrences while a page is rendered expand them once.
+    """
+
+    def process_request(self, request):
+        request._eventtools_expansion_scope = expansion_scope()
+        request._eventtools_expansion_scope.__enter__()
+
+    def process_response(self, request, response):
+        scope = getattr(request, '_eventtools_expansion_scope', None)
+        if scope is not None:
+            scope.__exit__(None, None, None)
+            del request._eventtools_expansion_scope
+        return response
+
+
+class OccurrenceMemoMiddleware(object):
+    """
+    Memoizes generator expansions and exception lookups for the duration of
+    each request (see eventtools.memo), so that the views and template tags
+    that ask for overlapping windows of occurrences while a page is rendered
+    expand each generator once. The memo is request.occurrence_memo; when
+    DEBUG is on, the number of expansions it saved is reported in an
+    X-Eventtools-Expansions-Saved response header.
+    """
+
+    def process_request(self, request):
+        request._eventtools_occurrence_memo = occurrence_memo()
+        request.occurrence_memo = request._eventtools_occurrence_memo.__enter__()
+
+    def process_response(self, request, response):
+        scope = getattr(request, '_eventtools_occurrence_memo', None)
+        if scope is not None:
+            scope.__exit__(None, None, None)
+            if settings.DEBUG:
+                response['X-Eventtools-Expansions-Saved'] = str(request.occurrence_memo.expansions_saved)
+            del request._eventtools_occurrence_memo
+        return response
@@ -1,6 +1,7 @@
 # −*− coding: UTF−8 −*−
 from events import *
 from eventvariations import *
+from exclusions import *
 from occurrencegenerators import *
 from occurrences import *
 from rules import *
\ No newline at end of file
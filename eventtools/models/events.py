@@ -6,7 +6,15 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 import sys
 from occurrencegenerators import *
 from occurrences import *
-from utils import occurrences_to_events, dateify
+from exclusions import ExclusionCalendar, exclusions_for
+from materialized import MaterializedOccurrenceBase, connect_materialized_signals, can_materialize, is_materialized, \
+    materialized_between, as_occurrences
+from utils import occurrences_to_events, dateify, datetimeify
+from eventtools.asynchronous import submit, AsyncOccurrenceIterator
+from eventtools.occurrence_cache import cached_occurrences, connect_occurrence_cache_signals
+from eventtools.spans import connect_span_signals
+from eventtools.freebusy import freebusy
+from eventtools.clashes import find_clashes
 
 from django.core.exceptions import ValidationError
 
@@ -31,6 +39,8 @@ Event.get_occurrences(start_date, end_date).
 
 This will return a list of EventOccurrences. Remember to use EventOccurrence.merged_event to display the details for each event (since merged_event takes in to account variations).
 
+If you set `materialize_occurrences = True` on Lecture, you also get a LectureMaterializedOccurrence model, and occurrence range queries are answered from it. See materialized.py for details.
+
 """
 
 class EventQuerySetBase(models.query.QuerySet):
@@ -39,11 +49,100 @@ class EventQuerySetBase(models.query.QuerySet):
         returns the EventOccurrences in a given datetime range.
         In most calendar applications you want to use occurrences_between_days.
         """
-        occurrences = []
-        for item in self:
-            occurrences += item.generators.occurrences_between(start, end)
-            
-        return sorted(occurrences)
+        GeneratorModel = models.get_model(self.model._meta.app_label, self.model._generator_model_name)
+        generators = GeneratorModel.objects.filter(event__in=self)
+        if self.model.materialize_occurrences and can_materialize(datetimeify(end, 'end')) and \
+                is_materialized(generators, datetimeify(end, 'end')):
+            # a single range query
+            return as_occurrences(self.materialized_between(start, end))
+        return generators.occurrences_between(start, end)
+
+    def aoccurrences_between(self, start, end):
+        """
+        occurrences_between, run in the asynchronous occurrence pool so as not to block an event
+        loop. Returns an AsyncResult to await (or wait on). Concurrent requests for the same
+        occurrences share one job; see eventtools.asynchronous.
+        """
+        start = datetimeify(start, 'start')
+        end = datetimeify(end, 'end')
+        key = ('occurrences_between', self.model._meta.app_label, self.model._meta.object_name,
+            str(self.query), start, end)
+        return submit(key, self._clone().occurrences_between, start, end)
+
+    def materialized_between(self, start, end, hide_hidden=True):
+        """
+        returns a QuerySet of the materialized occurrence rows in a given datetime range, ordered by start,
+        for event models with materialize_occurrences = True. Use materialized.as_occurrences to turn
+        (a page of) them into EventOccurrences.
+        
+        The range must end within MATERIALIZED_OCCURRENCES_HORIZON days from now, and the occurrences
+        be materialized up to its end (see materialized.refresh_materialized).
+        """
+        if not self.model.materialize_occurrences:
+            raise AttributeError("%s doesn't materialize its occurrences." % self.model.__name__)
+        start = datetimeify(start, 'start')
+        end = datetimeify(end, 'end')
+        if not can_materialize(end):
+            raise ValueError("Occurrences are only materialized up to the horizon (%s)." % end)
+        GeneratorModel = models.get_model(self.model._meta.app_label, self.model._generator_model_name)
+        MaterializedModel = models.get_model(self.model._meta.app_label, self.model._materialized_model_name)
+        return materialized_between(MaterializedModel, GeneratorModel.objects.filter(event__in=self), start, end, hide_hidden)
+
+    def occurrences_after(self, after=None, limit=None, offset=0, hide_hidden=True, cursor=None):
+        """
+        returns an iterator of the EventOccurrences after a datetime (default: now), in start order.
+        Occurrences are generated lazily, so asking for the next few is cheap. See
+        OccurrenceGeneratorQuerySet.occurrences_after.
+        """
+        GeneratorModel = models.get_model(self.model._meta.app_label, self.model._generator_model_name)
+        return GeneratorModel.objects.filter(event__in=self).occurrences_after(after, limit, offset, hide_hidden, cursor)
+
+    def occurrence_page(self, limit, after=None, cursor=None, hide_hidden=True):
+        """
+        returns a list of (up to) ``limit`` EventOccurrences after a datetime (default: now), or after
+        the ``cursor`` of the previous page, and the cursor of the next page (or None). See
+        eventtools.cursors.
+        """
+        GeneratorModel = models.get_model(self.model._meta.app_label, self.model._generator_model_name)
+        return GeneratorModel.objects.filter(event__in=self).occurrence_page(limit, after, cursor, hide_hidden)
+
+    def freebusy(self, start, end, show_cancelled=None):
+        """
+        returns a FreeBusy of the times in a datetime range when these events have occurrences (its
+        ``busy`` intervals, merged) and when they don't (its ``free`` ones). See eventtools.freebusy.
+        """
+        start = datetimeify(start, 'start')
+        end = datetimeify(end, 'end')
+        return freebusy(self.occurrences_between(start, end), start, end, show_cancelled)
+
+    def occurrences_at(self, when=None, hide_hidden=True):
+        """
+        returns the EventOccurrences that are happening at a datetime (default: now). Only the
+        generators that can be live then are loaded, so the cost doesn't grow with the number of
+        events; see eventtools.spans.
+        """
+        GeneratorModel = models.get_model(self.model._meta.app_label, self.model._generator_model_name)
+        return GeneratorModel.objects.filter(event__in=self).occurrences_at(when, hide_hidden)
+
+    def occurrences_starting_between(self, start, end, hide_hidden=True):
+        """
+        returns the EventOccurrences that start in a short window (from ``start``, up to ``end``),
+        e.g. "in the next hour". See occurrences_at.
+        """
+        GeneratorModel = models.get_model(self.model._meta.app_label, self.model._generator_model_name)
+        return GeneratorModel.objects.filter(event__in=self).occurrences_starting_between(
+            datetimeify(start, 'start'), datetimeify(end, 'end'), hide_hidden)
+
+    def aoccurrences_after(self, after=None, limit=None, offset=0, hide_hidden=True, batch_size=50):
+        """
+        occurrences_after, as an asynchronous iterator whose occurrences are generated in the
+        asynchronous occurrence pool, ``batch_size`` at a time; see eventtools.asynchronous.
+        """
+        if after is None:
+            after = datetime.datetime.now()
+        queryset = self._clone()
+        return AsyncOccurrenceIterator(
+            lambda: queryset.occurrences_after(after, limit, offset, hide_hidden), batch_size)
 
     def between(self, start, end):
         """
@@ -91,6 +190,30 @@ class EventManagerBase(models.Manager):
     def occurrences_between(self, start, end):
         return self.get_query_set().occurrences_between(start, end)
         
+    def occurrences_after(self, after=None, limit=None, offset=0, hide_hidden=True, cursor=None):
+        return self.get_query_set().occurrences_after(after, limit, offset, hide_hidden, cursor)
+
+    def occurrence_page(self, limit, after=None, cursor=None, hide_hidden=True):
+        return self.get_query_set().occurrence_page(limit, after, cursor, hide_hidden)
+
+    def freebusy(self, start, end, show_cancelled=None):
+        return self.get_query_set().freebusy(start, end, show_cancelled)
+
+    def occurrences_at(self, when=None, hide_hidden=True):
+        return self.get_query_set().occurrences_at(when, hide_hidden)
+
+    def occurrences_starting_between(self, start, end, hide_hidden=True):
+        return self.get_query_set().occurrences_starting_between(start, end, hide_hidden)
+
+    def aoccurrences_between(self, start, end):
+        return self.get_query_set().aoccurrences_between(start, end)
+
+    def aoccurrences_after(self, after=None, limit=None, offset=0, hide_hidden=True, batch_size=50):
+        return self.get_query_set().aoccurrences_after(after, limit, offset, hide_hidden, batch_size)
+
+    def materialized_between(self, start, end, hide_hidden=True):
+        return self.get_query_set().materialized_between(start, end, hide_hidden)
+
     def between(self, start, end):
          return self.get_query_set().between(start, end)
          
@@ -113,6 +236,9 @@ class EventModelBase(ModelBase):
         Dynamically generate two related classes to handle occurrences (get the vodka out, George).
         
         The two generated classes are ModelNameOccurrence and ModelNameOccurrenceGenerator.        
+        
+        If the model has materialize_occurrences = True, a third, ModelNameMaterializedOccurrence, is
+        generated too.
         """
         if name != 'EventBase': # This should only fire if this is a subclass (maybe we should make devs apply this metaclass to their subclass instead?)
             # Build names for the new classes
@@ -128,6 +254,8 @@ class EventModelBase(ModelBase):
                 'event': models.ForeignKey(cls, related_name = 'generators'),
                 '_occurrence_model_name': occ_name,
             }
+            if cls.materialize_occurrences:
+                generator_fields['materialized_until'] = models.DateTimeField(null=True, blank=True, editable=False)
             generator_class = type(gen_name, (OccurrenceGeneratorBase,), generator_fields)
             # This will also work:
             #generator_class = ModelBase.__new__(ModelBase, gen_name, (OccurrenceGeneratorBase,), generator_fields)
@@ -149,6 +277,21 @@ class EventModelBase(ModelBase):
             
             # Inject it into its rightful module
             setattr(sys.modules[cls.__module__], occ_name, occurrence_class)
+            connect_exception_stats_signals(occurrence_class)
+            connect_occurrence_cache_signals(cls, generator_class, occurrence_class)
+            connect_span_signals(generator_class)
+            
+            if cls.materialize_occurrences:
+                mat_name = "%s%s" % (name, "MaterializedOccurrence")
+                cls.add_to_class('_materialized_model_name', mat_name)
+                materialized_fields = {
+                    '__module__': cls.__module__,
+                    'event': models.ForeignKey(cls, related_name = 'materialized_occurrences'),
+                    'generator': models.ForeignKey(generator_class, related_name = 'materialized_occurrences'),
+                }
+                materialized_class = type(mat_name, (MaterializedOccurrenceBase,), materialized_fields)
+                setattr(sys.modules[cls.__module__], mat_name, materialized_class)
+                connect_materialized_signals(generator_class, occurrence_class)
             
             # Undocumented Django API: this regenerates the related objects cache for the EventBase
             # derived model, ensuring that delete() calls catch its occurrences and occurrence generators 
@@ -166,9 +309,15 @@ class EventBase(models.Model):
     #injected by EventModelBase:
     # _occurrence_model_name
     # _generator_model_name
+    # _materialized_model_name (if materialize_occurrences)
     
     __metaclass__ = EventModelBase
+    
+    # set to True to keep a table of occurrences for fast range queries (see materialized.py)
+    materialize_occurrences = False
+    
     _date_description = models.TextField(_("Describe when this event occurs"), blank=True, help_text=_("e.g. \"Every Tuesday and Thursday in March 2010\". If this is omitted, an automatic description will be attempted."))
+    exclusion_calendars = models.ManyToManyField(ExclusionCalendar, verbose_name=_("exclusion calendars"), blank=True, help_text=_("Occurrences aren't generated on the dates in these calendars (see exclusions.py)."))
     
     objects = EventManagerBase()
     
@@ -229,21 +378,60 @@ class EventBase(models.Model):
     get_one_occurrence = get_first_occurrence # for backwards compatibility
     
     def get_occurrences(self, start, end, hide_hidden=True):
+        """
+        returns the EventOccurrences between two datetimes, in order. Results are read through the
+        occurrence cache (see eventtools.occurrence_cache); don't modify the list you are given.
+        """
+        return cached_occurrences(self, datetimeify(start), datetimeify(end), hide_hidden, self._get_occurrences)
+
+    def _get_occurrences(self, start, end, hide_hidden=True):
+        generators = list(self.generators.select_related('rule'))
+        exceptions = exceptions_between(generators, start, end)
+        exclusions = exclusions_for(generators)
         occs = []
-        for gen in self.generators.all():
-            occs += gen.get_occurrences(start, end, hide_hidden)
+        for gen in generators:
+            occs += gen.get_occurrences(start, end, hide_hidden, exceptional_occurrences=exceptions[gen.pk],
+                exclusions=exclusions[gen.pk])
         return sorted(occs)
         
+    def get_clashes(self, start, end, same_source=False):
+        """
+        The ClashReport of the occurrences of this event's generators between two datetimes (see
+        eventtools.clashes): occurrences of different generators that start at the same time or
+        overlap. Hidden occurrences are included, since they still take place.
+        """
+        return find_clashes(self.get_occurrences(start, end, hide_hidden=False), same_source=same_source)
+
+    def aget_occurrences(self, start, end, hide_hidden=True):
+        """
+        get_occurrences, run in the asynchronous occurrence pool so as not to block an event loop.
+        Returns an AsyncResult to await (or wait on); see eventtools.asynchronous.
+        """
+        start = datetimeify(start)
+        end = datetimeify(end)
+        key = ('get_occurrences', self._meta.app_label, self._meta.object_name, self.pk, start, end, hide_hidden)
+        return submit(key, self.get_occurrences, start, end, hide_hidden)
+        
     def get_all_occurrences_if_possible(self):
         if self.get_last_occurrence() != datetime.datetime.max:
             return self.get_occurrences(self.first_generator.start, self.get_last_occurrence())
         return None
     
     def occurrences_count(self):
-        if self.get_last_occurrence() != datetime.datetime.max:
-            return len(self.get_occurrences(self.first_generator.start, self.get_last_occurrence()))
-        else:
-            return '&infin;'
+        """
+        The number of occurrences, counted without generating them (see
+        OccurrenceGeneratorBase.count_occurrences).
+        """
+        generators = list(self.generators.select_related('rule'))
+        exceptions = exceptions_of(generators)
+        exclusions = exclusions_for(generators)
+        count = 0
+        for generator in generators:
+            generator_count = generator.count_occurrences(exceptions[generator.pk], exclusions[generator.pk])
+            if generator_count is None:
+                return '&infin;'
+            count += generator_count
+        return count
     occurrences_count.allow_tags = True
     
     def get_changed_occurrences(self):
@@ -268,13 +456,16 @@ class EventBase(models.Model):
         lastoccs = []
         for generator in self.generators.all():
             if generator.repeat_until:
-                lastoccs.append(generator.repeat_until)
+                last = generator.repeat_until
             else:
                 if generator.rule:
                     return datetime.datetime.max
-                lastoccs.append(generator.end)
-            for varied in generator.get_changed_occurrences():
-                lastoccs.append(varied.varied_end)
+                last = generator.end
+            lastoccs.append(last)
+            # only look at the exceptions if the counters say one could end later
+            if generator._may_have_exceptions(start=last):
+                for varied in generator.get_changed_occurrences():
+                    lastoccs.append(varied.varied_end)
         lastoccs.sort()
         try:
             return lastoccs[-1]
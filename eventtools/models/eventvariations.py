@@ -1,6 +1,7 @@
 from django.db.models.base import ModelBase
 from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
+from eventtools.occurrence_cache import connect_variation_signals
 
 """
 If you're using EventBase, and now have OccurrenceGenerators and Occurences, you may find that you want to use a variation of an event for one occurrence. An EventVariationBase subclass is useful if there's something different about one (or more) of a series of events. For example:
@@ -47,6 +48,8 @@ class EventVariationModelBase(ModelBase):
             #Uses the unDRY cls.varies to name the class to FK to.
             if not attrs.has_key('unvaried_event'):
                 cls.add_to_class('unvaried_event', models.ForeignKey(cls.varies, related_name="variations"))
+            # a variation changes its occurrences' merged_event, so it makes cached occurrences stale
+            connect_variation_signals(cls)
                 
         super(EventVariationModelBase, cls).__init__(name, bases, attrs)
 
@@ -0,0 +1,196 @@
+# −*− coding: UTF−8 −*−
+from array import array
+from bisect import bisect_right
+from django.db import models
+from django.db.models import F
+from django.utils.translation import ugettext_lazy as _
+from eventtools.rrule_cache import rrule_cache
+
+"""
+An ExclusionCalendar is a named set of dates (or ranges of dates) on which occurrences don't happen,
+such as public holidays or venue closures. Calendars can be attached to events and to occurrence
+generators (both have an `exclusion_calendars` field); a generated occurrence that starts on a date in
+any of the calendars of its generator or its generator's event is left out. Exceptional occurrences
+(the ones saved in the database) are still shown, as they have been edited by hand.
+
+Each calendar is compiled once per process (and again when its periods change) into sorted arrays of
+day ordinals, and subtracted from a generator's expanded dates in one pass, so excluding 20 holidays
+from 5000 generators costs no queries or rrule exdates per occurrence:
+
+>>> exclusions = exclusions_for(generators)
+>>> exclusions[generator.pk].subtract(starts)
+[datetime(2010, 12, 24, 10, 0), datetime(2010, 12, 27, 10, 0), ...]
+"""
+
+class ExclusionCalendar(models.Model):
+    name = models.CharField(_("name"), max_length=100, help_text=_("e.g. \"Public holidays\"."))
+    description = models.TextField(_("description"), blank=True)
+    # incremented whenever the periods change, so that compiled copies are never stale
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name = _('exclusion calendar')
+        verbose_name_plural = _('exclusion calendars')
+        ordering = ('name',)
+        app_label = "eventtools"
+
+    def __unicode__(self):
+        return self.name
+
+    def compile(self):
+        return compile_calendars({self.pk: self.version})[self.pk]
+
+class ExcludedPeriod(models.Model):
+    calendar = models.ForeignKey(ExclusionCalendar, related_name='periods')
+    start_date = models.DateField(_("start date"))
+    end_date = models.DateField(_("end date"), null=True, blank=True, help_text=_("if you leave this blank, just the start date is excluded."))
+    description = models.CharField(_("description"), max_length=255, blank=True, help_text=_("e.g. \"Christmas Day\"."))
+
+    class Meta:
+        verbose_name = _('excluded period')
+        verbose_name_plural = _('excluded periods')
+        ordering = ('calendar', 'start_date')
+        app_label = "eventtools"
+
+    def __unicode__(self):
+        if self.end_date and self.end_date != self.start_date:
+            return u"%s: %s-%s" % (self.calendar, self.start_date, self.end_date)
+        return u"%s: %s" % (self.calendar, self.start_date)
+
+    def _bump_version(self, calendar_id):
+        ExclusionCalendar.objects.filter(pk=calendar_id).update(version=F('version') + 1)
+
+    def save(self, *args, **kwargs):
+        if self.id:
+            # it may have been moved from another calendar
+            for calendar_id in self.__class__.objects.filter(pk=self.id).values_list('calendar', flat=True):
+                self._bump_version(calendar_id)
+        super(ExcludedPeriod, self).save(*args, **kwargs)
+        self._bump_version(self.calendar_id)
+
+    def delete(self, *args, **kwargs):
+        calendar_id = self.calendar_id
+        super(ExcludedPeriod, self).delete(*args, **kwargs)
+        self._bump_version(calendar_id)
+
+class CompiledExclusions(object):
+    """
+    A union of excluded date ranges, merged and stored as two sorted arrays of day ordinals (the
+    first and last day of each range).
+    """
+    __slots__ = ('firsts', 'lasts')
+
+    def __init__(self, ranges=()):
+        """ ``ranges`` is a sequence of (first, last) day ordinals, inclusive. """
+        self.firsts = array('l')
+        self.lasts = array('l')
+        for first, last in sorted(ranges):
+            if self.lasts and first <= self.lasts[-1] + 1:
+                self.lasts[-1] = max(self.lasts[-1], last)
+            else:
+                self.firsts.append(first)
+                self.lasts.append(last)
+
+    def __len__(self):
+        return len(self.firsts)
+
+    def __nonzero__(self):
+        return len(self.firsts) > 0
+
+    def ranges(self):
+        return zip(self.firsts, self.lasts)
+
+    def union(cls, compiled):
+        """ merges several CompiledExclusions into one """
+        if len(compiled) == 1:
+            return compiled[0]
+        ranges = []
+        for c in compiled:
+            ranges += c.ranges()
+        return cls(ranges)
+    union = classmethod(union)
+
+    def excludes(self, dt):
+        """ is the date (or datetime) ``dt`` excluded? """
+        ordinal = dt.toordinal()
+        i = bisect_right(self.firsts, ordinal) - 1
+        return i >= 0 and ordinal <= self.lasts[i]
+
+    def subtract(self, datetimes):
+        """
+        returns the dates (or datetimes) in the sorted sequence ``datetimes`` that aren't excluded,
+        walking the dates and the ranges together.
+        """
+        if not self.firsts:
+            return list(datetimes)
+        firsts, lasts = self.firsts, self.lasts
+        n = len(firsts)
+        i = 0
+        result = []
+        for dt in datetimes:
+            ordinal = dt.toordinal()
+            while i < n and lasts[i] < ordinal:
+                i += 1
+            if i == n or ordinal < firsts[i]:
+                result.append(dt)
+        return result
+
+NO_EXCLUSIONS = CompiledExclusions()
+
+def compile_calendars(versions):
+    """
+    Takes a dictionary of calendar versions, keyed by ExclusionCalendar pk, and returns a dictionary
+    of CompiledExclusions, keyed the same way. Compiled calendars are shared via the process-wide
+    cache; the ones that aren't there are compiled in one query.
+    """
+    result = {}
+    missing = []
+    for pk, version in versions.items():
+        compiled = rrule_cache.get(('exclusion-calendar', pk, version))
+        if compiled is None:
+            missing.append(pk)
+        else:
+            result[pk] = compiled
+    if missing:
+        ranges = dict([(pk, []) for pk in missing])
+        for calendar_id, start_date, end_date in ExcludedPeriod.objects.filter(
+                calendar__in=missing).values_list('calendar', 'start_date', 'end_date'):
+            ranges[calendar_id].append((start_date.toordinal(), (end_date or start_date).toordinal()))
+        for pk in missing:
+            result[pk] = CompiledExclusions(ranges[pk])
+            rrule_cache.set(('exclusion-calendar', pk, versions[pk]), result[pk])
+    return result
+
+def _calendar_rows(model, objects):
+    """ (object pk, calendar pk, calendar version) for the calendars attached to some objects """
+    query_name = model._meta.get_field('exclusion_calendars').related_query_name()
+    return ExclusionCalendar.objects.filter(**{'%s__in' % query_name: objects}) \
+        .values_list(query_name, 'pk', 'version')
+
+def exclusions_for(generators):
+    """
+    Returns the CompiledExclusions of each of ``generators`` (the union of its calendars and its
+    event's), keyed by generator pk, in at most three queries. Every generator has an entry.
+    """
+    result = dict([(generator.pk, NO_EXCLUSIONS) for generator in generators])
+    if not result:
+        return result
+    GeneratorModel = generators[0].__class__
+    EventModel = GeneratorModel._meta.get_field('event').rel.to
+    calendars = dict([(generator.pk, set()) for generator in generators])
+    versions = {}
+    for generator_id, pk, version in _calendar_rows(GeneratorModel, calendars.keys()):
+        calendars[generator_id].add(pk)
+        versions[pk] = version
+    by_event = {}
+    for event_id, pk, version in _calendar_rows(EventModel, set([g.event_id for g in generators])):
+        by_event.setdefault(event_id, set()).add(pk)
+        versions[pk] = version
+    if not versions:
+        return result
+    compiled = compile_calendars(versions)
+    for generator in generators:
+        pks = calendars[generator.pk] | by_event.get(generator.event_id, set())
+        if pks:
+            result[generator.pk] = CompiledExclusions.union([compiled[pk] for pk in sorted(pks)])
+    return result
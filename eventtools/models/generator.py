@@ -198,10 +198,11 @@ class GeneratorModel(models.Model):
         duration = self.event_duration()
         
         if start_shift or end_shift:
-            for o in self.occurrences.all():
-                o.start += start_shift
-                o.end = o.start + duration
-                o.save()
+            # set-based, ends first since they are calculated from the old starts
+            occurrences = self.occurrences.all()
+            occurrences.update(end=models.F('start') + (start_shift + duration))
+            return occurrences.update(start=models.F('start') + start_shift)
+        return 0
 
     
     @transaction.commit_on_success()
@@ -229,7 +230,12 @@ class GeneratorModel(models.Model):
         the generator.
         """
         
-        all_occurrences = self.event.occurrences.all() #regardless of generator
+        # the event's occurrences (regardless of generator) and exclusions by
+        # start, found once rather than with a query for each candidate
+        existing = {}
+        for o in self.event.occurrences.all():
+            existing.setdefault(o.start, o)
+        excluded = set(self.event.exclusions.values_list('start', flat=True))
         unaccounted_for = set(self.occurrences.all())
         
         event_duration = self.event_duration()
@@ -243,25 +249,20 @@ class GeneratorModel(models.Model):
             #           remove it from the set of unaccounted_for
             #           occurrences so it stays hooked up
             
-            try:
-                o = all_occurrences.filter(start=start)[0]
-                if o.generated_by == self:
+            o = existing.get(start)
+            if o is not None:
+                if o.generated_by_id == self.pk:
                     if not o.is_exclusion():
                         unaccounted_for.discard(o)
                 continue
-            except IndexError:
-                # no occurrence exists yet.
-                pass
 
             # if the proposed occurrence is an exclusion, don't save it.
-            if self.event.exclusions.filter(
-                event=self.event, start=start
-            ).count():
-                continue            
+            if start in excluded:
+                continue
 
             #OK, we're good to go.
             end = start + event_duration
-            o = self.occurrences.create(event=self.event, start=start, end=end)
+            existing[start] = self.occurrences.create(event=self.event, start=start, end=end)
             #implied generated_by = self
     
         # Finally, unhook any unaccounted_for occurrences
@@ -0,0 +1,375 @@
+# −*− coding: UTF−8 −*−
+import datetime
+from django.db import models, transaction
+from django.db.models import F, Q, signals
+from eventtools.conf.settings import MATERIALIZED_OCCURRENCES_HORIZON
+from eventtools.vectorized import expand
+from rules import Rule
+from occurrences import VirtualOccurrence
+from exclusions import ExclusionCalendar, ExcludedPeriod, exclusions_for
+
+"""
+Normally occurrences are generated from the rules every time they are asked for. If you set
+`materialize_occurrences = True` on your EventBase subclass (say it's called Lecture), EventModelBase
+also injects a LectureMaterializedOccurrence model: a table with one row per occurrence, exceptional or
+not, with the start and end datetimes denormalized and indexed.
+
+The table is kept in sync as generators and exceptional occurrences are saved: a generator is only
+rematerialized if its times, rule or repeat_until have changed, from the first start the change can
+affect, and only the rows that differ are deleted and inserted. Saving a rule doesn't rebuild its
+generators in the request: they are marked stale (their materialized_until is cleared) and rebuilt
+by refresh_materialized. Generators that repeat for ever are only materialized up to a rolling
+horizon (MATERIALIZED_OCCURRENCES_HORIZON days from now); their materialized_until field records how
+far they have got. Reading never writes to the table, so as time passes, they need extending to the
+new horizon with refresh_materialized (or ``./manage.py refresh_materialized_occurrences``, say daily
+from cron).
+
+With the table in place, Lecture.objects.occurrences_between (and so between_days, on_day, etc.) is a
+single range query, as long as the table reaches the end of the range (otherwise the rules are expanded
+as usual). Lecture.objects.materialized_between returns the rows as a QuerySet, so they can be ordered
+and paginated in SQL:
+
+>>> rows = Lecture.objects.materialized_between(start, end)[20:40]
+>>> as_occurrences(rows)
+[<VirtualOccurrence ...>, ...]
+"""
+
+class MaterializedOccurrenceBase(models.Model):
+
+    # injected by EventModelBase:
+    # event = models.ForeignKey(somekindofEvent)
+    # generator = models.ForeignKey(somekindofOccurrenceGenerator)
+
+    # the id of the exceptional Occurrence this row was made from, if any
+    occurrence_id = models.IntegerField(null=True, blank=True)
+    unvaried_start = models.DateTimeField()
+    unvaried_end = models.DateTimeField()
+    start = models.DateTimeField(db_index=True)
+    end = models.DateTimeField(db_index=True)
+    cancelled = models.BooleanField(default=False)
+    hide_from_lists = models.BooleanField(default=False)
+    full = models.BooleanField(default=False)
+    varied_event_id = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+        ordering = ('start', 'generator', 'unvaried_start')
+        unique_together = ('generator', 'unvaried_start', 'unvaried_end')
+
+    def __unicode__(self):
+        return u"%s: %s-%s" % (self.event_id, self.start, self.end)
+
+def horizon():
+    """ how far ahead endless generators are materialized """
+    return datetime.datetime.now() + datetime.timedelta(days=MATERIALIZED_OCCURRENCES_HORIZON)
+
+def _extent(generator, until):
+    """
+    The datetime up to which the (unvaried) occurrences of ``generator`` need materializing to cover
+    ``until``.
+    """
+    end = generator.end_recurring_period
+    if end is not None and end <= until:
+        return end
+    return until
+
+def _occurrences(generator, after, until):
+    """
+    The occurrences of ``generator`` with unvaried starts after ``after`` (or from the generator's
+    start, if None) up to and including ``until``, with the exceptional ones swapped in.
+    """
+    first = after or generator.start
+    in_range = lambda d: (after is None or d > after) and d <= until
+    if generator.rule is not None:
+        starts = expand(generator.rule, generator.start, first, until)
+    else:
+        starts = [generator.start]
+    starts = exclusions_for([generator])[generator.pk].subtract(starts)
+    duration = generator.end - generator.start
+
+    fields = VirtualOccurrence.values_fields(generator.OccurrenceModel)
+    rows = generator.occurrences.filter(
+        unvaried_start_date__gte=first.date(), unvaried_start_date__lte=until.date()
+    ).values_list(*fields)
+    exceptions = {}
+    for row in rows:
+        occ = VirtualOccurrence.from_values(generator, row)
+        if in_range(occ.unvaried_start):
+            exceptions[(occ.unvaried_start, occ.unvaried_end)] = occ
+
+    occurrences = []
+    for start in starts:
+        if in_range(start):
+            end = start + duration
+            occurrences.append(exceptions.pop((start, end), None) or generator._create_occurrence(start, end))
+    # exceptions which the rule no longer generates are still shown, unless cancelled (see
+    # OccurrenceReplacer.get_additional_occurrences)
+    return occurrences + [occ for occ in exceptions.values() if not occ.cancelled]
+
+# how many rows are inserted a query, where bulk_create is available (Django 1.4+)
+BATCH_SIZE = 500
+
+_ROW_FIELDS = ('occurrence_id', 'unvaried_start', 'unvaried_end', 'start', 'end', 'cancelled',
+    'hide_from_lists', 'full', 'varied_event_id')
+
+def _row_values(occ):
+    """ the values of the materialized row of an occurrence, in the order of _ROW_FIELDS """
+    return (occ.id, occ.unvaried_start, occ.unvaried_end, occ.start, occ.end, occ.cancelled,
+        occ.hide_from_lists, occ.full, occ._varied_event_id)
+
+def _save_rows(generator, rows):
+    """ Inserts materialized rows (tuples of _row_values) for ``generator``. """
+    MaterializedModel = generator.materialized_occurrences.model
+    objects = [MaterializedModel(event_id=generator.event_id, generator=generator, **dict(zip(_ROW_FIELDS, row)))
+        for row in rows]
+    if hasattr(MaterializedModel.objects, 'bulk_create'):
+        for i in range(0, len(objects), BATCH_SIZE):
+            MaterializedModel.objects.bulk_create(objects[i:i + BATCH_SIZE])
+    else:
+        for obj in objects:
+            obj.save()
+
+def _replace_rows(generator, existing, occurrences):
+    """
+    Makes the materialized rows in ``existing`` (a queryset of them) those of ``occurrences``,
+    deleting and inserting only the rows that differ.
+    """
+    wanted = set([_row_values(occ) for occ in occurrences])
+    stale = []
+    for row in existing.values_list('pk', *_ROW_FIELDS):
+        if row[1:] in wanted:
+            wanted.discard(row[1:])
+        else:
+            stale.append(row[0])
+    for i in range(0, len(stale), BATCH_SIZE):
+        generator.materialized_occurrences.filter(pk__in=stale[i:i + BATCH_SIZE]).delete()
+    _save_rows(generator, list(wanted))
+
+def _set_materialized_until(generator, until):
+    generator.__class__.objects.filter(pk=generator.pk).update(materialized_until=until)
+    generator.materialized_until = until
+
+def materialize(generator, until=None, since=None):
+    """
+    (Re)builds the materialized occurrences of ``generator``, up to ``until`` (default: the horizon),
+    of the unvaried starts after ``since`` (default: all of them).
+    """
+    if until is None:
+        until = horizon()
+    extent = _extent(generator, until)
+    existing = generator.materialized_occurrences.all()
+    if since is not None:
+        existing = existing.filter(unvaried_start__gt=since)
+    _replace_rows(generator, existing, _occurrences(generator, since, extent))
+    _set_materialized_until(generator, extent)
+materialize = transaction.commit_on_success(materialize)
+
+def extend(generator, until=None):
+    """
+    Materializes any occurrences of ``generator`` between its materialized_until and ``until``
+    (default: the horizon).
+    """
+    if generator.materialized_until is None:
+        return materialize(generator, until)
+    if until is None:
+        until = horizon()
+    extent = _extent(generator, until)
+    if extent > generator.materialized_until:
+        _save_rows(generator, [_row_values(occ) for occ in
+            _occurrences(generator, generator.materialized_until, extent)])
+        _set_materialized_until(generator, extent)
+extend = transaction.commit_on_success(extend)
+
+def sync_occurrence(occurrence):
+    """
+    Rebuilds the materialized row for the unvaried start of an exceptional Occurrence that has just
+    been saved or deleted.
+    """
+    GeneratorModel = occurrence.__class__._meta.get_field('generator').rel.to
+    try:
+        # fetched afresh, for an up to date materialized_until
+        generator = GeneratorModel.objects.get(pk=occurrence.generator_id)
+    except GeneratorModel.DoesNotExist:
+        return # the occurrence is being deleted along with its generator
+    if generator.materialized_until is None or occurrence.unvaried_start > generator.materialized_until:
+        return # it will be picked up when the generator is extended
+    unvaried_start = occurrence.unvaried_start
+    existing = generator.materialized_occurrences.filter(
+        Q(unvaried_start=unvaried_start) | Q(occurrence_id=occurrence.pk))
+    occurrences = _occurrences(generator, unvaried_start - datetime.timedelta(microseconds=1), unvaried_start)
+    _replace_rows(generator, existing, occurrences)
+sync_occurrence = transaction.commit_on_success(sync_occurrence)
+
+def stale_generators(generators, end):
+    """
+    Filters a queryset of generators down to the ones whose materialized occurrences don't reach
+    ``end``.
+    """
+    return generators.filter(
+        Q(materialized_until__isnull=True) |
+        Q(materialized_until__lt=end) & (
+            Q(rule__isnull=False, repeat_until__isnull=True) | Q(repeat_until__gt=F('materialized_until'))
+        )
+    )
+
+def can_materialize(end):
+    return end <= horizon()
+
+def is_materialized(generators, end):
+    """ True if the materialized occurrences of a queryset of generators all reach ``end``. """
+    return not stale_generators(generators, end).exists()
+
+def refresh_materialized(GeneratorModel, until=None):
+    """
+    Extends the materialized occurrences of the generators of ``GeneratorModel`` that don't reach
+    ``until`` (default: the horizon). Returns how many were extended.
+    """
+    if until is None:
+        until = horizon()
+    refreshed = 0
+    for generator in stale_generators(GeneratorModel.objects.select_related('rule'), until):
+        extend(generator, until)
+        refreshed += 1
+    return refreshed
+
+def materialized_between(MaterializedModel, generators, start, end, hide_hidden=True):
+    """
+    Returns a QuerySet of the materialized occurrence rows between two datetimes for a queryset of
+    generators, ordered by start.
+
+    ``end`` must be within the horizon (see can_materialize), and the generators materialized up to
+    it (see is_materialized and refresh_materialized).
+    """
+    if not is_materialized(generators, end):
+        raise ValueError("Occurrences aren't materialized up to %s yet; see refresh_materialized." % end)
+    rows = MaterializedModel.objects.filter(generator__in=generators, start__lte=end, end__gte=start)
+    if hide_hidden:
+        rows = rows.filter(hide_from_lists=False)
+    return rows.order_by('start', 'generator', 'unvaried_start')
+
+def as_occurrences(rows):
+    """
+    Turns materialized occurrence rows into (Virtual)Occurrences, loading the generators (and their
+    events and rules) in one query.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    GeneratorModel = rows[0].__class__._meta.get_field('generator').rel.to
+    generators = GeneratorModel.objects.select_related('event', 'rule').in_bulk(
+        set([row.generator_id for row in rows]))
+    return [VirtualOccurrence(generators[row.generator_id], row.unvaried_start, row.unvaried_end,
+            id=row.occurrence_id, varied_start=row.start, varied_end=row.end,
+            cancelled=row.cancelled, hide_from_lists=row.hide_from_lists, full=row.full,
+            varied_event_id=row.varied_event_id)
+        for row in rows]
+
+# Keeping the table in sync
+
+_materialized_generator_models = []
+
+# the fields of a generator that its occurrences depend on (with the rule's, and the exceptions')
+_SCHEDULE_FIELDS = ('first_start_date', 'first_start_time', 'first_end_date', 'first_end_time', 'rule',
+    'repeat_until')
+
+_UNCHANGED = object()
+
+def _schedule(generator):
+    return (generator.first_start_date, generator.first_start_time, generator.first_end_date,
+        generator.first_end_time, generator.rule_id, generator.repeat_until)
+
+def _changed_since(old, new):
+    """
+    The unvaried start after which the occurrences of a generator can have changed, when its schedule
+    goes from ``old`` to ``new``: None for all of them, or _UNCHANGED for none.
+    """
+    if old[:5] != new[:5]:
+        return None # its times or rule
+    old_until, new_until = old[5], new[5]
+    if old_until == new_until:
+        return _UNCHANGED
+    if old_until is None or new_until is None:
+        return old_until or new_until
+    return min(old_until, new_until)
+
+def _generator_saving(sender, instance, **kwargs):
+    if kwargs.get('raw') or instance.pk is None:
+        return
+    saved = list(sender.objects.filter(pk=instance.pk).values_list(*_SCHEDULE_FIELDS))
+    instance._saved_schedule = saved and saved[0] or None
+
+def _generator_saved(sender, instance, created=False, **kwargs):
+    if kwargs.get('raw'):
+        return
+    saved, instance._saved_schedule = getattr(instance, '_saved_schedule', None), None
+    if created or saved is None or instance.materialized_until is None:
+        materialize(instance)
+        return
+    since = _changed_since(saved, _schedule(instance))
+    if since is not _UNCHANGED:
+        materialize(instance, since=since)
+
+def _occurrence_changed(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        sync_occurrence(instance)
+
+def _rule_saving(sender, instance, **kwargs):
+    if kwargs.get('raw') or instance.pk is None:
+        return
+    saved = list(Rule.objects.filter(pk=instance.pk).values_list('frequency', 'params', 'complex_rule'))
+    instance._saved_fingerprint = saved and saved[0] or None
+
+def _rule_saved(sender, instance, created=False, **kwargs):
+    """
+    Marks the generators of a rule whose occurrences have changed as stale, for refresh_materialized
+    to rebuild (they are expanded as usual until then), rather than rebuilding them all now.
+    """
+    if kwargs.get('raw') or created:
+        return
+    saved, instance._saved_fingerprint = getattr(instance, '_saved_fingerprint', None), None
+    if saved == (instance.frequency, instance.params, instance.complex_rule):
+        return
+    for GeneratorModel in _materialized_generator_models:
+        GeneratorModel.objects.filter(rule=instance).update(materialized_until=None)
+
+def _materialize_calendar_users(calendar_id):
+    for GeneratorModel in _materialized_generator_models:
+        for generator in GeneratorModel.objects.filter(
+            Q(exclusion_calendars=calendar_id) | Q(event__exclusion_calendars=calendar_id)
+        ).distinct():
+            materialize(generator)
+
+def _excluded_period_changed(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        _materialize_calendar_users(instance.calendar_id)
+
+def _calendars_changed(sender, instance, action, **kwargs):
+    """ exclusion calendars were attached to (or detached from) an event or a generator """
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, ExclusionCalendar):
+        _materialize_calendar_users(instance.pk)
+    elif hasattr(instance, 'generators'):
+        for generator in instance.generators.all():
+            materialize(generator)
+    else:
+        materialize(instance)
+
+def connect_materialized_signals(generator_class, occurrence_class):
+    """ Called by EventModelBase for event models with materialize_occurrences = True. """
+    _materialized_generator_models.append(generator_class)
+    uid = "%s.%s" % (generator_class.__module__, generator_class.__name__)
+    signals.pre_save.connect(_generator_saving, sender=generator_class, dispatch_uid="materialize_saving_generator.%s" % uid)
+    signals.post_save.connect(_generator_saved, sender=generator_class, dispatch_uid="materialize_generator.%s" % uid)
+    signals.post_save.connect(_occurrence_changed, sender=occurrence_class, dispatch_uid="materialize_saved_occurrence.%s" % uid)
+    signals.post_delete.connect(_occurrence_changed, sender=occurrence_class, dispatch_uid="materialize_deleted_occurrence.%s" % uid)
+    if hasattr(signals, 'm2m_changed'): # Django 1.2+
+        event_class = generator_class._meta.get_field('event').rel.to
+        for model in (generator_class, event_class):
+            signals.m2m_changed.connect(_calendars_changed, sender=model.exclusion_calendars.through,
+                dispatch_uid="materialize_calendars.%s.%s" % (model.__module__, model.__name__))
+
+signals.pre_save.connect(_rule_saving, sender=Rule, dispatch_uid="materialize_saving_rule")
+signals.post_save.connect(_rule_saved, sender=Rule, dispatch_uid="materialize_rule")
+signals.post_save.connect(_excluded_period_changed, sender=ExcludedPeriod, dispatch_uid="materialize_saved_excluded_period")
+signals.post_delete.connect(_excluded_period_changed, sender=ExcludedPeriod, dispatch_uid="materialize_deleted_excluded_period")
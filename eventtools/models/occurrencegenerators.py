@@ -2,12 +2,25 @@
 from dateutil import rrule
 from django.db.models.base import ModelBase
 from django.core.exceptions import ValidationError
-from eventtools.utils import OccurrenceReplacer
+from eventtools.utils import OccurrenceReplacer, merge_occurrences
+from eventtools.rrule_cache import get_rrule, invalidate_rule
+from eventtools.vectorized import expand, expand_batch
+from eventtools import fastforward
+from eventtools.counting import count_occurrences, last_start
+from eventtools.bulk import bulk_occurrences_between
+from eventtools.cursors import encode_cursor, decode_cursor, resume_from, after_position
+from eventtools.spans import generator_spans
+from eventtools.memo import current_memo, forget_exceptions, memoized_expand, memoized_expand_batch
+from eventtools.masks import generator_masks, window_masks, matching_values, ALL_WEEKDAYS, ALL_TIMES
 import datetime
+from itertools import islice
 from django.template.defaultfilters import date as date_filter
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Count, Min, Max, signals
 from django.utils.translation import ugettext, ugettext_lazy as _
 from rules import Rule
+from occurrences import VirtualOccurrence
+from exclusions import ExclusionCalendar, exclusions_for
 from utils import datetimeify
 import string
 
@@ -34,9 +47,233 @@ You might want to edit an occurrence if it's an exception to the 'norm'. For exa
 See occurrences.py for details.
 """
 
-class OccurrenceGeneratorManager(models.Manager):
+def _exceptions_window_q(start, end):
+    """
+    A filter for the exceptional Occurrences that can affect the occurrences between two datetimes:
+    those whose unvaried or varied dates overlap the dates of the range.
+    """
+    start_day, end_day = start.date(), end.date()
+    unvaried = models.Q(unvaried_start_date__lte=end_day) & (
+        models.Q(unvaried_end_date__gte=start_day) |
+        models.Q(unvaried_end_date__isnull=True, unvaried_start_date__gte=start_day))
+    varied = models.Q(varied_start_date__lte=end_day) & (
+        models.Q(varied_end_date__gte=start_day) |
+        models.Q(varied_end_date__isnull=True, varied_start_date__gte=start_day))
+    return unvaried | varied
+
+def _exceptions_after_q(after):
+    """
+    A filter for the exceptional Occurrences that can affect the occurrences after a datetime.
+    """
+    day = after.date()
+    return models.Q(unvaried_end_date__gte=day) | \
+        models.Q(unvaried_end_date__isnull=True, unvaried_start_date__gte=day) | \
+        models.Q(varied_end_date__gte=day) | \
+        models.Q(varied_end_date__isnull=True, varied_start_date__gte=day)
+
+def _exception_stats(OccurrenceModel, generator_id):
+    """
+    Counts the exceptional Occurrences of a generator and finds the range of dates they span, varied
+    or unvaried, in one query. Returns the values of the generator's exception counter fields.
+    """
+    stats = OccurrenceModel.objects.filter(generator=generator_id).aggregate(
+        count=Count('pk'),
+        first_unvaried=Min('unvaried_start_date'), first_varied=Min('varied_start_date'),
+        last_unvaried_start=Max('unvaried_start_date'), last_unvaried_end=Max('unvaried_end_date'),
+        last_varied_start=Max('varied_start_date'), last_varied_end=Max('varied_end_date'),
+    )
+    firsts = [d for d in (stats['first_unvaried'], stats['first_varied']) if d is not None]
+    lasts = [d for d in (stats['last_unvaried_start'], stats['last_unvaried_end'],
+        stats['last_varied_start'], stats['last_varied_end']) if d is not None]
+    return {
+        'exception_count': stats['count'],
+        'exceptions_first_date': firsts and min(firsts) or None,
+        'exceptions_last_date': lasts and max(lasts) or None,
+    }
+
+def _tracking_q():
+    """
+    A filter for the Occurrences whose varied times are the same as their unvaried times.
+    """
+    return models.Q(varied_start_date=F('unvaried_start_date'), varied_start_time=F('unvaried_start_time')) & \
+        (models.Q(varied_end_date=F('unvaried_end_date')) | models.Q(varied_end_date__isnull=True, unvaried_end_date__isnull=True)) & \
+        (models.Q(varied_end_time=F('unvaried_end_time')) | models.Q(varied_end_time__isnull=True, unvaried_end_time__isnull=True))
+
+def _shift_time(t, shift):
+    """
+    returns (days, time): the number of days a datetime at time of day ``t`` moves by, and the time
+    of day it ends up at, when it is shifted by the timedelta ``shift``.
+    """
+    day = datetime.date(2000, 1, 1)
+    shifted = datetime.datetime.combine(day, t) + shift
+    return (shifted.date() - day).days, shifted.time()
+
+def _add_days(field, days):
+    if days:
+        return F(field) + datetime.timedelta(days=days)
+    return F(field)
+
+def _update_in_chunks(queryset, pks, chunk_size=500, **values):
+    # (some databases limit the number of parameters in a query)
+    for i in range(0, len(pks), chunk_size):
+        queryset.filter(pk__in=pks[i:i + chunk_size]).update(**values)
+
+def _effective_end_q(after):
+    """
+    A filter for the generators that can have occurrences ending after a datetime.
+    """
+    # generators that haven't been saved since effective_end was added fall back to repeat_until
+    return models.Q(effective_end__gte=after) | models.Q(effective_end__isnull=True) & (
+        models.Q(repeat_until__isnull=True) | models.Q(repeat_until__gte=after))
+
+def _masks_q(start, end):
+    """
+    A filter for the generators whose weekday and time-of-day masks (see eventtools.masks) allow
+    occurrences between two datetimes, or None if every generator's do.
+    """
+    weekday_mask, time_mask = window_masks(start, end)
+    q = None
+    for field, mask, all_bits in (('weekday_mask', weekday_mask, ALL_WEEKDAYS), ('time_mask', time_mask, ALL_TIMES)):
+        values = matching_values(mask, all_bits)
+        if values is not None:
+            # generators that haven't been saved since the masks were added have NULLs
+            field_q = models.Q(**{'%s__in' % field: values}) | models.Q(**{'%s__isnull' % field: True})
+            q = q is None and field_q or q & field_q
+    return q
+
+def exceptions_between(generators, start, end):
+    """
+    Loads the exceptional Occurrences (as VirtualOccurrences) of all of ``generators`` that can affect
+    the occurrences between two datetimes, in one query.
+    
+    Returns a dictionary of lists of occurrences, keyed by generator pk. Every generator has an entry.
+    """
+    return _load_exceptions(generators, _exceptions_window_q(start, end), start, end)
+
+def exceptions_after(generators, after):
+    """
+    As exceptions_between, for the occurrences after a datetime.
+    """
+    return _load_exceptions(generators, _exceptions_after_q(after), after)
+
+def expand_generators(generators, start, end, hide_hidden=True, exclusions=None):
+    """
+    Returns the Occurrences of a list of generators (with their rules) between two datetimes, sorted.
+    The rules are expanded in one go, and the exceptional Occurrences loaded in one query.
+    ``exclusions`` (see exclusions_for) can be given, if the same generators are expanded over
+    several windows.
+    """
+    starts = memoized_expand_batch([
+        (generator.pk, generator.rule, generator.start) + generator._expansion_window(start, end)
+        for generator in generators if generator.rule is not None
+    ], expand_batch)
+    exceptions = exceptions_between(generators, start, end)
+    if exclusions is None:
+        exclusions = exclusions_for(generators)
+    
+    occurrences = []
+    for generator in generators:
+        occurrences += generator.get_occurrences(start, end, hide_hidden,
+            starts=starts.get(generator.pk), exceptional_occurrences=exceptions[generator.pk],
+            exclusions=exclusions[generator.pk])
+    return sorted(occurrences)
+
+class ExceptionWindows(object):
+    """
+    The exceptional Occurrences of some generators after a datetime, loaded a window at a time (for
+    all of the generators, in one query) as streams of their occurrences reach each window, rather
+    than for all time up front. The windows double in length, from FIRST_WINDOW, so a stream that
+    runs on for years only takes a few queries.
+    """
+    FIRST_WINDOW = datetime.timedelta(days=7)
+
+    def __init__(self, generators, after):
+        self.generators = generators
+        self._bounds = [after]
+        self._loaded = [] # for each window loaded so far, the exceptions keyed by generator pk
+
+    def bounds(self, i):
+        """ the (start, end) of window ``i``; the end is None for the last window """
+        while len(self._bounds) <= i + 1:
+            last = self._bounds[-1]
+            if last is None:
+                self._bounds.append(None)
+                continue
+            try:
+                self._bounds.append(last + self.FIRST_WINDOW * 2 ** (len(self._bounds) - 1))
+            except OverflowError:
+                self._bounds.append(None)
+        return self._bounds[i], self._bounds[i + 1]
+
+    def exceptions(self, generator, i):
+        """ the exceptional Occurrences of ``generator`` that can affect its occurrences in window ``i`` """
+        while len(self._loaded) <= i:
+            start, end = self.bounds(len(self._loaded))
+            if end is None:
+                q = _exceptions_after_q(start)
+            else:
+                q = _exceptions_window_q(start, end)
+            self._loaded.append(_load_exceptions(self.generators, q, start, end))
+        return self._loaded[i].get(generator.pk, [])
+
+def exceptions_of(generators):
+    """
+    As exceptions_between, for all of the exceptional Occurrences.
+    """
+    return _load_exceptions(generators, models.Q())
+
+def _load_exceptions(generators, q, start=None, end=None):
+    result = dict([(generator.pk, []) for generator in generators])
+    # the generators' exception counters say which can have any in the window
+    by_pk = dict([(generator.pk, generator) for generator in generators
+        if generator._may_have_exceptions(start, end)])
+    # and the request's memo may have loaded some for a window that covers it (see eventtools.memo)
+    memo = current_memo()
+    if memo is not None:
+        for pk in list(by_pk):
+            rows = memo.get_exception_rows(by_pk[pk], start, end)
+            if rows is not None:
+                result[pk] = [VirtualOccurrence.from_values(by_pk.pop(pk), row) for row in rows]
+    if not by_pk:
+        return result
+    OccurrenceModel = by_pk.values()[0].OccurrenceModel
+    fields = VirtualOccurrence.values_fields(OccurrenceModel)
+    rows = OccurrenceModel.objects.filter(generator__in=by_pk.keys()) \
+        .filter(q) \
+        .values_list('generator', *fields)
+    loaded = dict([(pk, []) for pk in by_pk])
+    for row in rows:
+        loaded[row[0]].append(row[1:])
+    for pk, generator_rows in loaded.items():
+        generator = by_pk[pk]
+        result[pk] = [VirtualOccurrence.from_values(generator, row) for row in generator_rows]
+        if memo is not None:
+            memo.set_exception_rows(generator, start, end, generator_rows)
+    return result
+
+class OccurrenceGeneratorQuerySet(models.query.QuerySet):
+    
+    def potentially_between(self, start, end):
+        """
+        Filters down to the generators that can produce occurrences between two datetimes, in SQL, with
+        their rules and events fetched in the same query.
         
-    def occurrences_between(self, start, end):
+        Relevant generators have the first_start_date before the requested end date AND their
+        effective_end is NULL (endless) or after the requested start date. For windows shorter than
+        a week, their weekday and time-of-day masks must also allow occurrences in the window (see
+        eventtools.masks). Generators with exceptional occurrences in the window are relevant
+        whatever their dates and masks.
+        """
+        q = models.Q(first_start_date__lte=end.date()) & _effective_end_q(start)
+        masks_q = _masks_q(start, end)
+        if masks_q is not None:
+            q &= masks_q
+        # exceptional Occurrences can have been moved into the window from any date or time
+        OccurrenceModel = models.get_model(self.model._meta.app_label, self.model._occurrence_model_name)
+        moved = OccurrenceModel.objects.filter(_exceptions_window_q(start, end)).values('generator')
+        return self.filter(q | models.Q(pk__in=moved)).select_related('rule', 'event')
+        
+    def occurrences_between(self, start, end, hide_hidden=True):
         """
         Returns all Occurrences with a start_date/time between two datetimes, sorted. 
         
@@ -45,25 +282,134 @@ class OccurrenceGeneratorManager(models.Manager):
         
         Get all OccurrenceGenerators that have the potential to produce occurrences between these dates.
         Run 'em all, and grab the ones that are in range.
-            
-        TODO - make this a queryset function too!            
+        
+        The exceptional occurrences of all the generators are loaded in one query, so the number of
+        queries doesn't depend on the number of generators.
         """
         
         start = datetimeify(start, "start")
         end = datetimeify(end, 'end')    
         
-        # relevant generators have
-        # the first_start_date before the requested end date AND
-        # the end date is NULL or after the requested start date
-        potential_occurrence_generators = self.filter(first_start_date__lte=end) & (self.filter(repeat_until__isnull=True) | self.filter(repeat_until__gte=start))
+        #In case you are pondering returning a queryset, remember that potentially occurrences are not in the database, so no such QS exists.
         
-        occurrences = []
-        for generator in potential_occurrence_generators:
-            occurrences += generator.get_occurrences(start, end)
+        return expand_generators(list(self.potentially_between(start, end)), start, end, hide_hidden)
+
+    def live_between(self, start, end):
+        """
+        Filters down to the generators that can have occurrences between two datetimes, found with
+        the in-memory span index and rule checks rather than SQL (see eventtools.spans). For short
+        windows, like "now" or "the next hour": it is a query with a list of the pks.
+        """
+        pks = generator_spans(self.model).live_between(start, end)
+        # exceptional Occurrences can have been moved into the window from anywhere
+        OccurrenceModel = models.get_model(self.model._meta.app_label, self.model._occurrence_model_name)
+        pks.update(OccurrenceModel.objects.filter(_exceptions_window_q(start, end)).values_list('generator', flat=True))
+        return self.filter(pk__in=list(pks))
+
+    def occurrences_at(self, when=None, hide_hidden=True):
+        """
+        Returns the Occurrences that are happening at a datetime (default: now), sorted. Only the
+        generators that can be live then are loaded; see live_between.
+        """
+        if when is None:
+            when = datetime.datetime.now()
+        return self.live_between(when, when).occurrences_between(when, when, hide_hidden)
+
+    def occurrences_starting_between(self, start, end, hide_hidden=True):
+        """
+        Returns the Occurrences that start from ``start`` up to (but not including) ``end``, sorted.
+        Only the generators that can be live then are loaded; see live_between.
+        """
+        occurrences = self.live_between(start, end).occurrences_between(start, end, hide_hidden)
+        return [occurrence for occurrence in occurrences if start <= occurrence.start < end]
+
+    def occurrences_after(self, after=None, limit=None, offset=0, hide_hidden=True, cursor=None):
+        """
+        Returns an iterator of the Occurrences after a datetime (default: now), across all the
+        generators, in start order (then generator id, then unvaried start).
         
-        #In case you are pondering returning a queryset, remember that potentially occurrences are not in the database, so no such QS exists.
+        Nothing is expanded up front: each generator's occurrences are generated as the merged
+        stream reaches them, so taking the first few occurrences is cheap however many generators
+        there are. Use ``limit`` and ``offset`` (or just stop iterating) to page through them, or
+        pass a ``cursor`` (see eventtools.cursors, and occurrence_page) to resume the stream after
+        the end of an earlier page; ``after`` is then taken from the cursor.
+        """
+        position = None
+        if cursor is not None:
+            after, position = decode_cursor(cursor)
+        elif after is None:
+            after = datetime.datetime.now()
+        start = after
+        if position is not None:
+            # generate from the cursor's position rather than from the stream's start
+            start = resume_from(after, position)
+        # only the generators that haven't ended, or have had occurrences moved after the start
+        OccurrenceModel = models.get_model(self.model._meta.app_label, self.model._occurrence_model_name)
+        moved = OccurrenceModel.objects.filter(_exceptions_after_q(start)).values('generator')
+        generators = list(self.filter(_effective_end_q(start) | models.Q(pk__in=moved))
+            .select_related('rule', 'event').order_by('pk'))
+        windows = ExceptionWindows(generators, start)
+        exclusions = exclusions_for(generators)
+        occurrences = merge_occurrences([
+            generator.occurrences_after(start, hide_hidden, exclusions=exclusions[generator.pk],
+                exception_windows=windows)
+            for generator in generators
+        ])
+        if position is not None:
+            occurrences = after_position(occurrences, position)
+        if limit is not None:
+            return islice(occurrences, offset, offset + limit)
+        return islice(occurrences, offset, None)
+
+    def occurrence_page(self, limit, after=None, cursor=None, hide_hidden=True):
+        """
+        Returns a list of (up to) ``limit`` Occurrences after a datetime (default: now), or after the
+        ``cursor`` of the previous page, and the cursor of the next page (None after the last page).
+        """
+        if cursor is not None:
+            after = decode_cursor(cursor)[0]
+        elif after is None:
+            after = datetime.datetime.now()
+        # one more than asked for, to find out whether there is a next page
+        occurrences = list(self.occurrences_after(after, limit + 1, 0, hide_hidden, cursor))
+        if len(occurrences) <= limit:
+            return occurrences, None
+        occurrences = occurrences[:limit]
+        return occurrences, encode_cursor(after, occurrences[-1])
+
+    def bulk_occurrences_between(self, start, end, hide_hidden=True, workers=None, shard_size=500, slice_days=31):
+        """
+        Returns an iterator of compact occurrence rows between two datetimes, in start order,
+        expanded in shards by a pool of worker processes. For feeds and exports of very many
+        generators; see eventtools.bulk.
+        """
+        return bulk_occurrences_between(self, datetimeify(start, 'start'), datetimeify(end, 'end'),
+            hide_hidden, workers, shard_size, slice_days)
+
+class OccurrenceGeneratorManager(models.Manager):
+    def get_query_set(self): 
+        return OccurrenceGeneratorQuerySet(self.model)
         
-        return sorted(occurrences)
+    def occurrences_between(self, start, end, hide_hidden=True):
+        return self.get_query_set().occurrences_between(start, end, hide_hidden)
+    
+    def occurrences_after(self, after=None, limit=None, offset=0, hide_hidden=True, cursor=None):
+        return self.get_query_set().occurrences_after(after, limit, offset, hide_hidden, cursor)
+
+    def occurrence_page(self, limit, after=None, cursor=None, hide_hidden=True):
+        return self.get_query_set().occurrence_page(limit, after, cursor, hide_hidden)
+
+    def live_between(self, start, end):
+        return self.get_query_set().live_between(start, end)
+
+    def occurrences_at(self, when=None, hide_hidden=True):
+        return self.get_query_set().occurrences_at(when, hide_hidden)
+
+    def occurrences_starting_between(self, start, end, hide_hidden=True):
+        return self.get_query_set().occurrences_starting_between(start, end, hide_hidden)
+
+    def bulk_occurrences_between(self, start, end, hide_hidden=True, workers=None, shard_size=500, slice_days=31):
+        return self.get_query_set().bulk_occurrences_between(start, end, hide_hidden, workers, shard_size, slice_days)
 
 class OccurrenceGeneratorBase(models.Model):
     """
@@ -83,6 +429,20 @@ class OccurrenceGeneratorBase(models.Model):
     first_end_time = models.TimeField(_('end time of the first occurrence'), null = True, blank = True, help_text=_("if you leave this blank, the same time as Start Time is assumed."))
     rule = models.ForeignKey(Rule, verbose_name=_("repetition rule"), null = True, blank = True, help_text=_("Select '----' for a one-off event."))
     repeat_until = models.DateTimeField(null = True, blank = True, help_text=_("This date is ignored for one-off events."))
+    exclusion_calendars = models.ManyToManyField(ExclusionCalendar, verbose_name=_("exclusion calendars"), blank = True, help_text=_("Occurrences aren't generated on the dates in these calendars (or the event's)."))
+    # the end of the last occurrence (NULL if there isn't one), taking the rule's COUNT or UNTIL into
+    # account. Maintained by save(), for pruning generators in SQL.
+    effective_end = models.DateTimeField(null = True, blank = True, editable = False, db_index = True)
+    # the number of exceptional Occurrences, and the first and last dates (varied or unvaried) they
+    # touch. Maintained as Occurrences are saved and deleted, so that generators without exceptions
+    # (in a window) needn't be queried for them. NULL means not counted yet.
+    exception_count = models.PositiveIntegerField(null = True, blank = True, editable = False)
+    exceptions_first_date = models.DateField(null = True, blank = True, editable = False)
+    exceptions_last_date = models.DateField(null = True, blank = True, editable = False)
+    # the days of the week and the times of day that occurrences can be on, as bitmasks (see
+    # eventtools.masks). Maintained by save(), for prefiltering day and time-slot queries in SQL.
+    weekday_mask = models.PositiveSmallIntegerField(null = True, blank = True, editable = False)
+    time_mask = models.PositiveSmallIntegerField(null = True, blank = True, editable = False)
     
     _date_description = models.CharField(_("Description of occurrences"), blank=True, max_length=255, help_text=_("e.g. \"Every Tuesday in March 2010\". If this is ommitted, an automatic description will be attempted."))
     
@@ -151,16 +511,21 @@ class OccurrenceGeneratorBase(models.Model):
     OccurrenceModel = property(_occurrence_model)
      
     def _create_occurrence(self, start, end=None):
+        """
+        returns a (lightweight) generated occurrence. It becomes an Occurrence model instance when saved.
+        """
         if end is None:
             end = start + (self.end - self.start)
-        occ = self.OccurrenceModel(
-            generator=self,
-            unvaried_start_date=start.date(),
-            unvaried_start_time=start.time(),
-            unvaried_end_date=end.date(),
-            unvaried_end_time=end.time(),
-        )
-        return occ
+        return VirtualOccurrence(self, start, end)
+    
+    def _exceptional_occurrences(self, start=None, end=None):
+        """
+        returns this generator's exceptional Occurrences, loaded as VirtualOccurrences. If two datetimes
+        are given, only the ones that can affect the occurrences between them are loaded.
+        """
+        if start is not None:
+            return exceptions_between([self], start, end)[self.pk]
+        return exceptions_of([self])[self.pk]
  
     def _end_recurring_period(self):
         # if there's no repeat_until AND no rule, then just return your end date, or your start date
@@ -172,30 +537,90 @@ class OccurrenceGeneratorBase(models.Model):
         return self.repeat_until
     end_recurring_period = property(_end_recurring_period)
 
-    def _get_occurrence_list(self, start, end):
+    def _effective_end(self):
+        """
+        returns the end of the last occurrence this generator produces (not counting exceptions), or
+        None if it repeats for ever.
+        """
+        if self.rule is None:
+            return self.end
+        last = last_start(self.rule, self.start, self.repeat_until)
+        if last is None:
+            return None
+        return last + (self.end - self.start)
+
+    def _expansion_window(self, start, end):
+        """
+        returns the (start, end) range that the starts of unexceptional Occurrences must fall in,
+        for them to be between two datetimes, start and end.
+        """
+        if self.end_recurring_period and self.end_recurring_period < end:
+            end = self.end_recurring_period
+        return start - (self.end - self.start), end
+
+    def _may_have_exceptions(self, start=None, end=None):
+        """
+        returns False if the exception counters show that no exceptional Occurrence can affect the
+        occurrences between the datetimes ``start`` and ``end`` (either can be None, for no limit).
+        """
+        if self.exception_count is None:
+            return True # not counted yet
+        if self.exception_count == 0:
+            return False
+        if start is not None and self.exceptions_last_date < start.date():
+            return False
+        if end is not None and self.exceptions_first_date > end.date():
+            return False
+        return True
+
+    def update_exception_stats(self, commit=True):
+        """
+        recounts the exceptional Occurrences (see exception_count). This is done automatically when
+        Occurrences are saved or deleted.
+        """
+        stats = _exception_stats(self.OccurrenceModel, self.pk)
+        for field, value in stats.items():
+            setattr(self, field, value)
+        if commit:
+            self.__class__.objects.filter(pk=self.pk).update(**stats)
+
+    def get_exclusions(self):
+        """
+        returns the CompiledExclusions of this generator's exclusion calendars and its event's (see
+        exclusions.py).
+        """
+        return exclusions_for([self])[self.pk]
+
+    def _get_occurrence_list(self, start, end, starts=None, exclusions=None):
         """
         generates a list of *unexceptional* Occurrences for this event between two datetimes, start and end.
+        
+        ``starts`` can be given if the occurrence start datetimes have already been expanded (see
+        eventtools.vectorized.expand_batch), and ``exclusions`` if they have already been loaded (see
+        exclusions_for).
         """
         
+        if exclusions is None:
+            exclusions = self.get_exclusions()
         difference = (self.end - self.start)
         if self.rule is not None:
+            if starts is None:
+                window_start, window_end = self._expansion_window(start, end)
+                starts = memoized_expand(self.rule, self.start, window_start, window_end, expand)
+            starts = exclusions.subtract(starts)
             occurrences = []
-            if self.end_recurring_period and self.end_recurring_period < end:
-                end = self.end_recurring_period
-            rule = self.get_rrule_object()
-            o_starts = rule.between(start-difference, end, inc=True)
-            for o_start in o_starts:
+            for o_start in starts:
                 o_end = o_start + difference
                 occurrences.append(self._create_occurrence(o_start, o_end))
             return occurrences
         else:
             # check if event is in the period
-            if self.start <= end and self.end >= start:
+            if self.start <= end and self.end >= start and not exclusions.excludes(self.start):
                 return [self._create_occurrence(self.start)]
             else:
                 return []
                         
-    def _occurrences_after_generator(self, after=None):
+    def _occurrences_after_generator(self, after=None, exclusions=None):
         """
         returns a generator that produces unexceptional occurrences after the
         datetime ``after``. For ever, if necessary.
@@ -203,19 +628,21 @@ class OccurrenceGeneratorBase(models.Model):
 
         if after is None:
             after = datetime.datetime.now()
-        rule = self.get_rrule_object()
-        if rule is None:
-            if self.end > after:
+        if exclusions is None:
+            exclusions = self.get_exclusions()
+        if self.rule is None:
+            if self.end > after and not exclusions.excludes(self.start):
                 yield self._create_occurrence(self.start, self.end)
             raise StopIteration
-        date_iter = iter(rule)
         difference = self.end - self.start
+        # skip straight to the first occurrence that might end after ``after``
+        date_iter = fastforward.iter_from(self.rule, self.start, after - difference)
         while True:
             o_start = date_iter.next()
-            if o_start > self.end_recurring_period:
+            if self.end_recurring_period and o_start > self.end_recurring_period:
                 raise StopIteration
             o_end = o_start + difference
-            if o_end > after:
+            if o_end > after and not exclusions.excludes(o_start):
                 yield self._create_occurrence(o_start, o_end)
 
     # for backwards compatibility, we construct and deconstruct `start` and `end` datetimes.
@@ -248,18 +675,27 @@ class OccurrenceGeneratorBase(models.Model):
             
         return result
 	
-    def get_occurrences(self, start, end, hide_hidden=True):
+    def get_occurrences(self, start, end, hide_hidden=True, starts=None, exceptional_occurrences=None, exclusions=None):
         """
         returns a list of occurrences between the datetimes ``start`` and ``end``.
         Includes all of the exceptional Occurrences.
+        
+        ``exceptional_occurrences`` and ``exclusions`` can be given if they have already been loaded
+        (see exceptions_between and exclusions_for).
         """
         
         start = datetimeify(start)
         end = datetimeify(end)
         
-        exceptional_occurrences = self.occurrences.all()
+        if exceptional_occurrences is None:
+            if self._may_have_exceptions(start, end):
+                exceptional_occurrences = self._exceptional_occurrences(start, end)
+            else:
+                exceptional_occurrences = []
+        occurrences = self._get_occurrence_list(start, end, starts, exclusions)
+        if not exceptional_occurrences:
+            return occurrences
         occ_replacer = OccurrenceReplacer(exceptional_occurrences)
-        occurrences = self._get_occurrence_list(start, end)
         final_occurrences = []
         for occ in occurrences:
             # replace occurrences with their exceptional counterparts
@@ -282,6 +718,8 @@ class OccurrenceGeneratorBase(models.Model):
         """
         return ONLY a list of exceptional Occurrences.
         """
+        if self.exception_count == 0:
+            return []
         
         exceptional_occurrences = self.occurrences.all()
         changed_occurrences = []
@@ -297,6 +735,8 @@ class OccurrenceGeneratorBase(models.Model):
         """ return ``True`` if the generator has no repetition rule and the occurrence is hidden """
         if self.rule is not None:
             return False # if there is a repetition rule, this will always return False
+        if self.exception_count == 0:
+            return False
 
         exceptional_occurrences = self.occurrences.all()
         return exceptional_occurrences[0].hide_from_lists if exceptional_occurrences else False
@@ -306,28 +746,20 @@ class OccurrenceGeneratorBase(models.Model):
         """ return ``True`` if the generator has no repetition rule and the occurrence is cancelled """
         if self.rule is not None:
             return False # if there _is_ a repetition rule, this will always return False
+        if self.exception_count == 0:
+            return False
 
         exceptional_occurrences = self.occurrences.all()
         return exceptional_occurrences[0].cancelled if exceptional_occurrences else False
 
 
     def get_rrule_object(self):
+        """
+        Returns the recurrence object for this generator's rule, shared via the
+        process-wide cache in eventtools.rrule_cache. Don't modify it.
+        """
         if self.rule is not None:
-            if self.rule.complex_rule:
-                try:
-                    return rrule.rrulestr(str(self.rule.complex_rule),dtstart=self.start)
-                except:
-                    pass
-            params = self.rule.get_params()
-            frequency = 'rrule.%s' % self.rule.frequency
-            simple_rule = rrule.rrule(eval(frequency), dtstart=self.start, **params)
-            set = rrule.rruleset()
-            set.rrule(simple_rule)
-#             goodfriday = rrule.rrule(rrule.YEARLY, dtstart=self.start, byeaster=-2)
-#             christmas = rrule.rrule(rrule.YEARLY, dtstart=self.start, bymonth=12, bymonthday=25)
-#             set.exrule(goodfriday)
-#             set.exrule(christmas)
-            return set
+            return get_rrule(self.rule, self.start)
    
     def check_for_exceptions(self, occ):
         """
@@ -357,9 +789,8 @@ class OccurrenceGeneratorBase(models.Model):
     get_one_occurrence = get_first_occurrence
 
     def get_occurrence(self, date):
-        rule = self.get_rrule_object()
-        if rule:
-            next_occurrence = rule.after(date, inc=True)
+        if self.rule is not None:
+            next_occurrence = fastforward.after(self.rule, self.start, date, inc=True)
         else:
             next_occurrence = self.start
         if next_occurrence == date:
@@ -369,47 +800,211 @@ class OccurrenceGeneratorBase(models.Model):
                 return self._create_occurrence(next_occurrence)
         # import pdb; pdb.set_trace()
 
-    def occurrences_after(self, after=None):
+    def _generates(self, start, end, exclusions=None):
+        """
+        returns True if the rule (or the one-off) generates an occurrence with this start and end,
+        and it isn't excluded.
+        """
+        if end - start != self.end - self.start:
+            return False
+        if exclusions is not None and exclusions.excludes(start):
+            return False
+        if self.rule is None:
+            return start == self.start
+        if self.end_recurring_period and start > self.end_recurring_period:
+            return False
+        return fastforward.after(self.rule, self.start, start, inc=True) == start
+
+    def count_occurrences(self, exceptional_occurrences=None, exclusions=None):
         """
-        returns a generator that produces occurrences after the datetime
-        ``after``.	Includes all of the exceptional Occurrences.
+        returns the number of occurrences this generator produces, or None if it repeats for ever.
+        Hidden occurrences aren't counted.
         
-        TODO: this doesn't bring in occurrences that were originally outside this date range, but now fall within it (or vice versa).
+        The occurrences aren't generated: the rule's occurrences are counted arithmetically where
+        possible (see eventtools.counting), those on excluded dates are taken off, and the
+        exceptional Occurrences are then accounted for. ``exceptional_occurrences`` and
+        ``exclusions`` can be given if they have already been loaded (see exceptions_of and
+        exclusions_for).
         """
-        occ_replacer = OccurrenceReplacer(self.occurrence_set.all())
-        generator = self._occurrences_after_generator(after)
+        if exclusions is None:
+            exclusions = self.get_exclusions()
+        if self.rule is None:
+            count = 1
+            if exclusions.excludes(self.start):
+                count = 0
+        else:
+            count = count_occurrences(self.rule, self.start, self.repeat_until)
+            if count is None:
+                return None
+            for first, last in exclusions.ranges():
+                # (excluded periods are short, so expanding over them is cheap)
+                excluded_start = datetime.datetime.fromordinal(first)
+                excluded_end = datetime.datetime.fromordinal(last + 1) - datetime.timedelta(microseconds=1)
+                if self.repeat_until and self.repeat_until < excluded_end:
+                    excluded_end = self.repeat_until
+                if excluded_start <= excluded_end:
+                    count -= len(fastforward.between(self.rule, self.start, excluded_start, excluded_end))
+        if exceptional_occurrences is None:
+            exceptional_occurrences = self._exceptional_occurrences()
+        for occ in exceptional_occurrences:
+            if self._generates(occ.unvaried_start, occ.unvaried_end, exclusions):
+                if occ.hide_from_lists:
+                    count -= 1
+            elif not occ.cancelled:
+                # an exception the rule no longer generates is shown anyway
+                count += 1
+        return count
+
+    def occurrences_after(self, after=None, hide_hidden=True, exceptional_occurrences=None, exclusions=None,
+        exception_windows=None):
+        """
+        returns a generator that produces occurrences after the datetime ``after``, in start order.
+        Includes all of the exceptional Occurrences, wherever they have been moved from or to.
+        
+        The generated occurrences are merged with the exceptional Occurrences, sorted by their
+        (varied) start. Generated occurrences that have an exception are skipped, so an occurrence
+        that has been moved comes out at its new time, and one moved from before ``after`` to after
+        it is included.
+        
+        The exceptional Occurrences are loaded a window at a time, as the stream reaches it (see
+        ExceptionWindows; ``exception_windows`` can be shared by the streams of many generators).
+        ``exceptional_occurrences`` (all of them after ``after``; see exceptions_after) and
+        ``exclusions`` (see exclusions_for) can be given instead, if they have already been loaded.
+        """
+        if after is None:
+            after = datetime.datetime.now()
+        if exclusions is None:
+            exclusions = self.get_exclusions()
+        if exceptional_occurrences is not None:
+            windows = lambda i: ((after, None), exceptional_occurrences)
+        else:
+            if exception_windows is None:
+                exception_windows = ExceptionWindows([self], after)
+            windows = lambda i: (exception_windows.bounds(i), exception_windows.exceptions(self, i))
+        # (occurrences moved to the same start are ordered by their unvaried start, for cursors)
+        order = lambda occ: (occ.start, occ.unvaried_start)
+        
+        generated = self._occurrences_after_generator(after, exclusions)
+        pending = [next(generated, None)]
+        replaced = set()
+        
+        def generated_before(end):
+            while pending[0] is not None and (end is None or pending[0].start < end):
+                occ, pending[0] = pending[0], next(generated, None)
+                if (occ.unvaried_start, occ.unvaried_end) not in replaced:
+                    yield occ
+        
+        i = 0
         while True:
-            next = generator.next()
-            yield occ_replacer.get_occurrence(next)
+            (window_start, window_end), loaded = windows(i)
+            replaced.update([(occ.unvaried_start, occ.unvaried_end) for occ in loaded])
+            # each exception comes out in the window it starts in (or the first, if it starts before it)
+            exceptions = [occ for occ in loaded if occ.end > after and
+                (i == 0 or occ.start >= window_start) and (window_end is None or occ.start < window_end) and
+                # (as in get_occurrences, cancelled exceptions the rule no longer generates are dropped)
+                not (occ.cancelled and not self._generates(occ.unvaried_start, occ.unvaried_end, exclusions))]
+            exceptions.sort(key=order)
+            for occ in merge_occurrences([generated_before(window_end), exceptions], order):
+                if not (hide_hidden and occ.hide_from_lists):
+                    yield occ
+            if window_end is None or pending[0] is None and not self._may_have_exceptions(window_end):
+                return
+            i += 1
+            
+    def shift_occurrences(self, start_shift, end_shift):
+        """
+        Shifts the unvaried times of the persisted Occurrences by ``start_shift`` and ``end_shift``.
+        Occurrences that are still using the generator's times (their varied times are the unvaried
+        ones) are moved too; the varied times of the others are left alone.
+        
+        This is done with a few UPDATE statements per distinct time of day, without loading any
+        Occurrences. Returns the number of Occurrences shifted.
+        """
+        occurrences = self.occurrences.all()
+        rows = list(occurrences.values_list('pk', 'unvaried_start_time', 'unvaried_end_date', 'unvaried_end_time'))
+        if not rows:
+            return 0
+        tracking = list(occurrences.filter(_tracking_q()).values_list('pk', flat=True))
+        
+        starts, ends = {}, {}
+        for pk, start_time, end_date, end_time in rows:
+            starts.setdefault(start_time, []).append(pk)
+            # if omitted, the end date and time are the start's
+            ends.setdefault((end_date is None, end_time or start_time), []).append(pk)
+        
+        # ends first, since they may be calculated from the (unshifted) start date
+        for (no_end_date, end_time), pks in ends.items():
+            days, new_time = _shift_time(end_time, end_shift)
+            end_date = _add_days(no_end_date and 'unvaried_start_date' or 'unvaried_end_date', days)
+            _update_in_chunks(occurrences, pks, unvaried_end_date=end_date, unvaried_end_time=new_time)
+        for start_time, pks in starts.items():
+            days, new_time = _shift_time(start_time, start_shift)
+            _update_in_chunks(occurrences, pks, unvaried_start_date=_add_days('unvaried_start_date', days),
+                unvaried_start_time=new_time)
+        # and the occurrences that were tracking the generator's times still are
+        _update_in_chunks(occurrences, tracking,
+            varied_start_date=F('unvaried_start_date'), varied_start_time=F('unvaried_start_time'),
+            varied_end_date=F('unvaried_end_date'), varied_end_time=F('unvaried_end_time'))
+        return len(rows)
+    shift_occurrences = transaction.commit_on_success(shift_occurrences)
             
     def save(self, *args, **kwargs):
         # if the occurrence generator changes, we must not break the link with persisted occurrences
         if self.id: # must already exist
             saved_self = self.__class__.objects.get(pk=self.id)
+            if saved_self.rule_id is not None:
+                # the compiled rrule for the old start is no use to anyone now
+                invalidate_rule(saved_self.rule_id, saved_self.start)
             if self.first_start_date != saved_self.first_start_date or \
                 self.first_start_time != saved_self.first_start_time or \
                 self.first_end_date != saved_self.first_end_date or \
                 self.first_end_time != saved_self.first_end_time: # have any of the times changed in the generator?
                 # something has changed, so let's figure out the timeshifts for the generator
-                start_shift = self.start - saved_self.start
-                end_shift = self.end - saved_self.end
-                for occ in self.occurrences.all(): # only persisted occurrences of course
-                    if occ.start == occ.original_start and occ.end == occ.original_end: # is this occurrence tracking the generator's times?
-                        # It is still using the generator's times, so we better shift it
-                        varied_start = datetime.datetime.combine(occ.varied_start_date, occ.varied_start_time) + start_shift
-                        varied_end = datetime.datetime.combine(occ.varied_end_date, occ.varied_end_time) + end_shift
-                        occ.varied_start_date = varied_start.date()
-                        occ.varied_start_time = varied_start.time()
-                        occ.varied_end_date = varied_end.date()
-                        occ.varied_end_time = varied_end.time()
-                    # and then apply the new 'unvaried' times
-                    unvaried_start = datetime.datetime.combine(occ.unvaried_start_date, occ.unvaried_start_time) + start_shift
-                    unvaried_end = datetime.datetime.combine(occ.unvaried_end_date, occ.unvaried_end_time) + end_shift
-                    occ.unvaried_start_date = unvaried_start.date()
-                    occ.unvaried_start_time = unvaried_start.time()
-                    occ.unvaried_end_date = unvaried_end.date()
-                    occ.unvaried_end_time = unvaried_end.time()
-
-                    occ.save()
+                self.shift_occurrences(self.start - saved_self.start, self.end - saved_self.end)
+                forget_exceptions(self.__class__, self.id)
+        self.effective_end = self._effective_end()
+        self.weekday_mask, self.time_mask = generator_masks(self.rule, self.start, self.end)
+        if self.id:
+            # (this instance's counters may be out of date, and would overwrite the saved ones)
+            self.update_exception_stats(commit=False)
+        else:
+            self.exception_count = 0
         super(OccurrenceGeneratorBase, self).save(*args, **kwargs)
 
+def _update_effective_ends(sender, instance, **kwargs):
+    """
+    Keeps the effective_end and the masks of the generators that use a Rule up to date when it
+    changes.
+    """
+    if kwargs.get('raw'):
+        return
+    for related in Rule._meta.get_all_related_objects():
+        if issubclass(related.model, OccurrenceGeneratorBase):
+            for generator in related.model.objects.filter(rule=instance).select_related('rule'):
+                weekday_mask, time_mask = generator_masks(generator.rule, generator.start, generator.end)
+                related.model.objects.filter(pk=generator.pk).update(effective_end=generator._effective_end(),
+                    weekday_mask=weekday_mask, time_mask=time_mask)
+
+signals.post_save.connect(_update_effective_ends, sender=Rule, dispatch_uid="update_effective_ends")
+
+def _occurrence_changed(sender, instance, **kwargs):
+    """
+    Keeps the exception counters of an Occurrence's generator up to date (and those of the generator
+    instance it was saved with, if any).
+    """
+    if kwargs.get('raw'):
+        return
+    field = sender._meta.get_field('generator')
+    forget_exceptions(field.rel.to, instance.generator_id)
+    stats = _exception_stats(sender, instance.generator_id)
+    field.rel.to.objects.filter(pk=instance.generator_id).update(**stats)
+    generator = getattr(instance, field.get_cache_name(), None)
+    if generator is not None:
+        for name, value in stats.items():
+            setattr(generator, name, value)
+
+def connect_exception_stats_signals(occurrence_class):
+    """ Called by EventModelBase for each Occurrence model. """
+    uid = "%s.%s" % (occurrence_class.__module__, occurrence_class.__name__)
+    signals.post_save.connect(_occurrence_changed, sender=occurrence_class, dispatch_uid="exception_stats_saved.%s" % uid)
+    signals.post_delete.connect(_occurrence_changed, sender=occurrence_class, dispatch_uid="exception_stats_deleted.%s" % uid)
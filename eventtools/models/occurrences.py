@@ -280,3 +280,193 @@ class OccurrenceBase(models.Model):
         daystart = self.start.replace(hour=0, minute=0)
         occurrence_list = self.generator.event.get_occurrences(daystart, daystart + datetime.timedelta(1))
         return occurrence_list.index(self)
+
+
+class VirtualOccurrence(object):
+    """
+    A lightweight stand-in for an OccurrenceBase instance.
+    
+    Generators produce one of these for every occurrence they generate, since most of them are only
+    rendered and thrown away. They have the same public API as Occurrence models (start, end,
+    merged_event, cancelled, is_varied, etc.) but use __slots__ and keep datetimes rather than
+    separate date and time fields, so they take a fraction of the memory and time to create.
+    
+    Calling save() (or cancel(), uncancel()) turns the occurrence into a real model row. Exceptional
+    occurrences loaded with from_values() keep their id, so saving them updates the existing row.
+    """
+    
+    # __dict__ is only allocated if something (like a template tag) annotates the occurrence.
+    __slots__ = ('generator', 'id', 'unvaried_start', 'unvaried_end', 'varied_start', 'varied_end',
+        'cancelled', 'hide_from_lists', 'full', '_varied_event', '_varied_event_id', '__dict__')
+    
+    # the fields to give to values_list() for from_values()
+    VALUES_FIELDS = (
+        'id',
+        'unvaried_start_date', 'unvaried_start_time', 'unvaried_end_date', 'unvaried_end_time',
+        'varied_start_date', 'varied_start_time', 'varied_end_date', 'varied_end_time',
+        'cancelled', 'hide_from_lists', 'full',
+    )
+    
+    def __init__(self, generator, start, end, id=None, varied_start=None, varied_end=None,
+        cancelled=False, hide_from_lists=False, full=False, varied_event_id=None):
+        self.generator = generator
+        self.id = id
+        self.unvaried_start = start
+        self.unvaried_end = end
+        self.varied_start = varied_start or start
+        self.varied_end = varied_end or self.varied_start + (end - start)
+        self.cancelled = cancelled
+        self.hide_from_lists = hide_from_lists
+        self.full = full
+        self._varied_event = None
+        self._varied_event_id = varied_event_id
+    
+    @classmethod
+    def values_fields(cls, OccurrenceModel):
+        if _has_varied_event(OccurrenceModel):
+            return cls.VALUES_FIELDS + ('_varied_event',)
+        return cls.VALUES_FIELDS
+    
+    @classmethod
+    def from_values(cls, generator, row):
+        """
+        Builds an occurrence from a row of ``values_list(*VirtualOccurrence.values_fields(Model))``,
+        so exceptional occurrences can be loaded without instantiating models.
+        """
+        (id, us_date, us_time, ue_date, ue_time, vs_date, vs_time, ve_date, ve_time,
+            cancelled, hide_from_lists, full) = row[:12]
+        combine = datetime.datetime.combine
+        unvaried_start = combine(us_date, us_time)
+        unvaried_end = combine(ue_date or us_date, ue_time or us_time)
+        varied_start = varied_end = None
+        if vs_date and vs_time:
+            varied_start = combine(vs_date, vs_time)
+            varied_end = combine(ve_date or vs_date, ve_time or vs_time)
+        return cls(generator, unvaried_start, unvaried_end, id=id,
+            varied_start=varied_start, varied_end=varied_end,
+            cancelled=cancelled, hide_from_lists=hide_from_lists, full=full,
+            varied_event_id=(row[12] if len(row) > 12 else None))
+    
+    def _get_pk(self):
+        return self.id
+    pk = property(_get_pk)
+    
+    start = property(lambda self: self.varied_start)
+    end = property(lambda self: self.varied_end)
+    original_start = property(lambda self: self.unvaried_start)
+    original_end = property(lambda self: self.unvaried_end)
+    
+    # date/time accessors, to match the Occurrence model fields
+    unvaried_start_date = property(lambda self: self.unvaried_start.date())
+    unvaried_start_time = property(lambda self: self.unvaried_start.time())
+    unvaried_end_date = property(lambda self: self.unvaried_end.date())
+    unvaried_end_time = property(lambda self: self.unvaried_end.time())
+    
+    def _set_varied_start_date(self, value):
+        self.varied_start = datetime.datetime.combine(value, self.varied_start.time())
+    def _set_varied_start_time(self, value):
+        self.varied_start = datetime.datetime.combine(self.varied_start.date(), value)
+    def _set_varied_end_date(self, value):
+        self.varied_end = datetime.datetime.combine(value, self.varied_end.time())
+    def _set_varied_end_time(self, value):
+        self.varied_end = datetime.datetime.combine(self.varied_end.date(), value)
+    varied_start_date = start_date = property(lambda self: self.varied_start.date(), _set_varied_start_date)
+    varied_start_time = start_time = property(lambda self: self.varied_start.time(), _set_varied_start_time)
+    varied_end_date = end_date = property(lambda self: self.varied_end.date(), _set_varied_end_date)
+    varied_end_time = end_time = property(lambda self: self.varied_end.time(), _set_varied_end_time)
+    
+    def _get_varied_event(self):
+        if self._varied_event is None and self._varied_event_id is not None:
+            VariationModel = self.generator.OccurrenceModel._meta.get_field('_varied_event').rel.to
+            self._varied_event = VariationModel._default_manager.get(pk=self._varied_event_id)
+        return self._varied_event
+    def _set_varied_event(self, v):
+        if not _has_varied_event(self.generator.OccurrenceModel):
+            raise AttributeError("You can't set an event variation for an event class with no 'varied_by' attribute.")
+        self._varied_event = v
+        self._varied_event_id = getattr(v, 'pk', None)
+    varied_event = property(_get_varied_event, _set_varied_event)
+    
+    unvaried_event = property(lambda self: self.generator.event)
+    merged_event = property(lambda self: MergedObject(self.unvaried_event, self.varied_event))
+    
+    is_moved = property(lambda self: self.unvaried_start != self.varied_start or self.unvaried_end != self.varied_end)
+    is_varied = property(lambda self: self.is_moved or self.cancelled)
+    duration = property(lambda self: self.varied_end - self.varied_start)
+    
+    # the rest of the API is shared with the model
+    clean = OccurrenceBase.__dict__['clean']
+    humanized_duration = OccurrenceBase.__dict__['humanized_duration']
+    __unicode__ = OccurrenceBase.__dict__['__unicode__']
+    __cmp__ = OccurrenceBase.__dict__['__cmp__']
+    __eq__ = OccurrenceBase.__dict__['__eq__']
+    unvaried_range_string = OccurrenceBase.__dict__['unvaried_range_string']
+    varied_range_string = OccurrenceBase.__dict__['varied_range_string']
+    date_description = OccurrenceBase.__dict__['date_description']
+    as_icalendar = OccurrenceBase.__dict__['as_icalendar']
+    reason = OccurrenceBase.__dict__['reason']
+    generated_id = OccurrenceBase.__dict__['generated_id']
+    
+    def __hash__(self):
+        return hash((self.unvaried_start, self.unvaried_end))
+    
+    def __repr__(self):
+        return '<%s: %s>' % (self.generator.OccurrenceModel.__name__, self.varied_start)
+    
+    def materialize(self):
+        """
+        Returns an Occurrence model instance with the same values (which will update the existing row
+        when saved, if this occurrence was loaded from one).
+        """
+        OccurrenceModel = self.generator.OccurrenceModel
+        kwargs = dict(
+            generator=self.generator,
+            unvaried_start_date=self.unvaried_start.date(),
+            unvaried_start_time=self.unvaried_start.time(),
+            unvaried_end_date=self.unvaried_end.date(),
+            unvaried_end_time=self.unvaried_end.time(),
+            varied_start_date=self.varied_start.date(),
+            varied_start_time=self.varied_start.time(),
+            varied_end_date=self.varied_end.date(),
+            varied_end_time=self.varied_end.time(),
+            cancelled=self.cancelled,
+            hide_from_lists=self.hide_from_lists,
+            full=self.full,
+        )
+        if self.id is not None:
+            kwargs['id'] = self.id
+        if self._varied_event is not None:
+            kwargs['_varied_event'] = self._varied_event
+        elif self._varied_event_id is not None:
+            kwargs['_varied_event_id'] = self._varied_event_id
+        return OccurrenceModel(**kwargs)
+    
+    def save(self, *args, **kwargs):
+        """
+        Saves the occurrence as a model row, and returns the model instance.
+        """
+        occ = self.materialize()
+        occ.save(*args, **kwargs)
+        self.id = occ.id
+        return occ
+    
+    def delete(self):
+        if self.id is not None:
+            self.materialize().delete()
+            self.id = None
+    
+    def cancel(self):
+        self.cancelled = True
+        self.save()
+
+    def uncancel(self):
+        self.cancelled = False
+        self.save()
+
+
+def _has_varied_event(OccurrenceModel):
+    try:
+        OccurrenceModel._meta.get_field('_varied_event')
+    except models.FieldDoesNotExist:
+        return False
+    return True
@@ -1,5 +1,6 @@
 from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
+from eventtools.rrule_cache import invalidate_rule
 
 freqs = (
     ("YEARLY", _("Yearly")),
@@ -69,6 +70,15 @@ class Rule(models.Model):
                 param_dict.append(param)
         return dict(param_dict)
         
+    def save(self, *args, **kwargs):
+        super(Rule, self).save(*args, **kwargs)
+        invalidate_rule(self.pk)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        super(Rule, self).delete(*args, **kwargs)
+        invalidate_rule(pk)
+
     def __unicode__(self):
         """Human readable string for Rule"""
         return self.name
@@ -0,0 +1,247 @@
+"""
+Reading occurrences through the Django cache framework.
+
+``EventBase.get_occurrences(start, end)`` (and so ``Period.occurrences``,
+which asks each of its events) stores its results in the cache named by the
+OCCURRENCE_CACHE_BACKEND setting, keyed by the event, the window and the
+event's schedule version:
+
+    eventtools:occurrences:<app>.<model>:<event id>:<version>:<start>:<end>:<hide_hidden>
+
+The version is a counter, also kept in the cache, that is bumped (by signals)
+whenever anything that changes an event's occurrences is saved or deleted:
+the event, its generators, their rules, exceptional occurrences, variations
+and exclusion calendars. Entries for an old version are never read again,
+and expire in their own time, so nothing has to be deleted by pattern. (Note
+that a queryset's update() doesn't send signals.)
+
+When a version isn't in the cache (it expired, or was evicted) a new one is
+started from the current time in microseconds, rather than from 1, so that
+an entry made for an earlier version can't be mistaken for a current one.
+
+Caching is off unless OCCURRENCE_CACHE_ENABLED = True (the eventtools tests
+turn it on and off with ``enabled``, below). Since versions are bumped in the
+process that saves, a site with more than one process must use a shared
+OCCURRENCE_CACHE_BACKEND, or the others will serve stale occurrences until
+they expire. Occurrences are stored in the
+compact encoding of eventtools.codec, so they are quick to send to and from a
+shared backend like memcached. The cache can be filled ahead of time with the
+warm_occurrence_cache management command (see eventtools.warming).
+"""
+import time
+
+from django.core.cache import get_cache
+from django.db.models import signals
+
+from eventtools.codec import OccurrenceWindow
+from eventtools.conf.settings import OCCURRENCE_CACHE_ENABLED, OCCURRENCE_CACHE_BACKEND, \
+    OCCURRENCE_CACHE_TIMEOUT
+
+enabled = OCCURRENCE_CACHE_ENABLED
+
+_cache = None
+
+
+def get_occurrence_cache():
+    """ The cache that occurrences are kept in, opened when it is first needed. """
+    global _cache
+    if _cache is None:
+        _cache = get_cache(OCCURRENCE_CACHE_BACKEND)
+    return _cache
+
+
+def _model_key(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.object_name.lower())
+
+
+def _version_key(EventModel, event_id):
+    return "eventtools:version:%s:%s" % (_model_key(EventModel), event_id)
+
+
+def _new_version():
+    return int(time.time() * 1000000)
+
+
+def schedule_version(EventModel, event_id):
+    """ The current schedule version of an event. """
+    cache = get_occurrence_cache()
+    key = _version_key(EventModel, event_id)
+    version = cache.get(key)
+    if version is None:
+        # add() rather than set(), in case another process has just started one
+        cache.add(key, _new_version(), OCCURRENCE_CACHE_TIMEOUT)
+        version = cache.get(key, _new_version())
+    return version
+
+
+def schedule_versions(EventModel, event_ids):
+    """ The current schedule versions of some events, keyed by id, looked up together. """
+    keys = dict([(_version_key(EventModel, event_id), event_id) for event_id in event_ids])
+    found = get_occurrence_cache().get_many(keys.keys())
+    versions = {}
+    for key, event_id in keys.items():
+        if key in found:
+            versions[event_id] = found[key]
+        else:
+            versions[event_id] = schedule_version(EventModel, event_id)
+    return versions
+
+
+def bump_version(EventModel, event_id):
+    """ Makes the cached occurrences of an event stale. """
+    cache = get_occurrence_cache()
+    key = _version_key(EventModel, event_id)
+    try:
+        cache.incr(key)
+    except ValueError: # it isn't there
+        cache.set(key, _new_version(), OCCURRENCE_CACHE_TIMEOUT)
+
+
+def occurrences_key(EventModel, event_id, start, end, hide_hidden=True, version=None):
+    """
+    The key the occurrences of an event in a window are (or would be) cached under, for the event's
+    current schedule version (or ``version``).
+    """
+    if version is None:
+        version = schedule_version(EventModel, event_id)
+    return "eventtools:occurrences:%s:%s:%s:%s:%s:%d" % (_model_key(EventModel), event_id,
+        version, start.isoformat(), end.isoformat(), hide_hidden)
+
+
+def cache_value(occurrences):
+    """ What a list of occurrences is cached as: encoded (see eventtools.codec), or pickled if it can't be. """
+    try:
+        return OccurrenceWindow.from_occurrences(occurrences).tostring()
+    except (ValueError, OverflowError):
+        return occurrences
+
+
+def _generators(event):
+    """ an event's generators, keyed by pk, to decode its occurrences with """
+    generators = {}
+    for generator in event.generators.select_related('rule'):
+        # so that the occurrences' unvaried_event doesn't take a query each
+        setattr(generator, generator._meta.get_field('event').get_cache_name(), event)
+        generators[generator.pk] = generator
+    return generators
+
+
+def cached_occurrences(event, start, end, hide_hidden, compute):
+    """
+    Returns the occurrences of ``event`` between two datetimes from the cache, calling
+    ``compute(start, end, hide_hidden)`` (and caching the result) if they aren't there.
+    
+    Occurrences are cached in the compact encoding of eventtools.codec, and decoded with the
+    event's generators (one query), or pickled if they can't be encoded.
+    """
+    if not enabled or event.pk is None:
+        return compute(start, end, hide_hidden)
+    cache = get_occurrence_cache()
+    key = occurrences_key(event.__class__, event.pk, start, end, hide_hidden)
+    data = cache.get(key)
+    if isinstance(data, list):
+        return data
+    if data is not None:
+        try:
+            window = OccurrenceWindow.fromstring(data)
+            if not len(window):
+                return []
+            return window.to_occurrences(_generators(event))
+        except (ValueError, KeyError): # another format, or a generator has gone
+            pass
+    occurrences = compute(start, end, hide_hidden)
+    cache.set(key, cache_value(occurrences), OCCURRENCE_CACHE_TIMEOUT)
+    return occurrences
+
+
+# Bumping versions
+
+_generator_models = []
+
+
+def _event_model(GeneratorModel):
+    return GeneratorModel._meta.get_field('event').rel.to
+
+
+def _bump_generator_events(GeneratorModel, **filters):
+    EventModel = _event_model(GeneratorModel)
+    for event_id in set(GeneratorModel.objects.filter(**filters).values_list('event', flat=True)):
+        bump_version(EventModel, event_id)
+
+
+def _event_changed(sender, instance, **kwargs):
+    bump_version(sender, instance.pk)
+
+
+def _generator_changed(sender, instance, **kwargs):
+    bump_version(_event_model(sender), instance.event_id)
+
+
+def _occurrence_changed(sender, instance, **kwargs):
+    field = sender._meta.get_field('generator')
+    generator = getattr(instance, field.get_cache_name(), None)
+    if generator is not None:
+        bump_version(_event_model(field.rel.to), generator.event_id)
+    else:
+        _bump_generator_events(field.rel.to, pk=instance.generator_id)
+
+
+def _variation_changed(sender, instance, **kwargs):
+    bump_version(sender._meta.get_field('unvaried_event').rel.to, instance.unvaried_event_id)
+
+
+def _rule_changed(sender, instance, **kwargs):
+    for GeneratorModel in _generator_models:
+        _bump_generator_events(GeneratorModel, rule=instance.pk)
+
+
+def _bump_calendar_users(calendar_id):
+    for GeneratorModel in _generator_models:
+        _bump_generator_events(GeneratorModel, exclusion_calendars=calendar_id)
+        EventModel = _event_model(GeneratorModel)
+        for event_id in EventModel.objects.filter(exclusion_calendars=calendar_id).values_list('pk', flat=True):
+            bump_version(EventModel, event_id)
+
+
+def _excluded_period_changed(sender, instance, **kwargs):
+    _bump_calendar_users(instance.calendar_id)
+
+
+def _calendars_changed(sender, instance, action, **kwargs):
+    """ exclusion calendars were attached to (or detached from) an event or a generator """
+    if not action.startswith('post_'):
+        return
+    if hasattr(instance, 'periods'): # an ExclusionCalendar
+        _bump_calendar_users(instance.pk)
+    elif hasattr(instance, 'generators'):
+        bump_version(instance.__class__, instance.pk)
+    else:
+        bump_version(_event_model(instance.__class__), instance.event_id)
+
+
+def _connect(handler, model, name):
+    uid = "%s.%s.%s" % (name, model.__module__, model.__name__)
+    signals.post_save.connect(handler, sender=model, dispatch_uid="%s.saved" % uid)
+    signals.post_delete.connect(handler, sender=model, dispatch_uid="%s.deleted" % uid)
+
+
+def connect_occurrence_cache_signals(event_class, generator_class, occurrence_class):
+    """ Called by EventModelBase for each event model. """
+    from eventtools.models.rules import Rule
+    from eventtools.models.exclusions import ExcludedPeriod
+
+    _generator_models.append(generator_class)
+    _connect(_event_changed, event_class, "occurrence_cache_event")
+    _connect(_generator_changed, generator_class, "occurrence_cache_generator")
+    _connect(_occurrence_changed, occurrence_class, "occurrence_cache_occurrence")
+    _connect(_rule_changed, Rule, "occurrence_cache_rule")
+    _connect(_excluded_period_changed, ExcludedPeriod, "occurrence_cache_excluded_period")
+    if hasattr(signals, 'm2m_changed'): # Django 1.2+
+        for model in (event_class, generator_class):
+            signals.m2m_changed.connect(_calendars_changed, sender=model.exclusion_calendars.through,
+                dispatch_uid="occurrence_cache_calendars.%s.%s" % (model.__module__, model.__name__))
+
+
+def connect_variation_signals(variation_class):
+    """ Called by EventVariationModelBase for each variation model. """
+    _connect(_variation_changed, variation_class, "occurrence_cache_variation")
@@ -26,6 +26,9 @@ class Period(object):
     '''
     This class represents a period of time. It can return a set of occurrences
     based on its events, and its time period (start and end).
+    
+    Each event's occurrences are read through the occurrence cache (see
+    eventtools.occurrence_cache), unless an occurrence_pool is given.
     '''
     def __init__(self, events, start, end, parent_exceptional_occurrences = None,
         occurrence_pool=None):
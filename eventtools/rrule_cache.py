@@ -0,0 +1,185 @@
+"""
+A process-wide cache of compiled recurrence objects.
+
+Building an rrule from a Rule means parsing ``Rule.params``, looking up the
+frequency and (for complex rules) running ``rrulestr``. A month view asks for
+the same handful of rules thousands of times, so we compile each
+(rule, dtstart) combination once and share the result between requests and
+threads. rrule objects are not mutated by iteration, so sharing them is safe.
+
+Entries are keyed by the rule's id, a fingerprint of the rule's content and
+the dtstart. The fingerprint means an edited rule can never be served from a
+stale entry; ``invalidate_rule`` (called when rules and generators are saved)
+just frees the memory early.
+
+>>> compiled = get_rrule(generator.rule, generator.start)
+>>> rrule_cache.stats()
+{'hits': 1021, 'misses': 12, 'evictions': 0, 'size': 12, 'maxsize': 1000}
+"""
+import threading
+
+from dateutil import rrule
+
+from eventtools.conf.settings import RRULE_CACHE_SIZE, FASTFORWARD_CACHE_SIZE
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe least-recently-used mapping.
+
+    Keeps hit/miss/eviction counters, so that the cache can be sized by
+    looking at ``stats()`` on a production process.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            # circular doubly-linked list of [prev, next, key, value] links,
+            # the root's next is the least recently used entry.
+            self._root = root = []
+            root[:] = [root, root, None, None]
+            self.hits = self.misses = self.evictions = 0
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+
+    def set(self, key, value):
+        with self._lock:
+            link = self._data.get(key)
+            if link is not None:
+                link[3] = value
+                self._unlink(link)
+                self._append(link)
+                return
+            if self.maxsize <= 0:
+                return
+            while len(self._data) >= self.maxsize:
+                oldest = self._root[1]
+                self._unlink(oldest)
+                del self._data[oldest[2]]
+                self.evictions += 1
+            link = [None, None, key, value]
+            self._append(link)
+            self._data[key] = link
+
+    def discard_matching(self, test):
+        """
+        Remove every entry whose key passes ``test``. Returns the number of
+        entries removed.
+        """
+        with self._lock:
+            doomed = [key for key in self._data if test(key)]
+            for key in doomed:
+                self._unlink(self._data.pop(key))
+            return len(doomed)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+rrule_cache = LRUCache(RRULE_CACHE_SIZE)
+
+# fast-forwarded rrules and checkpoints (see eventtools.fastforward) are kept
+# apart, so that the many window anchors don't evict the compiled rules
+fastforward_cache = LRUCache(FASTFORWARD_CACHE_SIZE)
+
+
+def rule_fingerprint(rule):
+    """
+    The parts of a Rule that affect the occurrences it generates.
+    """
+    return (rule.frequency, rule.params or "", rule.complex_rule or "")
+
+
+def compile_rrule(rule, dtstart):
+    """
+    Build the recurrence object for ``rule`` starting at ``dtstart``, without
+    looking in the cache.
+    """
+    if rule.complex_rule:
+        try:
+            return rrule.rrulestr(str(rule.complex_rule), dtstart=dtstart)
+        except:
+            pass
+    params = rule.get_params()
+    frequency = getattr(rrule, rule.frequency)
+    simple_rule = rrule.rrule(frequency, dtstart=dtstart, **params)
+    set = rrule.rruleset()
+    set.rrule(simple_rule)
+    # holidays and closures are excluded with ExclusionCalendars (see models/exclusions.py)
+    return set
+
+
+def get_rrule(rule, dtstart):
+    """
+    Returns the (shared) recurrence object for ``rule`` starting at
+    ``dtstart``, compiling it if it isn't in the cache.
+    """
+    key = (rule.pk, rule_fingerprint(rule), dtstart)
+    compiled = rrule_cache.get(key)
+    if compiled is None:
+        compiled = compile_rrule(rule, dtstart)
+        rrule_cache.set(key, compiled)
+    return compiled
+
+
+def invalidate_rule(rule_id, dtstart=None):
+    """
+    Forget the compiled objects for the Rule with id ``rule_id`` (only those
+    starting at ``dtstart``, if it is given).
+    """
+    if dtstart is None:
+        test = lambda key: key[0] == rule_id
+    else:
+        test = lambda key: key[0] == rule_id and key[2] == dtstart
+    return rrule_cache.discard_matching(test) + fastforward_cache.discard_matching(test)
+
+
+def is_bounded(compiled):
+    """
+    True if the rules of a recurrence object are all bounded by COUNT or UNTIL.
+    """
+    if isinstance(compiled, rrule.rruleset):
+        # (an rruleset of just rdates is bounded too)
+        return not [r for r in compiled._rrule if not is_bounded(r)]
+    return compiled._count is not None or compiled._until is not None
+
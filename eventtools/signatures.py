@@ -0,0 +1,142 @@
+"""
+Expanding the generators that share a rule and a phase once between them.
+
+Hundreds of generators typically use the same Rule ("Weekly") with the same
+weekday and start time, and differ only in their first occurrence or their
+repeat_until. The occurrences of a fixed-period rule (see
+eventtools.fastforward) depend on dtstart only through the by-params it
+implies (the weekday, day of the month, time of day...) and which periods
+are in phase with it, so those generators produce the same sequence of
+datetimes, each clipped to its own lifetime. The canonical form of that
+sequence is a rule's *signature*:
+
+>>> signature(generator.rule, generator.start)
+('WEEKLY', (('byhour', 10), ('byminute', 0), ('bysecond', 0), ('byweekday', 1)), 0)
+
+``expand_shared`` expands each signature once per window, over the union of
+the windows its generators ask for, and gives each generator its slice.
+Expansions are cached for the process, keyed by signature and window, and
+for the duration of a request (see ``expansion_scope`` and
+eventtools.middleware.SharedExpansionMiddleware), so that the same windows
+asked for several times while a page is rendered are only looked up once.
+
+Rules with ``count``, ``bysetpos`` (which dateutil applies to the partial
+first period) or a complex rule aren't shared.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from eventtools.conf.settings import SIGNATURE_CACHE_SIZE
+from eventtools.rrule_cache import LRUCache, rule_fingerprint
+from eventtools.fastforward import _fixed_period_params, _explicit_params, \
+    _period_start, _periods_between
+
+# phases are counted in periods from here
+EPOCH = datetime(1970, 1, 1)
+
+signature_cache = LRUCache(SIGNATURE_CACHE_SIZE)
+
+_local = threading.local()
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return value
+
+
+def signature(rule, dtstart):
+    """
+    The signature of ``rule`` beginning at ``dtstart``: generators with the
+    same signature produce the same occurrence starts, from the later of
+    their dtstarts on. Returns None if the rule can't be shared.
+    """
+    params = _fixed_period_params(rule)
+    if params is None or params.get('bysetpos') is not None:
+        return None
+    interval = params.get('interval', 1)
+    wkst = params.get('wkst', 0)
+    periods = _periods_between(rule.frequency,
+        _period_start(rule.frequency, EPOCH, wkst),
+        _period_start(rule.frequency, dtstart, wkst))
+    params = _explicit_params(rule.frequency, params, dtstart.replace(microsecond=0))
+    params = tuple(sorted([(k, _freeze(v)) for k, v in params.items()]))
+    return (rule.frequency, params, periods % interval)
+
+
+class expansion_scope(object):
+    """
+    A context manager that caches signature expansions for its duration, on
+    top of the process-wide cache (typically for one request). Scopes can be
+    nested; the outermost one owns the cache.
+
+    >>> with expansion_scope():
+    ...     month = Lecture.objects.occurrences_between(start, end)
+    """
+
+    def __enter__(self):
+        self.outermost = getattr(_local, 'expansions', None) is None
+        if self.outermost:
+            _local.expansions = {}
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.outermost:
+            _local.expansions = None
+        return False
+
+
+def _cached_expansion(sig, rule, dtstart, start, end, expand):
+    """
+    The starts of ``sig`` between ``start`` and ``end`` (inclusive), which
+    ``rule`` beginning at ``dtstart`` (at or before ``start``) produces.
+    """
+    key = (sig, start, end)
+    scoped = getattr(_local, 'expansions', None)
+    if scoped is not None and key in scoped:
+        return scoped[key]
+    starts = signature_cache.get(key)
+    if starts is None:
+        starts = expand(rule, dtstart, start, end)
+        signature_cache.set(key, starts)
+    if scoped is not None:
+        scoped[key] = starts
+    return starts
+
+
+def expand_shared(items, expand):
+    """
+    Expands the shareable items of a batch of (key, rule, dtstart, start,
+    end) tuples, one expansion (with the function ``expand``) per signature.
+    Returns a dict of the results, like eventtools.vectorized.expand_batch,
+    and a list of the items that couldn't be shared.
+    """
+    result = {}
+    rest = []
+    groups = {}
+    signatures = {}
+    for item in items:
+        key, rule, dtstart, start, end = item
+        rule_key = (rule.pk, rule_fingerprint(rule), dtstart)
+        if rule_key not in signatures:
+            signatures[rule_key] = signature(rule, dtstart)
+        sig = signatures[rule_key]
+        if sig is None:
+            rest.append(item)
+        elif max(start, dtstart.replace(microsecond=0)) > end:
+            result[key] = []
+        else:
+            groups.setdefault(sig, []).append(item)
+
+    for sig, group in groups.items():
+        # the earliest generator can expand the group's whole window
+        first = min([item[2] for item in group])
+        representative = [item for item in group if item[2] == first][0]
+        start = min([max(item[3], item[2].replace(microsecond=0)) for item in group])
+        end = max([item[4] for item in group])
+        starts = _cached_expansion(sig, representative[1], first, start, end, expand)
+        for key, rule, dtstart, item_start, item_end in group:
+            lo = bisect_left(starts, max(item_start, dtstart.replace(microsecond=0)))
+            result[key] = starts[lo:bisect_right(starts, item_end, lo)]
+    return result, rest
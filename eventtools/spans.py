@@ -0,0 +1,287 @@
+"""
+An in-memory index of the spans of occurrence generators, for "what's on
+now" queries.
+
+Asking for the occurrences at one moment (or in the next hour) with
+``occurrences_between`` loads and expands every generator whose span (its
+first start to its effective_end, or for ever) overlaps the window, and most
+endless generators always do. Each generator model has a GeneratorSpans
+instead, built from one query when it is first needed, which finds the
+generators that can be live in a window without touching the database:
+
+* a SpanIndex of their spans keeps the ones that end sorted by start, in
+  blocks that know their latest end (so blocks that are over are skipped),
+  and the open-ended ones sorted by start (so the live ones are a prefix);
+* the rules of the candidates are then checked for an occurrence in the
+  window, which fastforward does in constant time for most rules.
+
+Only the generators that pass are loaded and expanded, so the cost of
+``occurrences_at(now)`` depends on what is on, not on how many events there
+are:
+
+>>> Lecture.objects.occurrences_at(datetime.now())
+>>> Lecture.objects.occurrences_starting_between(now, now + timedelta(hours=1))
+
+The index is updated in place as generators are saved and deleted in this
+process, and rebuilt after a rule is (which changes its generators' spans).
+Other processes' changes bump a stamp kept in the occurrence
+cache (see eventtools.occurrence_cache), which makes the index rebuild when it
+is next used, so processes see each other's changes at once if that cache is
+shared. Whether or not it is, the index is rebuilt once it is SPAN_INDEX_TTL
+seconds old, so changes it can't hear about (other processes' with a
+per-process cache, and ``update()``s) are seen within that long.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+from django.db.models import signals
+
+from eventtools import fastforward
+from eventtools.occurrence_cache import get_occurrence_cache
+from eventtools.conf.settings import OCCURRENCE_CACHE_TIMEOUT, SPAN_INDEX_TTL
+
+BLOCK_SIZE = 64
+
+_AFTER_ANY_PK = float('inf')
+
+
+class SpanIndex(object):
+    """
+    The spans of some generators: (start, end) pairs keyed by pk, where an ``end`` of None means the
+    span is open-ended. ``between(start, end)`` returns the pks of the spans that overlap a window.
+    """
+
+    def __init__(self, spans=()):
+        self._spans = {}
+        self._open = [] # sorted (start, pk) of the open-ended spans
+        self._blocks = [] # sorted lists of (start, end, pk) of the others, in order
+        self._firsts = [] # each block's first entry
+        self._last_ends = [] # each block's latest end
+        entries = []
+        for pk, start, end in spans:
+            self._spans[pk] = (start, end)
+            if end is None:
+                self._open.append((start, pk))
+            else:
+                entries.append((start, end, pk))
+        self._open.sort()
+        entries.sort()
+        for i in range(0, len(entries), BLOCK_SIZE):
+            self._append_block(entries[i:i + BLOCK_SIZE])
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __contains__(self, pk):
+        return pk in self._spans
+
+    def _append_block(self, block):
+        self._blocks.append(block)
+        self._firsts.append(block[0])
+        self._last_ends.append(max([entry[1] for entry in block]))
+
+    def _block_index(self, entry):
+        return max(bisect_right(self._firsts, entry) - 1, 0)
+
+    def _summarize(self, i):
+        block = self._blocks[i]
+        self._firsts[i] = block[0]
+        self._last_ends[i] = max([entry[1] for entry in block])
+
+    def add(self, pk, start, end):
+        """ Adds a span (or moves it, if ``pk`` is already in the index). """
+        if pk in self._spans:
+            self.remove(pk)
+        self._spans[pk] = (start, end)
+        if end is None:
+            insort(self._open, (start, pk))
+            return
+        entry = (start, end, pk)
+        if not self._blocks:
+            self._append_block([entry])
+            return
+        i = self._block_index(entry)
+        block = self._blocks[i]
+        insort(block, entry)
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[i:i + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self._firsts.insert(i, None)
+            self._last_ends.insert(i, None)
+            self._summarize(i + 1)
+        self._summarize(i)
+
+    def remove(self, pk):
+        """ Removes a span, if it is there. """
+        if pk not in self._spans:
+            return
+        start, end = self._spans.pop(pk)
+        if end is None:
+            del self._open[bisect_left(self._open, (start, pk))]
+            return
+        entry = (start, end, pk)
+        i = self._block_index(entry)
+        block = self._blocks[i]
+        del block[bisect_left(block, entry)]
+        if block:
+            self._summarize(i)
+        else:
+            del self._blocks[i], self._firsts[i], self._last_ends[i]
+
+    def between(self, start, end):
+        """ The pks of the spans that overlap the window from ``start`` to ``end`` (inclusive). """
+        pks = [pk for s, pk in self._open[:bisect_right(self._open, (end, _AFTER_ANY_PK))]]
+        for i in range(bisect_right(self._firsts, (end, datetime.max, _AFTER_ANY_PK))):
+            if self._last_ends[i] < start:
+                continue
+            for s, e, pk in self._blocks[i]:
+                if s > end:
+                    break
+                if e >= start:
+                    pks.append(pk)
+        return pks
+
+
+class GeneratorSpans(object):
+    """
+    The SpanIndex of the generators of a model, and what is needed to check their rules: each one's
+    rule id, first start and duration, and the rules.
+    """
+
+    FIELDS = ('pk', 'first_start_date', 'first_start_time', 'first_end_date', 'first_end_time',
+        'effective_end', 'rule')
+
+    def __init__(self, GeneratorModel):
+        self.GeneratorModel = GeneratorModel
+        self._lock = threading.RLock()
+        self._index = None
+        self._stamp = None
+        self._built = None
+
+    def _key(self):
+        opts = self.GeneratorModel._meta
+        return "eventtools:generator-spans:%s.%s" % (opts.app_label, opts.object_name.lower())
+
+    def _build(self):
+        from eventtools.models.rules import Rule
+        combine = datetime.combine
+        spans, self._details = [], {}
+        for pk, start_date, start_time, end_date, end_time, effective_end, rule_id in \
+                self.GeneratorModel.objects.values_list(*self.FIELDS):
+            start = combine(start_date, start_time)
+            end = combine(end_date or start_date, end_time or start_time)
+            spans.append((pk, start, effective_end))
+            self._details[pk] = (rule_id, start, end - start)
+        self._rules = dict([(rule.pk, rule) for rule in Rule.objects.all()])
+        self._index = SpanIndex(spans)
+        self._built = time.time()
+
+    def _current(self):
+        """
+        the index, (re)built if it hasn't been, another process has changed the generators, or it is
+        older than SPAN_INDEX_TTL
+        """
+        cache = get_occurrence_cache()
+        stamp = cache.get(self._key())
+        if stamp is None:
+            cache.add(self._key(), 0, OCCURRENCE_CACHE_TIMEOUT)
+            stamp = cache.get(self._key(), 0)
+        if self._index is None or stamp != self._stamp or time.time() - self._built >= SPAN_INDEX_TTL:
+            self._build()
+            self._stamp = stamp
+        return self._index
+
+    def _bump(self):
+        """ tells other processes about a change that has been made to this one's index """
+        cache = get_occurrence_cache()
+        try:
+            stamp = cache.incr(self._key())
+        except ValueError:
+            self._index = None
+            return
+        if self._index is not None and stamp == self._stamp + 1:
+            self._stamp = stamp
+        else:
+            self._index = None
+
+    def _may_occur_between(self, pk, start, end):
+        rule_id, first_start, duration = self._details[pk]
+        if rule_id is None:
+            return True # a one-off: its span is its occurrence
+        rule = self._rules.get(rule_id)
+        if rule is None:
+            return True
+        first = fastforward.after(rule, first_start, start - duration, inc=True)
+        return first is not None and first <= end
+
+    def live_between(self, start, end):
+        """
+        The pks of the generators that can have (unexceptional) occurrences between two datetimes:
+        whose span overlaps the window, and whose rule generates an occurrence in it.
+        """
+        with self._lock:
+            index = self._current()
+            return set([pk for pk in index.between(start, end) if self._may_occur_between(pk, start, end)])
+
+    def generator_changed(self, generator):
+        with self._lock:
+            if self._index is not None:
+                self._index.add(generator.pk, generator.start, generator.effective_end)
+                self._details[generator.pk] = (generator.rule_id, generator.start, generator.end - generator.start)
+            self._bump()
+
+    def generator_deleted(self, pk):
+        with self._lock:
+            if self._index is not None:
+                self._index.remove(pk)
+                self._details.pop(pk, None)
+            self._bump()
+
+    def rule_changed(self, rule):
+        with self._lock:
+            # saving a rule changes its generators' effective_ends with an update(), which sends no
+            # signals, so the index is rebuilt (from one query) when it is next used
+            self._index = None
+            self._bump()
+
+
+_spans = {}
+_spans_lock = threading.Lock()
+
+
+def generator_spans(GeneratorModel):
+    """ The (process-wide) GeneratorSpans of a generator model. """
+    with _spans_lock:
+        if GeneratorModel not in _spans:
+            _spans[GeneratorModel] = GeneratorSpans(GeneratorModel)
+        return _spans[GeneratorModel]
+
+
+def reset():
+    """ Forgets all the indexes (they are rebuilt when they are next used). """
+    with _spans_lock:
+        _spans.clear()
+
+
+def _generator_saved(sender, instance, **kwargs):
+    generator_spans(sender).generator_changed(instance)
+
+
+def _generator_deleted(sender, instance, **kwargs):
+    generator_spans(sender).generator_deleted(instance.pk)
+
+
+def _rule_changed(sender, instance, **kwargs):
+    for spans in list(_spans.values()):
+        spans.rule_changed(instance)
+
+
+def connect_span_signals(generator_class):
+    """ Called by EventModelBase for each generator model. """
+    from eventtools.models.rules import Rule
+    uid = "%s.%s" % (generator_class.__module__, generator_class.__name__)
+    signals.post_save.connect(_generator_saved, sender=generator_class, dispatch_uid="spans_saved.%s" % uid)
+    signals.post_delete.connect(_generator_deleted, sender=generator_class, dispatch_uid="spans_deleted.%s" % uid)
+    signals.post_save.connect(_rule_changed, sender=Rule, dispatch_uid="spans_rule_saved")
+    signals.post_delete.connect(_rule_changed, sender=Rule, dispatch_uid="spans_rule_deleted")
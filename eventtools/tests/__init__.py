@@ -1,2 +1,16 @@
 from test_models import *
-from test_periods import *
\ No newline at end of file
+from test_periods import *
+from test_rrule_cache import *
+from test_vectorized import *
+from test_fastforward import *
+from test_counting import *
+from test_signatures import *
+from test_asynchronous import *
+from test_codec import *
+from test_spans import *
+from test_freebusy import *
+from test_clashes import *
+from test_masks import *
+from test_memo import *
+from test_warming import *
+from test_bulk import *
\ No newline at end of file
@@ -2,6 +2,7 @@ from django.test import TestCase
 from django.conf import settings
 from django.db.models.loading import load_app
 from django.core.management import call_command
+from eventtools import occurrence_cache, spans
 
 APP_NAME = 'eventtools.tests.eventtools_testapp'
 
@@ -17,6 +18,11 @@ class TestCaseWithApp(TestCase):
         load_app(APP_NAME)
         call_command('flush', verbosity=0, interactive=False)
         call_command('syncdb', verbosity=0, interactive=False)
+        # ids are reused after a flush; tests that want the occurrence cache turn it back on
+        self.old_occurrence_cache_enabled = occurrence_cache.enabled
+        occurrence_cache.enabled = False
+        spans.reset()
         
     def tearDown(self):
         settings.INSTALLED_APPS = self.old_INSTALLED_APPS
+        occurrence_cache.enabled = self.old_occurrence_cache_enabled
@@ -0,0 +1,50 @@
+import threading
+from unittest import TestCase
+
+from eventtools import asynchronous
+from eventtools.asynchronous import ThreadPoolExecutor, StopAsyncIteration, submit, \
+    AsyncOccurrenceIterator
+
+
+class TestAsynchronous(TestCase):
+    """
+    Jobs run in the pool, and concurrent requests for the same thing share a job.
+    (The database isn't used here: the workers' connections can't see a test database's
+    transaction.)
+    """
+
+    def test_shared_jobs(self):
+        if ThreadPoolExecutor is None:
+            return
+        release = threading.Event()
+        calls = []
+        def job(n):
+            calls.append(n)
+            release.wait(5)
+            return [n] * n
+        first = submit(('test', 3), job, 3)
+        second = submit(('test', 3), job, 3)
+        other = submit(('test', 2), job, 2)
+        release.set()
+        self.assertEqual(first.result(5), [3, 3, 3])
+        self.assertTrue(second.future is first.future)
+        self.assertEqual(other.result(5), [2, 2])
+        self.assertEqual(sorted(calls), [2, 3])
+        # once it has finished, the job isn't shared any more
+        self.assertFalse(('test', 3) in asynchronous._in_flight)
+        self.assertEqual(submit(('test', 3), job, 3).result(5), [3, 3, 3])
+        self.assertEqual(len(calls), 3)
+
+    def test_async_iterator(self):
+        if ThreadPoolExecutor is None:
+            return
+        iterator = AsyncOccurrenceIterator(lambda: iter(range(7)), batch_size=3)
+        self.assertTrue(iterator.__aiter__() is iterator)
+        items = []
+        while True:
+            try:
+                items.append(iterator.__anext__().result(5))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(items, range(7))
+        self.assertRaises(StopAsyncIteration, iterator.__anext__().result)
@@ -0,0 +1,61 @@
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools import bulk
+
+
+loaded = []
+
+def daily_shard(app_label, model_name, pks, slices, hide_hidden=True):
+    """
+    A stand-in for bulk.expand_shard that needs no database: "generator" ``pk`` has an occurrence
+    every day at ``pk`` o'clock, for two hours. Rows end with the id of the process that made them.
+    """
+    loaded.append(pks)
+    for start, end in slices:
+        yield daily_rows(pks, start, end)
+
+def daily_rows(pks, start, end):
+    rows = []
+    for pk in pks:
+        day = datetime(start.year, start.month, start.day) - timedelta(days=1)
+        while day <= end:
+            occurrence_start = day + timedelta(hours=pk)
+            occurrence_end = occurrence_start + timedelta(hours=2)
+            if occurrence_start < end and occurrence_end >= start:
+                rows.append((occurrence_start, pk, occurrence_start, occurrence_end, 0, 0, os.getpid()))
+            day += timedelta(days=1)
+    rows.sort()
+    return rows
+
+
+class TestBulk(TestCase):
+    """
+    The shards and slices expanded by worker processes are merged into one stream, in order.
+    """
+
+    def setUp(self):
+        self.pks = [1, 5, 9, 13, 17, 21, 23]
+        self.start, self.end = datetime(2010, 3, 1, 3, 0), datetime(2010, 3, 29)
+
+    def expected(self):
+        return [row[:-1] for row in daily_rows(self.pks, self.start, self.end)]
+
+    def test_slices(self):
+        del loaded[:]
+        rows = list(bulk.iter_rows(daily_shard, 'tests', 'Generator', self.pks, self.start, self.end,
+            workers=1, shard_size=3, slice_days=5))
+        self.assertEqual([row[:-1] for row in rows], self.expected())
+        # each shard is loaded once, for all of the slices
+        self.assertEqual(loaded, [[1, 5, 9], [13, 17, 21], [23]])
+
+    def test_pool(self):
+        if bulk.ProcessPoolExecutor is None:
+            return
+        rows = bulk.iter_rows(daily_shard, 'tests', 'Generator', self.pks, self.start, self.end,
+            workers=2, shard_size=3, slice_days=5)
+        self.assertEqual(rows.next()[:-1], self.expected()[0])
+        rows = [rows.next()] + list(rows)
+        self.assertEqual([row[:-1] for row in rows], self.expected()[1:])
+        self.assertFalse(os.getpid() in set([row[-1] for row in rows]))
@@ -0,0 +1,71 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.clashes import find_clashes
+
+
+class Generator(object):
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class Occurrence(object):
+    def __init__(self, generator, start, end, cancelled=False):
+        self.generator = generator
+        self.start = start
+        self.end = end
+        self.cancelled = cancelled
+
+
+class TestClashes(TestCase):
+    """
+    The sweep line finds the same clashes as comparing every pair of occurrences.
+    """
+
+    def test_find_clashes(self):
+        day = datetime(2010, 3, 1)
+        hours = lambda h: day + timedelta(hours=h)
+        a, b = Generator(1), Generator(2)
+        occurrences = [
+            Occurrence(a, hours(9), hours(10)),
+            Occurrence(b, hours(9), hours(10)), # the same start
+            Occurrence(a, hours(12), hours(14)),
+            Occurrence(b, hours(13), hours(15)), # overlaps
+            Occurrence(b, hours(15), hours(16)), # touches
+            Occurrence(a, hours(12.5), hours(12.75)), # overlaps, but from the same generator
+            Occurrence(b, hours(18), hours(20)),
+            Occurrence(a, hours(18), hours(20), cancelled=True),
+        ]
+        report = find_clashes(occurrences)
+        self.assertEqual(report.clashing_starts(), set([hours(9)]))
+        self.assertEqual([(x.start, y.start) for x, y in report.overlaps], [(hours(12), hours(13))])
+        self.assertEqual(len(report), 2)
+        
+        report = find_clashes(occurrences, same_source=True)
+        self.assertEqual(report.clashing_starts(), set([hours(9)]))
+        self.assertEqual([(x.start, y.start) for x, y in report.overlaps], [(hours(12), hours(12.5)), (hours(12), hours(13))])
+        
+        self.assertEqual(find_clashes(occurrences, show_cancelled=True).clashing_starts(), set([hours(9), hours(18)]))
+        self.assertFalse(find_clashes([]))
+
+    def test_differential(self):
+        rnd = random.Random(11)
+        start = datetime(2010, 3, 1)
+        for i in range(200):
+            generators = [Generator(pk) for pk in range(rnd.randint(1, 4))]
+            occurrences = []
+            for j in range(rnd.randint(0, 30)):
+                occurrence_start = start + timedelta(hours=rnd.randint(0, 40))
+                occurrences.append(Occurrence(rnd.choice(generators), occurrence_start,
+                    occurrence_start + timedelta(hours=rnd.choice([0, 1, 2, 5])), rnd.random() < 0.1))
+            for same_source in (False, True):
+                report = find_clashes(occurrences, same_source=same_source)
+                live = [o for o in occurrences if not o.cancelled]
+                clash = lambda x, y: same_source or x.generator.pk != y.generator.pk
+                expected = set([(id(x), id(y)) for x in live for y in live
+                    if x.start < y.start < x.end and clash(x, y)])
+                self.assertEqual(set([(id(x), id(y)) for x, y in report.overlaps]), expected)
+                self.assertEqual(len(report.overlaps), len(expected))
+                starts = set([x.start for x in live for y in live if x is not y and x.start == y.start and clash(x, y)])
+                self.assertEqual(report.clashing_starts(), starts)
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.codec import encode, decode, OccurrenceWindow, CANCELLED, HIDDEN, FULL, VARIED
+from eventtools.models import VirtualOccurrence
+
+
+class Generator(object):
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class TestCodec(TestCase):
+    """
+    Encoded occurrences decode to the same occurrences, in the same order.
+    """
+
+    def setUp(self):
+        self.generators = {1: Generator(1), 7: Generator(7)}
+        start = datetime(2010, 3, 1, 10, 0)
+        hour = timedelta(hours=1)
+        self.occurrences = [
+            VirtualOccurrence(self.generators[1], start, start + hour),
+            # moved and cancelled
+            VirtualOccurrence(self.generators[7], start, start + hour, id=12,
+                varied_start=start + timedelta(days=1, minutes=30), varied_end=start + timedelta(days=1, hours=3),
+                cancelled=True),
+            VirtualOccurrence(self.generators[1], start + timedelta(weeks=1), start + timedelta(weeks=1) + hour,
+                id=13, hide_from_lists=True, full=True, varied_event_id=3),
+            VirtualOccurrence(self.generators[7], datetime(2999, 12, 31, 23, 59, 59), datetime(3000, 1, 2)),
+        ]
+
+    def _fields(self, occurrence):
+        return (occurrence.generator.pk, occurrence.unvaried_start, occurrence.unvaried_end,
+            occurrence.start, occurrence.end, occurrence.id, occurrence.cancelled,
+            occurrence.hide_from_lists, occurrence.full, occurrence._varied_event_id)
+
+    def test_round_trip(self):
+        data = encode(self.occurrences)
+        decoded = decode(data, self.generators)
+        self.assertEqual([self._fields(o) for o in decoded], [self._fields(o) for o in self.occurrences])
+        self.assertTrue(decoded[0].generator is self.generators[1])
+        self.assertEqual(decode(encode([]), {}), [])
+
+        window = OccurrenceWindow.fromstring(data)
+        self.assertEqual(len(window), 4)
+        self.assertEqual(list(window.flags), [0, CANCELLED, HIDDEN | FULL | VARIED, 0])
+        self.assertEqual(list(window.unvaried_offsets), [0, -(24 * 60 + 30) * 60, 0, 0])
+
+    def test_invalid(self):
+        data = encode(self.occurrences)
+        self.assertRaises(ValueError, OccurrenceWindow.fromstring, data[:-1])
+        self.assertRaises(ValueError, OccurrenceWindow.fromstring, 'not a window'.encode('ascii'))
+        self.assertRaises(KeyError, decode, data, {1: self.generators[1]})
+        start = datetime(2010, 3, 1, 10, 0, 0, 500)
+        self.assertRaises(ValueError, encode, [VirtualOccurrence(self.generators[1], start, start)])
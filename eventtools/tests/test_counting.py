@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.models import Rule
+from eventtools.rrule_cache import get_rrule
+from eventtools.counting import count_occurrences, last_start
+from test_vectorized import _random_rule, _random_datetime
+
+
+def _stream_count(rule, dtstart, until):
+    count = 0
+    for d in get_rrule(rule, dtstart):
+        if d > until:
+            break
+        count += 1
+    return count
+
+def _stream_last_start(rule, dtstart, until):
+    last = None
+    for d in get_rrule(rule, dtstart):
+        if until is not None and d > until:
+            return until
+        last = d
+    return last or until
+
+
+class TestCounting(TestCase):
+    """
+    Counting must agree with iterating over the rule.
+    """
+
+    def test_differential(self):
+        rnd = random.Random(4)
+        base = datetime(2008, 1, 1)
+        for i in range(1000):
+            rule = _random_rule(rnd)
+            dtstart = _random_datetime(rnd, base, 1000)
+            until = _random_datetime(rnd, dtstart - timedelta(days=5), 1500)
+            self.assertEqual(count_occurrences(rule, dtstart, until),
+                _stream_count(rule, dtstart, until),
+                "%s %s from %s until %s" % (rule.frequency, rule.params, dtstart, until))
+
+    def test_unbounded(self):
+        dtstart = datetime(2010, 1, 1, 9, 0)
+        self.assertEqual(count_occurrences(Rule(frequency="WEEKLY"), dtstart), None)
+        self.assertEqual(count_occurrences(Rule(frequency="WEEKLY", params="count:4"), dtstart), 4)
+        self.assertEqual(count_occurrences(Rule(frequency="WEEKLY", params="count:4"), dtstart,
+            datetime(2010, 1, 15, 9, 0)), 3)
+
+    def test_complex_rules_are_streamed(self):
+        dtstart = datetime(2010, 1, 1, 9, 0)
+        self.assertEqual(count_occurrences(Rule(complex_rule="FREQ=DAILY;COUNT=7"), dtstart), 7)
+        self.assertEqual(count_occurrences(Rule(complex_rule="FREQ=YEARLY;BYEASTER=0"), dtstart), None)
+        self.assertEqual(count_occurrences(Rule(complex_rule="FREQ=YEARLY;BYEASTER=0"), dtstart,
+            datetime(2020, 1, 1)), 10)
+
+    def test_last_start(self):
+        rnd = random.Random(5)
+        base = datetime(2008, 1, 1)
+        for i in range(500):
+            rule = _random_rule(rnd)
+            if 'count' not in rule.params:
+                rule.params = ';'.join([p for p in (rule.params, 'count:%d' % rnd.randint(1, 200)) if p])
+            dtstart = _random_datetime(rnd, base, 1000)
+            until = None
+            # (a rule can have no occurrences at all, like the 31st of February, so don't stream to the end of time)
+            if rnd.random() < 0.7 or 'bymonth' in rule.params:
+                until = _random_datetime(rnd, dtstart - timedelta(days=5), 3000)
+            self.assertEqual(last_start(rule, dtstart, until),
+                _stream_last_start(rule, dtstart, until),
+                "%s %s from %s until %s" % (rule.frequency, rule.params, dtstart, until))
+
+    def test_last_start_unbounded(self):
+        dtstart = datetime(2010, 3, 1, 10, 0)
+        until = datetime(2010, 3, 20)
+        self.assertEqual(last_start(Rule(frequency="WEEKLY"), dtstart), None)
+        self.assertEqual(last_start(Rule(frequency="WEEKLY"), dtstart, until), until)
+        self.assertEqual(last_start(Rule(frequency="WEEKLY", params="count:3"), dtstart, until),
+            datetime(2010, 3, 15, 10, 0))
+        self.assertEqual(last_start(Rule(complex_rule="FREQ=WEEKLY"), dtstart, until), until)
+        self.assertEqual(last_start(Rule(complex_rule="FREQ=DAILY;UNTIL=20100404T235959"), dtstart),
+            datetime(2010, 4, 4, 10, 0))
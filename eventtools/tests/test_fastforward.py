@@ -0,0 +1,91 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.models import Rule
+from eventtools.rrule_cache import get_rrule
+from eventtools import fastforward
+
+
+def _random_rule(rnd):
+    frequency = rnd.choice(['YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY', 'HOURLY'])
+    params = []
+    if rnd.random() < 0.5:
+        params.append('interval:%d' % rnd.randint(1, 5))
+    if rnd.random() < 0.4:
+        params.append('byweekday:%s' % ','.join(
+            [str(d) for d in rnd.sample(range(7), rnd.randint(1, 3))]))
+        if rnd.random() < 0.3:
+            params.append('bysetpos:%d' % rnd.choice([1, -1]))
+    if frequency in ('WEEKLY', 'DAILY') and rnd.random() < 0.3:
+        params.append('bymonth:%s' % ','.join(
+            [str(m) for m in rnd.sample(range(1, 13), rnd.randint(2, 6))]))
+    if frequency != 'HOURLY' and rnd.random() < 0.2:
+        params.append('byhour:%s' % ','.join(
+            [str(h) for h in rnd.sample(range(24), rnd.randint(1, 3))]))
+    if rnd.random() < 0.2:
+        params.append('wkst:%d' % rnd.randint(0, 6))
+    return Rule(frequency=frequency, params=';'.join(params))
+
+
+class TestFastForward(TestCase):
+    """
+    Fast-forwarded expansion must give exactly the same results as iterating
+    from dtstart.
+    """
+
+    def test_differential(self):
+        rnd = random.Random(3)
+        for i in range(200):
+            rule = _random_rule(rnd)
+            dtstart = datetime(2004, 1, 1) + timedelta(days=rnd.randint(0, 1500),
+                minutes=rnd.randint(0, 24 * 60 - 1))
+            start = dtstart + timedelta(days=rnd.randint(-10, 2500),
+                minutes=rnd.randint(0, 24 * 60 - 1))
+            end = start + timedelta(days=(rule.frequency == 'HOURLY' and 2 or 60))
+            compiled = get_rrule(rule, dtstart)
+            message = "%s %s from %s, at %s" % (rule.frequency, rule.params, dtstart, start)
+            self.assertEqual(fastforward.between(rule, dtstart, start, end),
+                compiled.between(start, end, inc=True), message)
+            self.assertEqual(fastforward.after(rule, dtstart, start),
+                compiled.after(start), message)
+
+    def test_anchor_is_near_the_window(self):
+        rule = Rule(frequency="DAILY", params="interval:3")
+        dtstart = datetime(2004, 3, 1, 19, 30)
+        start = datetime(2010, 3, 1)
+        first = fastforward.fast_forward(rule, dtstart, start)[0]
+        self.assertEqual(first, datetime(2010, 2, 28, 19, 30))
+        self.assertEqual(fastforward.fast_forward(rule, dtstart, dtstart + timedelta(days=1)), None)
+
+    def test_count_is_never_fast_forwarded(self):
+        rule = Rule(frequency="WEEKLY", params="count:10")
+        dtstart = datetime(2010, 1, 4, 9, 0)
+        self.assertEqual(fastforward.fast_forward(rule, dtstart, datetime(2010, 2, 1)), None)
+        self.assertEqual(fastforward.between(rule, dtstart, datetime(2010, 3, 1), datetime(2010, 6, 1)),
+            [datetime(2010, 3, 1, 9, 0), datetime(2010, 3, 8, 9, 0)])
+
+    def test_checkpoints(self):
+        rule = Rule(complex_rule="FREQ=MONTHLY;BYDAY=+1MO,-1FR")
+        dtstart = datetime(2005, 1, 1, 18, 0)
+        checkpoints = fastforward.get_checkpoints(rule, dtstart)
+        self.assertEqual(fastforward.between(rule, dtstart, datetime(2010, 3, 1), datetime(2010, 3, 31)),
+            [datetime(2010, 3, 1, 18, 0), datetime(2010, 3, 26, 18, 0)])
+        computed = len(checkpoints.dates)
+        # an earlier window is found in what has already been computed
+        self.assertEqual(fastforward.after(rule, dtstart, datetime(2009, 12, 31)), datetime(2010, 1, 4, 18, 0))
+        self.assertEqual(len(checkpoints.dates), computed)
+        iterator = fastforward.iter_from(rule, dtstart, datetime(2010, 3, 27))
+        self.assertEqual([iterator.next() for i in range(2)],
+            [datetime(2010, 4, 5, 18, 0), datetime(2010, 4, 30, 18, 0)])
+
+    def test_anchors_dont_evict_compiled_rules(self):
+        from eventtools.rrule_cache import rrule_cache, fastforward_cache, rule_fingerprint
+        rule = Rule(frequency="DAILY")
+        dtstart = datetime(2004, 3, 1, 19, 30)
+        get_rrule(rule, dtstart)
+        for day in range(rrule_cache.maxsize + 10):
+            start = datetime(2008, 1, 1) + timedelta(days=day)
+            fastforward.between(rule, dtstart, start, start + timedelta(days=1))
+        self.assertTrue((rule.pk, rule_fingerprint(rule), dtstart) in rrule_cache)
+        self.assertTrue(len(fastforward_cache) <= fastforward_cache.maxsize)
@@ -0,0 +1,78 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.freebusy import freebusy, merge_intervals
+
+
+class Occurrence(object):
+    def __init__(self, start, end, cancelled=False):
+        self.start = start
+        self.end = end
+        self.cancelled = cancelled
+
+
+class TestFreeBusy(TestCase):
+    """
+    Busy intervals are the merged occurrences, clipped to the window, and free intervals fill the
+    gaps between them.
+    """
+
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([]), [])
+        self.assertEqual(merge_intervals([(5, 6), (1, 3), (2, 4), (4, 4), (7, 9), (8, 8)]), [(1, 4), (5, 6), (7, 9)])
+
+    def test_freebusy(self):
+        day = datetime(2010, 3, 1)
+        hours = lambda *h: day + timedelta(hours=h[0], minutes=len(h) > 1 and h[1] or 0)
+        occurrences = [
+            Occurrence(hours(-2), hours(1)), # started yesterday
+            Occurrence(hours(10), hours(12)),
+            Occurrence(hours(11), hours(13)),
+            Occurrence(hours(13), hours(14)), # touches the last one
+            Occurrence(hours(15), hours(16), cancelled=True),
+            Occurrence(hours(23), hours(25)),
+        ]
+        result = freebusy(occurrences, day, hours(24), show_cancelled=False)
+        self.assertEqual(result.busy, [(day, hours(1)), (hours(10), hours(14)), (hours(23), hours(24))])
+        self.assertEqual(result.free, [(hours(1), hours(10)), (hours(14), hours(23))])
+        
+        result = freebusy(occurrences, day, hours(24), show_cancelled=True)
+        self.assertEqual(result.busy[2], (hours(15), hours(16)))
+        
+        result = freebusy([], day, hours(24))
+        self.assertEqual((result.busy, result.free), ([], [(day, hours(24))]))
+
+    def test_touching_the_window(self):
+        day = datetime(2010, 3, 1)
+        hours = lambda h: day + timedelta(hours=h)
+        # ending as the window starts, starting as it ends, and taking no time at all
+        occurrences = [Occurrence(hours(-2), day), Occurrence(hours(5), hours(5)), Occurrence(hours(24), hours(26))]
+        result = freebusy(occurrences, day, hours(24))
+        self.assertEqual((result.busy, result.free), ([], [(day, hours(24))]))
+        occurrences.append(Occurrence(hours(23), hours(24)))
+        result = freebusy(occurrences, day, hours(24))
+        self.assertEqual((result.busy, result.free), ([(hours(23), hours(24))], [(day, hours(23))]))
+
+    def test_differential(self):
+        rnd = random.Random(7)
+        start = datetime(2010, 3, 1)
+        end = start + timedelta(minutes=600)
+        for i in range(100):
+            occurrences = []
+            for j in range(rnd.randint(0, 20)):
+                occurrence_start = start + timedelta(minutes=rnd.randint(-60, 660))
+                occurrences.append(Occurrence(occurrence_start,
+                    occurrence_start + timedelta(minutes=rnd.randint(0, 90)), rnd.random() < 0.2))
+            result = freebusy(occurrences, start, end, show_cancelled=False)
+            intervals = sorted(result.busy + result.free)
+            # the intervals tile the window...
+            self.assertEqual(intervals[0][0], start)
+            self.assertEqual(intervals[-1][1], end)
+            for a, b in zip(intervals, intervals[1:]):
+                self.assertEqual(a[1], b[0])
+            # ...and each minute is busy if an occurrence that isn't cancelled is going on
+            for minute in range(600):
+                t = start + timedelta(minutes=minute, seconds=30)
+                busy = [o for o in occurrences if not o.cancelled and o.start <= t < o.end]
+                self.assertEqual(bool([1 for a, b in result.busy if a <= t < b]), bool(busy))
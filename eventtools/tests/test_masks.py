@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from dateutil import rrule
+
+from eventtools.models import Rule
+from eventtools.masks import generator_masks, window_masks, matching_values, ALL_WEEKDAYS, ALL_TIMES, \
+    TIME_BUCKET_HOURS
+
+
+def _random_rule(rnd):
+    frequency = rnd.choice(['YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY', 'HOURLY'])
+    params = []
+    if rnd.random() < 0.5:
+        params.append('interval:%d' % rnd.choice([1, 2, 3, 7, 14]))
+    if rnd.random() < 0.4:
+        params.append('byweekday:%s' % ','.join([str(d) for d in rnd.sample(range(7), rnd.randint(1, 3))]))
+    if rnd.random() < 0.2:
+        params.append('bymonthday:%s' % ','.join([str(d) for d in rnd.sample([1, 2, 15, 28, 31, -1], rnd.randint(1, 2))]))
+    if rnd.random() < 0.3:
+        params.append('byhour:%s' % ','.join([str(h) for h in rnd.sample(range(24), rnd.randint(1, 3))]))
+    if rnd.random() < 0.2:
+        params.append('byminute:%s' % ','.join([str(m) for m in rnd.sample(range(60), rnd.randint(1, 3))]))
+    return Rule(frequency=frequency, params=';'.join(params))
+
+
+class TestMasks(TestCase):
+    """
+    A generator's masks must allow every day and time its occurrences are on, and a window's masks
+    must share a bit with those of every occurrence in it.
+    """
+
+    def test_masks(self):
+        tuesday_evening = generator_masks(Rule(frequency="WEEKLY"), datetime(2010, 3, 2, 18, 0), datetime(2010, 3, 2, 20, 0))
+        self.assertEqual(tuesday_evening, (1 << 1, 1 << (18 // TIME_BUCKET_HOURS)))
+        # running on past midnight
+        self.assertEqual(generator_masks(None, datetime(2010, 3, 6, 22, 0), datetime(2010, 3, 7, 1, 0)),
+            ((1 << 5) | (1 << 6), (1 << 7) | 1))
+        self.assertEqual(generator_masks(Rule(frequency="WEEKLY", params="byweekday:0,2"),
+            datetime(2010, 3, 1, 9, 0), datetime(2010, 3, 1, 10, 0))[0], (1 << 0) | (1 << 2))
+        self.assertEqual(generator_masks(Rule(frequency="MONTHLY"), datetime(2010, 3, 1, 9, 0),
+            datetime(2010, 3, 1, 10, 0))[0], ALL_WEEKDAYS)
+        self.assertEqual(generator_masks(Rule(frequency="HOURLY"), datetime(2010, 3, 1, 9, 0),
+            datetime(2010, 3, 1, 10, 0))[1], ALL_TIMES)
+        self.assertEqual(generator_masks(Rule(frequency="DAILY", complex_rule="RRULE:FREQ=DAILY"),
+            datetime(2010, 3, 1, 9, 0), datetime(2010, 3, 1, 10, 0)), (ALL_WEEKDAYS, ALL_TIMES))
+        
+        saturday_evening = window_masks(datetime(2010, 3, 6, 18, 0), datetime(2010, 3, 6, 23, 59))
+        self.assertEqual(saturday_evening, (1 << 5, (1 << 6) | (1 << 7)))
+        self.assertEqual(window_masks(datetime(2010, 3, 1), datetime(2010, 3, 8)), (ALL_WEEKDAYS, ALL_TIMES))
+        self.assertEqual(len(matching_values(1 << 5, ALL_WEEKDAYS)), 64)
+        self.assertEqual(matching_values(ALL_TIMES, ALL_TIMES), None)
+
+    def test_differential(self):
+        rnd = random.Random(5)
+        for i in range(300):
+            rule = rnd.random() < 0.85 and _random_rule(rnd) or None
+            start = datetime(2010, 1, 1) + timedelta(days=rnd.randint(0, 30), hours=rnd.randint(0, 23),
+                minutes=rnd.choice([0, 15, 30, 45]))
+            end = start + timedelta(minutes=rnd.choice([0, 30, 90, 300, 1440, 3000]))
+            weekday_mask, time_mask = generator_masks(rule, start, end)
+            starts = [start]
+            if rule is not None:
+                try:
+                    recurrence = rrule.rrule(getattr(rrule, rule.frequency), dtstart=start, **rule.get_params())
+                except ValueError:
+                    continue
+                starts += recurrence.between(start, start + timedelta(days=60), inc=True)[:100]
+            for occurrence_start in starts:
+                occurrence_end = occurrence_start + (end - start)
+                # every hour the occurrence is on (inclusive) is in the masks
+                t = occurrence_start.replace(minute=0, second=0)
+                while t <= occurrence_end:
+                    self.assertTrue(weekday_mask & (1 << t.weekday()))
+                    self.assertTrue(time_mask & (1 << (t.hour // TIME_BUCKET_HOURS)))
+                    t += timedelta(hours=1)
+                # and so windows that overlap it share bits with them
+                window_start = occurrence_start - timedelta(minutes=rnd.randint(0, 600))
+                window_end = window_start + timedelta(minutes=rnd.randint(0, 2000))
+                if window_start <= occurrence_end and window_end >= occurrence_start:
+                    window_weekdays, window_times = window_masks(window_start, window_end)
+                    self.assertTrue(window_weekdays & weekday_mask and window_times & time_mask)
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.memo import occurrence_memo, current_memo, memoized_expand, memoized_expand_batch, \
+    forget_exceptions
+
+
+class Rule(object):
+    def __init__(self, pk, frequency='DAILY', params='', complex_rule=''):
+        self.pk = pk
+        self.frequency = frequency
+        self.params = params
+        self.complex_rule = complex_rule
+
+
+class Generator(object):
+    def __init__(self, pk):
+        self.pk = pk
+
+
+def daily(rule, dtstart, start, end):
+    """ a stand-in for eventtools.vectorized.expand, for a daily rule """
+    days = max((start - dtstart).days, 0)
+    starts = []
+    d = dtstart + timedelta(days=days)
+    while d <= end:
+        if d >= start:
+            starts.append(d)
+        d += timedelta(days=1)
+    return starts
+
+
+class TestOccurrenceMemo(TestCase):
+    """
+    Expansions and exception lookups for windows inside one the memo has seen are sliced from it.
+    """
+
+    def test_expansions(self):
+        rule, dtstart = Rule(1), datetime(2010, 1, 1, 10, 0)
+        month = (datetime(2010, 3, 1), datetime(2010, 3, 31, 23, 59))
+        week = (datetime(2010, 3, 8), datetime(2010, 3, 14, 23, 59))
+        calls = []
+        def expand(*args):
+            calls.append(args)
+            return daily(*args)
+        
+        self.assertEqual(current_memo(), None)
+        self.assertEqual(memoized_expand(rule, dtstart, month[0], month[1], expand), daily(rule, dtstart, *month))
+        with occurrence_memo() as memo:
+            self.assertEqual(memoized_expand(rule, dtstart, month[0], month[1], expand), daily(rule, dtstart, *month))
+            self.assertEqual(memoized_expand(rule, dtstart, week[0], week[1], expand), daily(rule, dtstart, *week))
+            with occurrence_memo() as inner:
+                self.assertTrue(inner is memo)
+                self.assertEqual(memoized_expand(rule, dtstart, week[0], week[1], expand), daily(rule, dtstart, *week))
+            # another rule, or a changed one, is expanded
+            memoized_expand(Rule(2), dtstart, week[0], week[1], expand)
+            memoized_expand(Rule(1, params='interval:2'), dtstart, week[0], week[1], expand)
+            # a window the memo hasn't got all of is expanded, and then covers the ones inside it
+            memoized_expand(rule, dtstart, month[0], month[1] + timedelta(days=1), expand)
+            memoized_expand(rule, dtstart, month[0], month[1], expand)
+            self.assertEqual((memo.expansions, memo.expansions_saved), (4, 3))
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(current_memo(), None)
+
+    def test_batches(self):
+        dtstart = datetime(2010, 1, 1, 10, 0)
+        batch = lambda start, end: [(pk, Rule(pk), dtstart, start, end) for pk in range(3)]
+        expand_batch = lambda items: dict([(item[0], daily(*item[1:])) for item in items])
+        with occurrence_memo() as memo:
+            memoized_expand_batch(batch(datetime(2010, 3, 1), datetime(2010, 3, 31)), expand_batch)
+            result = memoized_expand_batch(batch(datetime(2010, 3, 8), datetime(2010, 3, 14)), expand_batch)
+            self.assertEqual(result[2], daily(None, dtstart, datetime(2010, 3, 8), datetime(2010, 3, 14)))
+            self.assertEqual((memo.expansions, memo.expansions_saved), (3, 3))
+
+    def test_exceptions(self):
+        generator = Generator(1)
+        rows = [('a row',)]
+        with occurrence_memo() as memo:
+            memo.set_exception_rows(generator, datetime(2010, 3, 1), datetime(2010, 3, 31), rows)
+            self.assertEqual(memo.get_exception_rows(generator, datetime(2010, 3, 8), datetime(2010, 3, 14)), rows)
+            self.assertEqual(memo.get_exception_rows(generator, datetime(2010, 3, 8)), None) # unbounded
+            self.assertEqual(memo.get_exception_rows(generator), None)
+            memo.set_exception_rows(generator, None, None, rows)
+            self.assertEqual(memo.get_exception_rows(generator, datetime(2010, 3, 8)), rows)
+            forget_exceptions(Generator, 1)
+            self.assertEqual(memo.get_exception_rows(generator, datetime(2010, 3, 8), datetime(2010, 3, 14)), None)
+            self.assertEqual(memo.exception_lookups_saved, 2)
@@ -8,8 +8,10 @@ from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor
 from eventtools.tests.eventtools_testapp.models import *
 from eventtools.tests.eventtools_testapp.forms import *
 from datetime import date, datetime, time, timedelta
+from itertools import islice
 from _inject_app import TestCaseWithApp as TestCase
-from eventtools.models import Rule
+from eventtools.models import Rule, VirtualOccurrence
+from eventtools.utils import EventListManager
 
 class TestModelMetaClass(TestCase):
 
@@ -514,3 +516,808 @@ class TestModel(TestCase):
             rule=None,
             result=0
         )
+
+    def test_virtual_occurrences(self):
+        """
+        Generated occurrences are lightweight VirtualOccurrences, until they are saved.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = LectureEvent.objects.create(location='The lecture hall', title='Lecture series on Moths')
+        gen = evt.create_generator(first_start_date=date(2010, 3, 1), first_start_time=time(10, 0), first_end_time=time(12, 0), rule=weekly)
+        
+        occs = evt.get_occurrences(datetime(2010, 3, 1), datetime(2010, 3, 15))
+        self.assertEqual(len(occs), 2)
+        occ = occs[1]
+        self.assertTrue(isinstance(occ, VirtualOccurrence))
+        self.assertEqual(occ.start, datetime(2010, 3, 8, 10, 0))
+        self.assertEqual(occ.end_time, time(12, 0))
+        self.assertEqual(occ.duration, timedelta(hours=2))
+        self.assertEqual(occ.merged_event.location, 'The lecture hall')
+        self.assertFalse(occ.is_varied)
+        self.assertEqual(occ.id, None)
+        
+        # varying and saving it makes a real row
+        occ.varied_start_time = time(11, 0)
+        self.assertTrue(occ.is_moved)
+        saved = occ.save()
+        self.assertTrue(isinstance(saved, LectureEventOccurrence))
+        self.assertEqual(occ.id, saved.id)
+        self.assertEqual(saved.unvaried_start, datetime(2010, 3, 8, 10, 0))
+        self.assertEqual(saved.start, datetime(2010, 3, 8, 11, 0))
+        
+        # and it comes back (via values_list) as a VirtualOccurrence with the same id
+        occs = evt.get_occurrences(datetime(2010, 3, 1), datetime(2010, 3, 15))
+        self.assertEqual([o.start for o in occs], [datetime(2010, 3, 1, 10, 0), datetime(2010, 3, 8, 11, 0)])
+        self.assertEqual(occs[1].id, saved.id)
+        self.assertTrue(occs[1].is_varied)
+        
+        # saving again updates the row rather than creating another one
+        occs[1].cancel()
+        self.assertEqual(gen.occurrences.count(), 1)
+        self.assertTrue(gen.occurrences.get().cancelled)
+
+    def test_exceptions_loaded_for_window(self):
+        """
+        Exceptional occurrences are loaded for all generators at once, and only the ones that can affect
+        the requested window, but moved occurrences still come and go correctly.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        start_date = date(2010, 3, 1) #it's a monday
+        end_date = start_date+timedelta(13)
+        
+        question_time = BroadcastEvent.objects.create(presenter = "Jim Appleface", studio=2)
+        answer_time = BroadcastEvent.objects.create(presenter = "Jim Appleface", studio=1)
+        question_gen = question_time.create_generator(first_start_date=start_date, first_start_time=time(10,00), first_end_time=time(12,00), rule=weekly)
+        answer_gen = answer_time.create_generator(first_start_date=start_date+timedelta(3), first_start_time=time(10,00), first_end_time=time(12,00), rule=weekly)
+        
+        # move the second question time out of the window
+        occ = question_gen.get_occurrence(datetime(2010, 3, 8, 10, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 4, 5)
+        occ.save()
+        # move a later answer time into the window
+        occ = answer_gen.get_occurrence(datetime(2010, 3, 25, 10, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 3, 13)
+        occ.save()
+        # and cancel another answer time, in the window
+        answer_gen.get_occurrence(datetime(2010, 3, 4, 10, 0)).cancel()
+        
+        occurrences = BroadcastEvent.objects.occurrences_between(start_date, end_date)
+        self.assertEqual([(o.generator, o.start, o.cancelled) for o in occurrences], [
+            (question_gen, datetime(2010, 3, 1, 10, 0), False),
+            (answer_gen, datetime(2010, 3, 4, 10, 0), True),
+            (answer_gen, datetime(2010, 3, 11, 10, 0), False),
+            (answer_gen, datetime(2010, 3, 13, 10, 0), False),
+        ])
+        self.assertEqual(occurrences, sorted(
+            question_time.get_occurrences(start_date, end_date) + answer_time.get_occurrences(start_date, end_date)))
+        
+        # the moved question time turns up where it was moved to
+        self.assertEqual([o.start for o in question_time.get_occurrences(date(2010, 4, 5), date(2010, 4, 6))],
+            [datetime(2010, 4, 5, 10, 0), datetime(2010, 4, 5, 10, 0)])
+
+    def test_occurrences_after(self):
+        """
+        The occurrences of many events can be streamed, lazily, in start order.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        start_date = date(2010, 3, 1) #it's a monday
+        
+        question_time = BroadcastEvent.objects.create(presenter = "Jim Appleface", studio=2)
+        answer_time = BroadcastEvent.objects.create(presenter = "Jim Appleface", studio=1)
+        question_time.create_generator(first_start_date=start_date, first_start_time=time(10,00), first_end_time=time(12,00), rule=weekly)
+        answer_gen = answer_time.create_generator(first_start_date=start_date+timedelta(3), first_start_time=time(10,00), first_end_time=time(12,00), rule=weekly)
+        answer_time.create_generator(first_start_date=start_date+timedelta(1), first_start_time=time(9,00), first_end_time=time(10,00))
+        answer_gen.get_occurrence(datetime(2010, 3, 11, 10, 0)).cancel()
+        
+        after = datetime(2010, 3, 1, 11, 0)
+        occurrences = BroadcastEvent.objects.occurrences_after(after, limit=5)
+        self.assertEqual([(o.start, o.cancelled) for o in occurrences], [
+            (datetime(2010, 3, 1, 10, 0), False), # still going at 11
+            (datetime(2010, 3, 2, 9, 0), False),
+            (datetime(2010, 3, 4, 10, 0), False),
+            (datetime(2010, 3, 8, 10, 0), False),
+            (datetime(2010, 3, 11, 10, 0), True),
+        ])
+        
+        occurrences = BroadcastEvent.objects.filter(studio=1).occurrences_after(after, limit=2, offset=1)
+        self.assertEqual([o.start for o in occurrences], [datetime(2010, 3, 4, 10, 0), datetime(2010, 3, 11, 10, 0)])
+        
+        # endless, but we can stop whenever we like
+        occurrences = EventListManager([question_time, answer_time]).occurrences_after(after)
+        self.assertEqual(len([o for o, i in zip(occurrences, range(100))]), 100)
+
+    def test_materialized_occurrences(self):
+        """
+        Events with materialize_occurrences = True keep a table of their occurrences up to the horizon, which
+        answers range queries.
+        """
+        from eventtools.models.materialized import as_occurrences
+        from eventtools.conf.settings import MATERIALIZED_OCCURRENCES_HORIZON
+        self.assertTrue(hasattr(ScreeningEvent, 'materialized_occurrences'))
+        self.assertFalse(hasattr(LectureEvent, '_materialized_model_name'))
+        
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        today = date.today()
+        film = ScreeningEvent.objects.create(film="Metropolis")
+        gen = film.create_generator(first_start_date=today, first_start_time=time(19,00), first_end_time=time(21,30), rule=daily)
+        film.create_generator(first_start_date=today+timedelta(2), first_start_time=time(14,00), first_end_time=time(16,30))
+        # a year of daily occurrences (give or take one, depending on the time of day), and the one-off
+        self.assertTrue(film.materialized_occurrences.count() in (MATERIALIZED_OCCURRENCES_HORIZON + 1, MATERIALIZED_OCCURRENCES_HORIZON + 2))
+        
+        start, end = datetime.combine(today, time.min), datetime.combine(today + timedelta(6), time.max)
+        expanded = film.get_occurrences(start, end)
+        self.assertEqual([(o.start, o.end) for o in ScreeningEvent.objects.occurrences_between(start, end)],
+            [(o.start, o.end) for o in expanded])
+        self.assertEqual(len(expanded), 8)
+        
+        # exceptions are kept in sync
+        occ = gen.get_occurrence(datetime.combine(today + timedelta(1), time(19,00)))
+        occ.varied_start_time = time(20,00)
+        occ.save()
+        gen.get_occurrence(datetime.combine(today + timedelta(3), time(19,00))).cancel()
+        occurrences = ScreeningEvent.objects.occurrences_on_day(today + timedelta(1))
+        self.assertEqual([o.start for o in occurrences], [datetime.combine(today + timedelta(1), time(20,00))])
+        self.assertEqual([o.cancelled for o in ScreeningEvent.objects.occurrences_on_day(today + timedelta(3))], [True])
+        gen.occurrences.get(unvaried_start_date=today + timedelta(1)).delete()
+        occurrences = ScreeningEvent.objects.occurrences_on_day(today + timedelta(1))
+        self.assertEqual([o.start for o in occurrences], [datetime.combine(today + timedelta(1), time(19,00))])
+        
+        # ...as are rules, by refresh_materialized: until then, their generators are expanded as usual
+        from eventtools.models.materialized import refresh_materialized
+        GeneratorModel = gen.__class__
+        daily.name = "every day"
+        daily.save()
+        self.assertNotEqual(GeneratorModel.objects.get(pk=gen.pk).materialized_until, None)
+        daily.params = "interval:2"
+        daily.save()
+        self.assertEqual(GeneratorModel.objects.get(pk=gen.pk).materialized_until, None)
+        self.assertEqual(len(ScreeningEvent.objects.occurrences_between(start, end)), 5)
+        self.assertEqual(refresh_materialized(GeneratorModel), 1)
+        self.assertEqual(len(ScreeningEvent.objects.materialized_between(start, end)), 5)
+        gen = GeneratorModel.objects.get(pk=gen.pk)
+        
+        # the rows can be paginated in SQL
+        rows = ScreeningEvent.objects.materialized_between(start, end)
+        self.assertEqual([o.start for o in as_occurrences(rows[1:3])],
+            [datetime.combine(today + timedelta(2), time(14,00)), datetime.combine(today + timedelta(2), time(19,00))])
+        
+        # saving a generator only rewrites the rows that change, after the first start that can have
+        pks = set(film.materialized_occurrences.values_list('pk', flat=True))
+        gen.save()
+        self.assertEqual(set(film.materialized_occurrences.values_list('pk', flat=True)), pks)
+        until = datetime.combine(today + timedelta(30), time.min)
+        gen.repeat_until = until
+        gen.save()
+        self.assertEqual(film.materialized_occurrences.filter(generator=gen, unvaried_start__gte=until).count(), 0)
+        self.assertTrue(pks.issuperset(film.materialized_occurrences.values_list('pk', flat=True)))
+        pks = set(film.materialized_occurrences.values_list('pk', flat=True))
+        gen.repeat_until = None
+        gen.save()
+        self.assertTrue(film.materialized_occurrences.filter(generator=gen, unvaried_start__gte=until).count() > 0)
+        self.assertEqual(set(film.materialized_occurrences.filter(unvaried_start__lt=until).values_list('pk', flat=True)), pks)
+        
+        # reading doesn't extend the table: until it is refreshed, the rules are expanded
+        GeneratorModel.objects.filter(pk=gen.pk).update(materialized_until=datetime.combine(today + timedelta(3), time.min))
+        film.materialized_occurrences.filter(generator=gen, unvaried_start__gte=datetime.combine(today + timedelta(3), time.min)).delete()
+        self.assertRaises(ValueError, ScreeningEvent.objects.materialized_between, start, end)
+        count = film.materialized_occurrences.count()
+        self.assertEqual(len(ScreeningEvent.objects.occurrences_between(start, end)), 5)
+        self.assertEqual(film.materialized_occurrences.count(), count)
+        self.assertEqual(refresh_materialized(GeneratorModel), 1)
+        self.assertTrue(film.materialized_occurrences.count() > count)
+        self.assertEqual(ScreeningEvent.objects.materialized_between(start, end).count(), 5)
+        self.assertEqual(refresh_materialized(GeneratorModel), 0)
+        
+        # beyond the horizon, the rules are expanded as usual
+        far = datetime.combine(today + timedelta(MATERIALIZED_OCCURRENCES_HORIZON + 10), time.min)
+        self.assertEqual(len(ScreeningEvent.objects.occurrences_between(far, far + timedelta(4))), 2)
+        self.assertRaises(ValueError, ScreeningEvent.objects.materialized_between, far, far + timedelta(4))
+
+    def test_effective_end(self):
+        """
+        Generators store the end of their last occurrence, taking COUNT and UNTIL into account, so that
+        they can be pruned in SQL.
+        """
+        evt = LessonEvent.objects.create(subject="Origami")
+        counted = Rule.objects.create(name="three times", frequency="WEEKLY", params="count:3")
+        until = Rule.objects.create(name="until Easter", complex_rule="RRULE:FREQ=DAILY;UNTIL=20100404T235959")
+        endless = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        
+        one_off = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0))
+        gen_counted = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=counted)
+        gen_until = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=until)
+        gen_endless = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=endless)
+        gen_repeat_until = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=endless, repeat_until=datetime(2010, 3, 20))
+        
+        self.assertEqual(one_off.effective_end, datetime(2010, 3, 1, 11, 0))
+        self.assertEqual(gen_counted.effective_end, datetime(2010, 3, 15, 11, 0))
+        self.assertEqual(gen_until.effective_end, datetime(2010, 4, 4, 11, 0))
+        self.assertEqual(gen_endless.effective_end, None)
+        self.assertEqual(gen_repeat_until.effective_end, datetime(2010, 3, 20, 1, 0))
+        
+        GeneratorModel = evt.GeneratorModel
+        def candidates(start, end):
+            return set(GeneratorModel.objects.filter(event=evt).potentially_between(start, end))
+        # (windows with a Monday in, which the weekday masks of the weekly generators allow)
+        self.assertEqual(candidates(datetime(2010, 3, 8), datetime(2010, 3, 9)), set([gen_counted, gen_until, gen_endless, gen_repeat_until]))
+        self.assertEqual(candidates(datetime(2010, 4, 4), datetime(2010, 4, 5)), set([gen_until, gen_endless]))
+        self.assertEqual(candidates(datetime(2011, 1, 3), datetime(2011, 1, 4)), set([gen_endless]))
+        # a Wednesday to Friday window only has the daily one
+        self.assertEqual(candidates(datetime(2010, 3, 10), datetime(2010, 3, 12)), set([gen_until]))
+        
+        # editing the rule updates its generators
+        counted.params = "count:5"
+        counted.save()
+        self.assertEqual(GeneratorModel.objects.get(pk=gen_counted.pk).effective_end, datetime(2010, 3, 29, 11, 0))
+        
+        self.assertEqual(len(LessonEvent.objects.occurrences_between(datetime(2010, 3, 22), datetime(2010, 3, 23))), 3)
+
+    def test_effective_end_with_moved_exceptions(self):
+        """
+        Generators whose exceptional occurrences have been moved past their effective_end, or before
+        their first start, aren't pruned from windows they have been moved into.
+        """
+        evt = LessonEvent.objects.create(subject="Papier-mache")
+        counted = Rule.objects.create(name="three times", frequency="WEEKLY", params="count:3")
+        one_off = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0))
+        gen_counted = evt.create_generator(start=datetime(2010, 3, 2, 10, 0), end=datetime(2010, 3, 2, 11, 0), rule=counted)
+        
+        def move(generator, unvaried_start, varied_start):
+            occ = generator.get_occurrence(unvaried_start)
+            occ.varied_start_date, occ.varied_start_time = varied_start.date(), varied_start.time()
+            end = varied_start + timedelta(hours=1)
+            occ.varied_end_date, occ.varied_end_time = end.date(), end.time()
+            occ.save()
+        move(one_off, datetime(2010, 3, 1, 10, 0), datetime(2010, 4, 1, 10, 0)) # a month later
+        move(gen_counted, datetime(2010, 3, 9, 10, 0), datetime(2010, 2, 25, 10, 0)) # before the first
+        
+        events = LessonEvent.objects.filter(pk=evt.pk)
+        self.assertEqual([(o.start, o.generator) for o in events.occurrences_between(datetime(2010, 4, 1), datetime(2010, 4, 2))],
+            [(datetime(2010, 4, 1, 10, 0), one_off)])
+        self.assertEqual([(o.start, o.generator) for o in events.occurrences_between(datetime(2010, 2, 25), datetime(2010, 2, 26))],
+            [(datetime(2010, 2, 25, 10, 0), gen_counted)])
+        self.assertEqual(events.occurrences_between(datetime(2010, 3, 1), datetime(2010, 3, 1, 23, 59)), [])
+        self.assertEqual([o.start for o in evt.get_occurrences(datetime(2010, 4, 1), datetime(2010, 4, 2))],
+            [datetime(2010, 4, 1, 10, 0)])
+
+    def test_occurrences_after_with_moved_exceptions(self):
+        """
+        Moved occurrences come out of occurrences_after at their new times, wherever they were moved from.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = LessonEvent.objects.create(subject="Knots")
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly)
+        
+        def move(unvaried_start, varied_start):
+            occ = gen.get_occurrence(unvaried_start)
+            occ.varied_start_date, occ.varied_start_time = varied_start.date(), varied_start.time()
+            end = varied_start + timedelta(hours=1)
+            occ.varied_end_date, occ.varied_end_time = end.date(), end.time()
+            occ.save()
+        move(datetime(2010, 3, 1, 10, 0), datetime(2010, 3, 10, 10, 0)) # from before `after`
+        move(datetime(2010, 3, 8, 10, 0), datetime(2010, 3, 16, 10, 0)) # past the next one
+        move(datetime(2010, 3, 22, 10, 0), datetime(2010, 3, 2, 10, 0)) # to before `after`
+        gen.get_occurrence(datetime(2010, 3, 29, 10, 0)).cancel()
+        
+        occurrences = gen.occurrences_after(datetime(2010, 3, 5))
+        self.assertEqual([(o.start, o.cancelled) for o in islice(occurrences, 5)], [
+            (datetime(2010, 3, 10, 10, 0), False),
+            (datetime(2010, 3, 15, 10, 0), False),
+            (datetime(2010, 3, 16, 10, 0), False),
+            (datetime(2010, 3, 29, 10, 0), True),
+            (datetime(2010, 4, 5, 10, 0), False),
+        ])
+        self.assertEqual([o.start for o in LessonEvent.objects.occurrences_after(datetime(2010, 3, 5), limit=3)],
+            [datetime(2010, 3, 10, 10, 0), datetime(2010, 3, 15, 10, 0), datetime(2010, 3, 16, 10, 0)])
+
+    def test_occurrences_after_pruning(self):
+        """
+        occurrences_after only streams the generators that haven't ended (or have occurrences moved
+        after the start), and loads their exceptional occurrences a window at a time.
+        """
+        from eventtools.models import occurrencegenerators
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        thrice = Rule.objects.create(name="three times", frequency="WEEKLY", params="count:3")
+        evt = LessonEvent.objects.create(subject="Calligraphy")
+        endless = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly)
+        ended = evt.create_generator(start=datetime(2010, 2, 1, 12, 0), end=datetime(2010, 2, 1, 13, 0), rule=thrice)
+        one_off = evt.create_generator(start=datetime(2010, 2, 3, 12, 0), end=datetime(2010, 2, 3, 13, 0))
+        moved = evt.create_generator(start=datetime(2010, 2, 4, 12, 0), end=datetime(2010, 2, 4, 13, 0))
+        occ = moved.get_occurrence(datetime(2010, 2, 4, 12, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 6, 7)
+        occ.save()
+        
+        streamed = []
+        class RecordingWindows(occurrencegenerators.ExceptionWindows):
+            def __init__(self, generators, after):
+                streamed.extend(generators)
+                super(RecordingWindows, self).__init__(generators, after)
+        occurrencegenerators.ExceptionWindows = RecordingWindows
+        try:
+            occurrences = list(LessonEvent.objects.occurrences_after(datetime(2010, 3, 5), limit=20))
+        finally:
+            occurrencegenerators.ExceptionWindows = RecordingWindows.__bases__[0]
+        self.assertEqual(set(streamed), set([endless, moved]))
+        self.assertEqual([o.start for o in occurrences if o.generator == moved], [datetime(2010, 6, 7, 12, 0)])
+        self.assertEqual(len(occurrences), 20)
+        self.assertEqual(occurrences, sorted(occurrences, key=lambda o: o.start))
+        
+        # exceptions are loaded for the windows the stream has reached
+        windows = occurrencegenerators.ExceptionWindows([endless, moved], datetime(2010, 3, 5))
+        stream = endless.occurrences_after(datetime(2010, 3, 5), exception_windows=windows)
+        self.assertEqual([o.start for o in islice(stream, 3)],
+            [datetime(2010, 3, 8, 10, 0), datetime(2010, 3, 15, 10, 0), datetime(2010, 3, 22, 10, 0)])
+        self.assertEqual(len(windows._loaded), 2)
+
+    def test_occurrence_page_pruning(self):
+        """
+        A page after a cursor only streams the generators that haven't ended by the cursor's position.
+        """
+        from eventtools.models import occurrencegenerators
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        thrice = Rule.objects.create(name="three times", frequency="DAILY", params="count:3")
+        evt = LessonEvent.objects.create(subject="Fencing")
+        endless = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=daily)
+        short = evt.create_generator(start=datetime(2010, 3, 1, 12, 0), end=datetime(2010, 3, 1, 13, 0), rule=thrice)
+        
+        after = datetime(2010, 3, 1)
+        expected = list(LessonEvent.objects.occurrences_after(after, limit=20))
+        occurrences, cursor = LessonEvent.objects.occurrence_page(10, after)
+        self.assertEqual(occurrences, expected[:10])
+        
+        streamed = []
+        class RecordingWindows(occurrencegenerators.ExceptionWindows):
+            def __init__(self, generators, after):
+                streamed.extend(generators)
+                super(RecordingWindows, self).__init__(generators, after)
+        occurrencegenerators.ExceptionWindows = RecordingWindows
+        try:
+            page, cursor = LessonEvent.objects.occurrence_page(10, cursor=cursor)
+        finally:
+            occurrencegenerators.ExceptionWindows = RecordingWindows.__bases__[0]
+        self.assertEqual(page, expected[10:])
+        self.assertEqual(streamed, [endless])
+
+    def test_shifting_occurrences(self):
+        """
+        When a generator's times change, its persisted occurrences are shifted with it, in bulk. Ones which
+        have been moved keep their varied times.
+        """
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        evt = LessonEvent.objects.create(subject="Calligraphy")
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 22, 0), end=datetime(2010, 3, 1, 23, 0), rule=daily)
+        gen.get_occurrence(datetime(2010, 3, 2, 22, 0)).cancel()
+        moved = gen.get_occurrence(datetime(2010, 3, 3, 22, 0))
+        moved.varied_start_time = time(20, 0)
+        moved.varied_end_time = time(21, 0)
+        moved.save()
+        
+        # later, and across midnight
+        self.assertEqual(gen.shift_occurrences(timedelta(hours=3), timedelta(hours=3, minutes=30)), 2)
+        cancelled, moved = gen.occurrences.order_by('unvaried_start_date')
+        self.assertEqual((cancelled.unvaried_start, cancelled.unvaried_end), (datetime(2010, 3, 3, 1, 0), datetime(2010, 3, 3, 2, 30)))
+        self.assertEqual((cancelled.start, cancelled.end), (datetime(2010, 3, 3, 1, 0), datetime(2010, 3, 3, 2, 30)))
+        self.assertEqual((moved.unvaried_start, moved.unvaried_end), (datetime(2010, 3, 4, 1, 0), datetime(2010, 3, 4, 2, 30)))
+        self.assertEqual((moved.start, moved.end), (datetime(2010, 3, 3, 20, 0), datetime(2010, 3, 3, 21, 0)))
+        
+        # saving the generator shifts them back
+        gen = evt.generators.get(pk=gen.pk)
+        gen.first_start_time = time(19, 0)
+        gen.first_end_time = time(19, 30)
+        gen.save()
+        cancelled, moved = gen.occurrences.order_by('unvaried_start_date')
+        self.assertEqual((cancelled.start, cancelled.end, cancelled.cancelled), (datetime(2010, 3, 2, 22, 0), datetime(2010, 3, 2, 23, 0), True))
+        self.assertEqual((moved.unvaried_start, moved.unvaried_end), (datetime(2010, 3, 3, 22, 0), datetime(2010, 3, 3, 23, 0)))
+        self.assertEqual(moved.start, datetime(2010, 3, 3, 20, 0))
+
+    def test_occurrences_count(self):
+        """
+        Occurrences are counted without being generated, taking exceptions into account.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = LessonEvent.objects.create(subject="Juggling")
+        self.assertEqual(evt.occurrences_count(), 0)
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly, repeat_until=date(2010, 12, 31))
+        evt.create_generator(start=datetime(2010, 3, 2, 10, 0), end=datetime(2010, 3, 2, 11, 0))
+        self.assertEqual(evt.occurrences_count(), 44 + 1)
+        
+        hidden = gen.get_occurrence(datetime(2010, 3, 8, 10, 0))
+        hidden.hide_from_lists = True
+        hidden.save()
+        gen.get_occurrence(datetime(2010, 3, 15, 10, 0)).cancel() # still counted
+        self.assertEqual(evt.occurrences_count(), 44)
+        self.assertEqual(evt.occurrences_count(), len(evt.get_occurrences(datetime(2010, 3, 1), datetime(2011, 1, 1))))
+        
+        evt.create_generator(start=datetime(2010, 3, 1, 18, 0), end=datetime(2010, 3, 1, 19, 0), rule=weekly)
+        self.assertEqual(evt.occurrences_count(), '&infin;')
+
+    def test_exclusion_calendars(self):
+        """
+        Occurrences aren't generated on the dates in the exclusion calendars of an event or a generator.
+        """
+        from eventtools.models import ExclusionCalendar
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        holidays = ExclusionCalendar.objects.create(name="Holidays")
+        holidays.periods.create(start_date=date(2010, 12, 25), end_date=date(2010, 12, 26))
+        holidays.periods.create(start_date=date(2011, 1, 1))
+        closures = ExclusionCalendar.objects.create(name="Closures")
+        closures.periods.create(start_date=date(2010, 12, 28))
+        
+        evt = LessonEvent.objects.create(subject="Knitting")
+        gen = evt.create_generator(start=datetime(2010, 12, 20, 10, 0), end=datetime(2010, 12, 20, 11, 0), rule=daily, repeat_until=datetime(2011, 1, 3, 10, 0))
+        evt.exclusion_calendars.add(holidays)
+        gen.exclusion_calendars.add(closures)
+        
+        days = lambda occurrences: [occ.start.day for occ in occurrences]
+        window = (datetime(2010, 12, 24), datetime(2011, 1, 2))
+        self.assertEqual(days(evt.get_occurrences(*window)), [24, 27, 29, 30, 31])
+        self.assertEqual(days(LessonEvent.objects.occurrences_between(*window)), [24, 27, 29, 30, 31])
+        self.assertEqual(days(evt.generators.occurrences_after(datetime(2010, 12, 24), limit=6)), [24, 27, 29, 30, 31, 2])
+        self.assertEqual(evt.occurrences_count(), 15 - 4)
+        
+        # compiled calendars are recompiled when their periods change
+        holidays.periods.create(start_date=date(2010, 12, 27))
+        self.assertEqual(days(evt.get_occurrences(*window)), [24, 29, 30, 31])
+        # and exceptional occurrences on excluded dates are still shown
+        occ = gen.get_occurrence(datetime(2010, 12, 28, 10, 0))
+        occ.varied_start_time = time(14, 0)
+        occ.varied_end_time = time(15, 0)
+        occ.save()
+        self.assertEqual([occ.start for occ in evt.get_occurrences(datetime(2010, 12, 28), datetime(2010, 12, 29))],
+            [datetime(2010, 12, 28, 14, 0)])
+        self.assertEqual(evt.occurrences_count(), 15 - 5 + 1)
+
+    def test_exception_counters(self):
+        """
+        Generators keep count of their exceptional Occurrences and the dates they span, so that the
+        ones without any (in a window) aren't queried for them.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = LessonEvent.objects.create(subject="Origami")
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly, repeat_until=datetime(2010, 6, 1))
+        self.assertEqual(gen.exception_count, 0)
+        self.assertFalse(gen._may_have_exceptions())
+        self.assertEqual(gen.get_changed_occurrences(), [])
+        
+        occ = gen.get_occurrence(datetime(2010, 3, 8, 10, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 3, 10)
+        occ.save()
+        saved = evt.generators.get(pk=gen.pk)
+        for g in (gen, saved):
+            self.assertEqual((g.exception_count, g.exceptions_first_date, g.exceptions_last_date),
+                (1, date(2010, 3, 8), date(2010, 3, 10)))
+        self.assertFalse(saved._may_have_exceptions(datetime(2010, 3, 11), datetime(2010, 4, 1)))
+        self.assertTrue(saved._may_have_exceptions(datetime(2010, 3, 9), datetime(2010, 3, 9)))
+        self.assertEqual([o.start for o in saved.get_occurrences(datetime(2010, 3, 7), datetime(2010, 3, 16))],
+            [datetime(2010, 3, 10, 10, 0), datetime(2010, 3, 15, 10, 0)])
+        self.assertEqual(evt.get_last_occurrence(), datetime(2010, 6, 1))
+        
+        # the counters survive saving an out of date instance
+        saved.save()
+        self.assertEqual(evt.generators.get(pk=gen.pk).exception_count, 1)
+        
+        gen.occurrences.all()[0].delete()
+        self.assertEqual(evt.generators.get(pk=gen.pk).exception_count, 0)
+        self.assertEqual(len(gen.get_occurrences(datetime(2010, 3, 7), datetime(2010, 3, 16))), 2)
+
+    def test_bulk_occurrences_between(self):
+        """
+        Bulk expansion gives the same occurrences as occurrences_between, as compact rows.
+        """
+        from eventtools import bulk
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = LessonEvent.objects.create(subject="Pottery")
+        for hour in (10, 12, 14):
+            gen = evt.create_generator(start=datetime(2010, 3, 1, hour, 0), end=datetime(2010, 3, 1, hour + 1, 0), rule=weekly)
+        evt.create_generator(start=datetime(2010, 3, 3, 10, 0), end=datetime(2010, 3, 3, 11, 0))
+        # (overlaps two slices, and comes out once)
+        evt.create_generator(start=datetime(2010, 3, 7, 23, 0), end=datetime(2010, 3, 8, 1, 0))
+        gen.get_occurrence(datetime(2010, 3, 8, 14, 0)).cancel()
+        
+        GeneratorModel = gen.__class__
+        start, end = datetime(2010, 3, 1), datetime(2010, 4, 1)
+        # (an in-memory test database can't be shared with worker processes; see test_bulk)
+        rows = list(GeneratorModel.objects.bulk_occurrences_between(start, end, workers=1, shard_size=1))
+        expected = sorted([bulk.occurrence_row(occ) for occ in GeneratorModel.objects.occurrences_between(start, end)])
+        self.assertEqual(rows, expected)
+        self.assertEqual(len(rows), 5 * 3 + 2)
+        self.assertEqual(list(GeneratorModel.objects.bulk_occurrences_between(start, end, workers=1, shard_size=2, slice_days=7)), expected)
+        self.assertEqual(list(GeneratorModel.objects.bulk_occurrences_between(start, end, workers=1, slice_days=None)), expected)
+        cancelled = [row for row in rows if row[-1] & bulk.CANCELLED]
+        self.assertEqual([(row[0], row[1]) for row in cancelled], [(datetime(2010, 3, 8, 14, 0), gen.pk)])
+        self.assertTrue(cancelled[0][4] > 0)
+
+    def test_occurrence_cache(self):
+        """
+        get_occurrences reads through the cache, and anything that changes an event's occurrences
+        makes its cached ones stale.
+        """
+        from eventtools import occurrence_cache
+        occurrence_cache.enabled = True
+        occurrence_cache.get_occurrence_cache().clear()
+        
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = BroadcastEvent.objects.create(presenter="Jimmy McBigmouth", studio=2)
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly)
+        start, end = datetime(2010, 3, 1), datetime(2010, 4, 1)
+        key = occurrence_cache.occurrences_key(BroadcastEvent, evt.pk, start, end)
+        self.assertEqual(occurrence_cache.get_occurrence_cache().get(key), None)
+        self.assertEqual(len(evt.get_occurrences(start, end)), 5)
+        from eventtools.codec import decode
+        self.assertEqual(decode(occurrence_cache.get_occurrence_cache().get(key), {gen.pk: gen}),
+            evt._get_occurrences(start, end))
+        self.assertEqual(len(evt.get_occurrences(start, end)), 5)
+        
+        # generators
+        gen.repeat_until = datetime(2010, 3, 20)
+        gen.save()
+        self.assertNotEqual(occurrence_cache.occurrences_key(BroadcastEvent, evt.pk, start, end), key)
+        self.assertEqual(len(evt.get_occurrences(start, end)), 3)
+        
+        # exceptional occurrences
+        occ = gen.get_occurrence(datetime(2010, 3, 8, 10, 0))
+        occ.cancel()
+        self.assertEqual([o.cancelled for o in evt.get_occurrences(start, end)], [False, True, False])
+        occ = gen.occurrences.all()[0]
+        occ.delete()
+        self.assertEqual([o.cancelled for o in evt.get_occurrences(start, end)], [False, False, False])
+        
+        # rules
+        weekly.params = "interval:2"
+        weekly.save()
+        self.assertEqual(len(evt.get_occurrences(start, end)), 2)
+        
+        # variations
+        variation = evt.create_variation(presenter="Amy Sub")
+        occ = gen.get_occurrence(datetime(2010, 3, 15, 10, 0))
+        occ.varied_event = variation
+        occ.save()
+        self.assertEqual([o.merged_event.presenter for o in evt.get_occurrences(start, end)], ["Jimmy McBigmouth", "Amy Sub"])
+        variation.presenter = "Alan Loco"
+        variation.save()
+        self.assertEqual([o.merged_event.presenter for o in evt.get_occurrences(start, end)], ["Jimmy McBigmouth", "Alan Loco"])
+        
+        # the cache can be turned off
+        occurrence_cache.enabled = False
+        self.assertEqual(len(evt.get_occurrences(start, end)), 2)
+        self.assertEqual(evt.get_occurrences(start, end), evt._get_occurrences(start, end))
+
+    def test_occurrence_cursors(self):
+        """
+        Paging with cursors gives the same occurrences as one stream, in a stable order, even when
+        several generators share a start.
+        """
+        from eventtools.cursors import decode_cursor
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        evt = LessonEvent.objects.create(subject="Juggling")
+        other = LessonEvent.objects.create(subject="Knitting")
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly)
+        other.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 12, 0), rule=weekly)
+        other.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 10, 30), rule=daily)
+        # moved onto the start of the next one
+        occ = gen.get_occurrence(datetime(2010, 3, 15, 10, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 3, 22)
+        occ.save()
+        
+        after = datetime(2010, 3, 1, 10, 15)
+        expected = list(LessonEvent.objects.occurrences_after(after, limit=40))
+        positions = [(o.start, o.generator.pk, o.unvaried_start) for o in expected]
+        self.assertEqual(positions, sorted(positions))
+        
+        for page_size in (1, 2, 3, 7):
+            occurrences, cursor = LessonEvent.objects.occurrence_page(page_size, after)
+            while len(occurrences) < 40:
+                page, cursor = LessonEvent.objects.occurrence_page(page_size, cursor=cursor)
+                self.assertEqual(len(page), page_size)
+                occurrences += page
+            self.assertEqual(occurrences[:40], expected)
+            self.assertEqual(decode_cursor(cursor)[0], after)
+        
+        # the iterator API takes cursors too
+        occurrences, cursor = LessonEvent.objects.occurrence_page(5, after)
+        self.assertEqual(list(LessonEvent.objects.occurrences_after(cursor=cursor, limit=5)), expected[5:10])
+        
+        # a stream that ends has no cursor after its last page
+        gen.repeat_until = datetime(2010, 3, 31)
+        gen.save()
+        occurrences, cursor = LessonEvent.objects.filter(pk=evt.pk).occurrence_page(3, datetime(2010, 3, 1))
+        self.assertNotEqual(cursor, None)
+        occurrences, cursor = LessonEvent.objects.filter(pk=evt.pk).occurrence_page(3, cursor=cursor)
+        self.assertEqual([o.start for o in occurrences], [datetime(2010, 3, 22, 10, 0), datetime(2010, 3, 29, 10, 0)])
+        self.assertEqual(cursor, None)
+        
+        self.assertRaises(ValueError, decode_cursor, "not a cursor")
+
+    def test_occurrences_at(self):
+        """
+        "What's on now" queries find the same occurrences as occurrences_between, but only load the
+        generators that can be live.
+        """
+        from eventtools.spans import generator_spans
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        evt = LessonEvent.objects.create(subject="Yoga")
+        tuesdays = evt.create_generator(start=datetime(2010, 3, 2, 18, 0), end=datetime(2010, 3, 2, 20, 0), rule=weekly)
+        saturdays = evt.create_generator(start=datetime(2010, 3, 6, 18, 0), end=datetime(2010, 3, 6, 19, 0), rule=weekly)
+        mornings = evt.create_generator(start=datetime(2010, 3, 1, 7, 0), end=datetime(2010, 3, 1, 8, 0), rule=daily,
+            repeat_until=datetime(2010, 3, 31))
+        one_off = evt.create_generator(start=datetime(2010, 3, 13, 17, 0), end=datetime(2010, 3, 13, 21, 0))
+        GeneratorModel = tuesdays.__class__
+        
+        saturday_evening = datetime(2010, 3, 13, 18, 30)
+        self.assertEqual(generator_spans(GeneratorModel).live_between(saturday_evening, saturday_evening),
+            set([saturdays.pk, one_off.pk]))
+        self.assertEqual(LessonEvent.objects.occurrences_at(saturday_evening),
+            LessonEvent.objects.occurrences_between(saturday_evening, saturday_evening))
+        self.assertEqual([o.generator.pk for o in LessonEvent.objects.occurrences_at(saturday_evening)],
+            [one_off.pk, saturdays.pk])
+        
+        # starting in the next hour
+        self.assertEqual([o.start for o in LessonEvent.objects.occurrences_starting_between(
+            datetime(2010, 3, 16, 17, 30), datetime(2010, 3, 16, 18, 30))], [datetime(2010, 3, 16, 18, 0)])
+        self.assertEqual(LessonEvent.objects.occurrences_starting_between(
+            datetime(2010, 4, 1, 6, 30), datetime(2010, 4, 1, 7, 30)), [])
+        
+        # the index follows saves, deletes and rule changes
+        mornings.repeat_until = datetime(2010, 4, 30)
+        mornings.save()
+        self.assertEqual(len(LessonEvent.objects.occurrences_starting_between(
+            datetime(2010, 4, 1, 6, 30), datetime(2010, 4, 1, 7, 30))), 1)
+        one_off.delete()
+        self.assertEqual(generator_spans(GeneratorModel).live_between(saturday_evening, saturday_evening),
+            set([saturdays.pk]))
+        weekly.params = "interval:2"
+        weekly.save()
+        self.assertEqual(LessonEvent.objects.occurrences_at(saturday_evening), [])
+        # (saving a rule updates its generators' effective_ends without signals)
+        thrice = Rule.objects.create(name="three times", frequency="WEEKLY", params="count:3")
+        mondays = evt.create_generator(start=datetime(2010, 3, 1, 12, 0), end=datetime(2010, 3, 1, 13, 0), rule=thrice)
+        monday_lunchtime = datetime(2010, 3, 29, 12, 30)
+        self.assertEqual(LessonEvent.objects.occurrences_at(monday_lunchtime), [])
+        thrice.params = ""
+        thrice.save()
+        self.assertEqual([o.generator.pk for o in LessonEvent.objects.occurrences_at(monday_lunchtime)], [mondays.pk])
+        self.assertEqual([o.start for o in LessonEvent.objects.occurrences_starting_between(
+            datetime(2010, 4, 5, 11, 30), datetime(2010, 4, 5, 12, 30))], [datetime(2010, 4, 5, 12, 0)])
+        
+        # changes the index can't hear about (update()s, or other processes' with a per-process
+        # occurrence cache) are seen once it is SPAN_INDEX_TTL seconds old
+        from eventtools.conf.settings import SPAN_INDEX_TTL
+        GeneratorModel.objects.filter(pk=mornings.pk).update(repeat_until=None, effective_end=None)
+        may_morning = (datetime(2010, 5, 3, 6, 30), datetime(2010, 5, 3, 7, 30))
+        self.assertEqual(LessonEvent.objects.occurrences_starting_between(*may_morning), [])
+        generator_spans(GeneratorModel)._built -= SPAN_INDEX_TTL
+        self.assertEqual([o.generator.pk for o in LessonEvent.objects.occurrences_starting_between(*may_morning)],
+            [mornings.pk])
+        
+        # occurrences moved into the window are found, too
+        occ = tuesdays.get_occurrence(datetime(2010, 3, 2, 18, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 3, 13)
+        occ.save()
+        self.assertEqual([o.generator.pk for o in LessonEvent.objects.occurrences_at(saturday_evening)], [tuesdays.pk])
+
+    def test_get_clashes(self):
+        """
+        An event's clashes are the occurrences of different generators that start at the same time
+        or overlap.
+        """
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        evt = LessonEvent.objects.create(subject="Tai Chi")
+        mornings = evt.create_generator(start=datetime(2010, 3, 1, 9, 0), end=datetime(2010, 3, 1, 10, 0), rule=daily,
+            repeat_until=datetime(2010, 3, 7))
+        same = evt.create_generator(start=datetime(2010, 3, 3, 9, 0), end=datetime(2010, 3, 3, 10, 0))
+        overlapping = evt.create_generator(start=datetime(2010, 3, 5, 9, 30), end=datetime(2010, 3, 5, 11, 0))
+        evt.create_generator(start=datetime(2010, 3, 6, 10, 0), end=datetime(2010, 3, 6, 11, 0)) # touches
+        
+        report = evt.get_clashes(datetime(2010, 3, 1), datetime(2010, 3, 8))
+        self.assertEqual(report.clashing_starts(), set([datetime(2010, 3, 3, 9, 0)]))
+        self.assertEqual([(a.start, b.start) for a, b in report.overlaps],
+            [(datetime(2010, 3, 5, 9, 0), datetime(2010, 3, 5, 9, 30))])
+        self.assertEqual(report.sources(), set([mornings.pk, same.pk, overlapping.pk]))
+        
+        # cancelled occurrences don't clash
+        occ = same.get_occurrence(datetime(2010, 3, 3, 9, 0))
+        occ.cancel()
+        self.assertEqual(evt.get_clashes(datetime(2010, 3, 1), datetime(2010, 3, 8)).clashing_starts(), set())
+
+    def test_masks_prefilter(self):
+        """
+        Day and time-slot queries only load the generators whose masks allow occurrences in the
+        window, and the ones with exceptional occurrences moved into it.
+        """
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = LessonEvent.objects.create(subject="Pottery")
+        generators = []
+        for day in range(1, 8): # 2010-03-01 is a Monday
+            generators.append(evt.create_generator(start=datetime(2010, 3, day, 18, 0),
+                end=datetime(2010, 3, day, 20, 0), rule=weekly))
+            generators.append(evt.create_generator(start=datetime(2010, 3, day, 9, 0),
+                end=datetime(2010, 3, day, 10, 0), rule=weekly))
+        GeneratorModel = generators[0].__class__
+        saturday, saturday_evening = datetime(2010, 3, 13), datetime(2010, 3, 13, 18, 0)
+        
+        self.assertEqual(GeneratorModel.objects.potentially_between(saturday, saturday + timedelta(hours=23)).count(), 2)
+        self.assertEqual(GeneratorModel.objects.potentially_between(saturday_evening, saturday_evening).count(), 1)
+        self.assertEqual([o.start for o in LessonEvent.objects.occurrences_between(saturday_evening,
+            saturday_evening + timedelta(hours=5))], [saturday_evening])
+        self.assertEqual(len(LessonEvent.objects.on_day(date(2010, 3, 13))), 1)
+        self.assertEqual(len(LessonEvent.objects.occurrences_on_day(date(2010, 3, 13))), 2)
+        
+        # a Tuesday morning moved to Saturday evening
+        occ = generators[3].get_occurrence(datetime(2010, 3, 9, 9, 0))
+        occ.varied_start_date = occ.varied_end_date = date(2010, 3, 13)
+        occ.varied_start_time, occ.varied_end_time = time(19, 0), time(20, 0)
+        occ.save()
+        self.assertEqual([o.start for o in LessonEvent.objects.occurrences_between(saturday_evening,
+            saturday_evening + timedelta(hours=5))], [saturday_evening, datetime(2010, 3, 13, 19, 0)])
+        
+        # masks follow the rule
+        weekly.frequency = "DAILY"
+        weekly.save()
+        next_saturday_evening = saturday_evening + timedelta(days=7)
+        self.assertEqual(GeneratorModel.objects.potentially_between(next_saturday_evening, next_saturday_evening).count(), 7)
+
+    def test_occurrence_memo(self):
+        """
+        Inside an occurrence memo, windows inside ones that have been expanded are sliced from them,
+        with the same results, and exceptions saved meanwhile are seen.
+        """
+        from eventtools.memo import occurrence_memo
+        daily = Rule.objects.create(name="daily", frequency="DAILY")
+        evt = LessonEvent.objects.create(subject="Sketching")
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=daily)
+        occ = gen.get_occurrence(datetime(2010, 3, 10, 10, 0))
+        occ.cancel()
+        month = (datetime(2010, 3, 1), datetime(2010, 3, 31, 23, 59))
+        week = (datetime(2010, 3, 8), datetime(2010, 3, 14, 23, 59))
+        expected_week = evt._get_occurrences(*week)
+        
+        with occurrence_memo() as memo:
+            self.assertEqual(len(evt._get_occurrences(*month)), 31)
+            self.assertEqual(evt._get_occurrences(*week), expected_week)
+            self.assertEqual(LessonEvent.objects.occurrences_between(*week), expected_week)
+            self.assertEqual(memo.expansions, 1)
+            self.assertEqual(memo.expansions_saved, 2)
+            self.assertTrue(memo.exception_lookups_saved >= 1)
+            
+            occ = gen.get_occurrence(datetime(2010, 3, 11, 10, 0))
+            occ.cancel()
+            self.assertEqual(len([o for o in evt._get_occurrences(*week) if o.cancelled]), 2)
+
+    def test_warm_occurrence_cache(self):
+        """
+        warm_occurrence_cache caches each event's occurrences for the month pages, as get_occurrences
+        would, and skips the windows that are cached for the event's current schedule version.
+        """
+        from eventtools import occurrence_cache
+        from eventtools.codec import decode
+        from eventtools.warming import warm_occurrence_cache
+        occurrence_cache.enabled = True
+        cache = occurrence_cache.get_occurrence_cache()
+        cache.clear()
+        
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        evt = BroadcastEvent.objects.create(presenter="Jimmy McBigmouth", studio=2)
+        gen = evt.create_generator(start=datetime(2010, 3, 1, 10, 0), end=datetime(2010, 3, 1, 11, 0), rule=weekly)
+        evt2 = BroadcastEvent.objects.create(presenter="Amy Sub", studio=1)
+        
+        reports = list(warm_occurrence_cache([BroadcastEvent], months=2, chunk_size=1, start=datetime(2010, 3, 15)))
+        self.assertEqual([(r.number, r.events, r.warmed, r.skipped) for r in reports], [(1, 1, 2, 0), (2, 1, 2, 0)])
+        march, april = (datetime(2010, 3, 1), datetime(2010, 4, 1)), (datetime(2010, 4, 1), datetime(2010, 5, 1))
+        for window in (march, april):
+            key = occurrence_cache.occurrences_key(BroadcastEvent, evt.pk, *window)
+            self.assertEqual(decode(cache.get(key), {gen.pk: gen}), evt._get_occurrences(*window))
+        self.assertEqual(len(evt.get_occurrences(*march)), 5)
+        self.assertEqual(evt2.get_occurrences(*april), [])
+        
+        reports = list(warm_occurrence_cache([BroadcastEvent], months=2, start=datetime(2010, 3, 15)))
+        self.assertEqual([(r.warmed, r.skipped) for r in reports], [(0, 4)])
+        
+        # a change makes the event's windows stale
+        gen.repeat_until = datetime(2010, 3, 20)
+        gen.save()
+        reports = list(warm_occurrence_cache([BroadcastEvent], months=2, start=datetime(2010, 3, 15)))
+        self.assertEqual([(r.warmed, r.skipped) for r in reports], [(2, 2)])
+        self.assertEqual(len(evt.get_occurrences(*march)), 3)
+        occurrence_cache.enabled = False
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+from eventtools.models import Rule
+from eventtools.rrule_cache import LRUCache, rrule_cache, get_rrule
+from _inject_app import TestCaseWithApp as TestCase
+
+
+class TestLRUCache(TestCase):
+
+    def test_eviction_and_counters(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1) # 'b' is now least recently used
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {
+            'hits': 2, 'misses': 1, 'evictions': 1, 'size': 2, 'maxsize': 2,
+        })
+
+
+class TestRRuleCache(TestCase):
+
+    def setUp(self):
+        super(TestRRuleCache, self).setUp()
+        rrule_cache.clear()
+
+    def test_compiled_rules_are_shared(self):
+        weekly = Rule.objects.create(name="weekly", frequency="WEEKLY")
+        start = datetime(2010, 3, 1, 10, 0)
+        compiled = get_rrule(weekly, start)
+        self.assertTrue(get_rrule(weekly, start) is compiled)
+        self.assertEqual(rrule_cache.stats()['hits'], 1)
+        self.assertEqual(compiled.between(start, start + timedelta(14), inc=True),
+            [start, start + timedelta(7), start + timedelta(14)])
+
+    def test_saving_a_rule_invalidates(self):
+        rule = Rule.objects.create(name="often", frequency="WEEKLY")
+        start = datetime(2010, 3, 1, 10, 0)
+        get_rrule(rule, start)
+        rule.frequency = "DAILY"
+        rule.save()
+        self.assertEqual(len(rrule_cache), 0)
+        self.assertEqual(get_rrule(rule, start).after(start),
+            start + timedelta(1))
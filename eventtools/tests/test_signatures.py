@@ -0,0 +1,85 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.models import Rule
+from eventtools.rrule_cache import get_rrule
+from eventtools.signatures import signature, expand_shared, expansion_scope, \
+    signature_cache
+from test_fastforward import _random_rule
+
+
+class TestSignatures(TestCase):
+    """
+    Generators with the same signature must be expanded once between them,
+    and each must get exactly the occurrences it would have on its own.
+    """
+
+    def setUp(self):
+        signature_cache.clear()
+        self.expansions = 0
+
+    def _expand(self, rule, dtstart, start, end):
+        self.expansions += 1
+        return get_rrule(rule, dtstart).between(start, end, inc=True)
+
+    def test_signature(self):
+        weekly = Rule(frequency="WEEKLY")
+        fortnightly = Rule(frequency="WEEKLY", params="interval:2")
+        tuesday = datetime(2010, 3, 2, 10, 0)
+        self.assertEqual(signature(weekly, tuesday), signature(weekly, tuesday + timedelta(weeks=5)))
+        self.assertNotEqual(signature(weekly, tuesday), signature(weekly, tuesday + timedelta(days=1)))
+        self.assertNotEqual(signature(weekly, tuesday), signature(weekly, tuesday + timedelta(hours=1)))
+        self.assertEqual(signature(fortnightly, tuesday), signature(fortnightly, tuesday + timedelta(weeks=4)))
+        self.assertNotEqual(signature(fortnightly, tuesday), signature(fortnightly, tuesday + timedelta(weeks=5)))
+        # identical rules share, whichever Rule they are
+        self.assertEqual(signature(weekly, tuesday), signature(Rule(frequency="WEEKLY", params="byweekday:1"), tuesday))
+
+        self.assertEqual(signature(Rule(frequency="WEEKLY", params="count:5"), tuesday), None)
+        self.assertEqual(signature(Rule(frequency="MONTHLY", params="byweekday:0;bysetpos:1"), tuesday), None)
+        self.assertEqual(signature(Rule(complex_rule="FREQ=YEARLY;BYEASTER=0"), tuesday), None)
+
+    def test_differential(self):
+        rnd = random.Random(5)
+        for i in range(50):
+            rules = [_random_rule(rnd) for j in range(2)]
+            items = []
+            for key in range(15):
+                rule = rnd.choice(rules)
+                dtstart = datetime(2009, 1, 1) + timedelta(days=rnd.randint(0, 700),
+                    hours=rnd.choice([9, 18]), minutes=rnd.choice([0, 30]))
+                start = datetime(2010, 1, 1) + timedelta(days=rnd.randint(0, 60),
+                    minutes=rnd.randint(0, 24 * 60 - 1))
+                end = start + timedelta(days=(rule.frequency == 'HOURLY' and 1 or 31))
+                items.append((key, rule, dtstart, start, end))
+            result, rest = expand_shared(items, self._expand)
+            for key, rule, dtstart, start, end in items:
+                if key in result:
+                    self.assertEqual(result[key], get_rrule(rule, dtstart).between(start, end, inc=True),
+                        "%s %s from %s" % (rule.frequency, rule.params, dtstart))
+            self.assertEqual(len(result) + len(rest), len(items))
+
+    def test_expanded_once(self):
+        weekly = Rule(frequency="WEEKLY")
+        items = [(i, weekly, datetime(2009, 1, 6, 10, 0) + timedelta(weeks=i), datetime(2010, 3, 1), datetime(2010, 4, 1))
+            for i in range(100)]
+        result, rest = expand_shared(items, self._expand)
+        self.assertEqual(self.expansions, 1)
+        self.assertEqual(rest, [])
+        self.assertEqual(result[0], [datetime(2010, 3, d, 10, 0) for d in (2, 9, 16, 23, 30)])
+        # a later generator only gets its own occurrences
+        self.assertEqual(result[64], [datetime(2010, 3, d, 10, 0) for d in (30,)])
+        self.assertEqual(result[99], [])
+
+        # the same window is found in the process-wide cache...
+        expand_shared(items, self._expand)
+        self.assertEqual(self.expansions, 1)
+        # ...and in the request's, if the process-wide cache is cleared
+        with expansion_scope():
+            expand_shared(items, self._expand)
+            signature_cache.clear()
+            expand_shared(items, self._expand)
+            self.assertEqual(self.expansions, 1)
+        signature_cache.clear()
+        expand_shared(items, self._expand)
+        self.assertEqual(self.expansions, 2)
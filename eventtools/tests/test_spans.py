@@ -0,0 +1,48 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools import spans
+from eventtools.spans import SpanIndex
+
+
+class TestSpanIndex(TestCase):
+    """
+    The index finds the same spans as checking every one, as spans are added, moved and removed.
+    """
+
+    def _random_span(self, rnd):
+        start = datetime(2010, 1, 1) + timedelta(hours=rnd.randint(0, 24 * 365))
+        if rnd.random() < 0.2:
+            return start, None
+        return start, start + timedelta(hours=rnd.randint(0, 24 * 60))
+
+    def _check(self, index, expected, rnd):
+        for i in range(20):
+            start = datetime(2010, 1, 1) + timedelta(hours=rnd.randint(-24 * 30, 24 * 400))
+            end = start + timedelta(minutes=rnd.choice([0, 60, 60 * 24 * 7]))
+            brute_force = [pk for pk, (s, e) in expected.items() if s <= end and (e is None or e >= start)]
+            self.assertEqual(sorted(index.between(start, end)), sorted(brute_force))
+
+    def test_differential(self):
+        rnd = random.Random(3)
+        expected = {}
+        for pk in range(1000):
+            expected[pk] = self._random_span(rnd)
+        index = SpanIndex([(pk, s, e) for pk, (s, e) in expected.items()])
+        self.assertEqual(len(index), 1000)
+        self._check(index, expected, rnd)
+        for i in range(3000):
+            pk = rnd.randint(0, 1500)
+            if rnd.random() < 0.3:
+                index.remove(pk)
+                expected.pop(pk, None)
+            else:
+                expected[pk] = self._random_span(rnd)
+                index.add(pk, *expected[pk])
+            if i % 300 == 0:
+                self._check(index, expected, rnd)
+        self.assertEqual(len(index), len(expected))
+        self._check(index, expected, rnd)
+        # lots of blocks have been split along the way
+        self.assertTrue(len(index._blocks) > len(expected) / (2 * spans.BLOCK_SIZE))
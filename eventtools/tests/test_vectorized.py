@@ -0,0 +1,100 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from eventtools.models import Rule
+from eventtools.vectorized import numpy, rule_spec, expand, expand_batch, \
+    dateutil_expand
+
+
+def _random_rule(rnd):
+    params = []
+    if rnd.random() < 0.5:
+        params.append('interval:%d' % rnd.randint(1, 4))
+    if rnd.random() < 0.3:
+        params.append('count:%d' % rnd.randint(1, 40))
+    if rnd.random() < 0.4:
+        params.append('byweekday:%s' % ','.join(
+            [str(d) for d in rnd.sample(range(7), rnd.randint(1, 3))]))
+    if rnd.random() < 0.3:
+        params.append('bymonthday:%s' % ','.join([str(d) for d in
+            rnd.sample([1, 2, 15, 28, 29, 30, 31, -1, -2, -15], rnd.randint(1, 2))]))
+    if rnd.random() < 0.3:
+        params.append('bymonth:%s' % ','.join(
+            [str(m) for m in rnd.sample(range(1, 13), rnd.randint(1, 4))]))
+    return Rule(
+        frequency=rnd.choice(['DAILY', 'WEEKLY', 'MONTHLY']),
+        params=';'.join(params),
+    )
+
+def _random_datetime(rnd, base, days):
+    return base + timedelta(days=rnd.randint(0, days),
+        minutes=rnd.randint(0, 24 * 60 - 1))
+
+
+class TestVectorizedExpansion(TestCase):
+    """
+    The vectorized engine must give exactly the same results as dateutil.
+    """
+
+    def test_supported_rules(self):
+        self.assertEqual(rule_spec(Rule(frequency="YEARLY")), None)
+        self.assertEqual(rule_spec(Rule(frequency="WEEKLY", params="byhour:1")), None)
+        self.assertEqual(rule_spec(Rule(frequency="WEEKLY",
+            complex_rule="FREQ=WEEKLY;BYDAY=MO")), None)
+        if numpy is not None:
+            spec = rule_spec(Rule(frequency="WEEKLY", params="interval:2;byweekday:1,3"))
+            self.assertEqual((spec.interval, spec.byweekday), (2, (1, 3)))
+
+    def test_fallback(self):
+        rule = Rule(frequency="YEARLY", params="byeaster:0")
+        start = datetime(2010, 1, 1, 10, 0)
+        self.assertEqual(expand(rule, start, start, datetime(2012, 1, 1)),
+            [datetime(2010, 4, 4, 10, 0), datetime(2011, 4, 24, 10, 0)])
+
+    def test_month_ends(self):
+        # months without a 31st are skipped, not clamped
+        rule = Rule(frequency="MONTHLY")
+        start = datetime(2010, 1, 31, 9, 30)
+        self.assertEqual(expand(rule, start, start, datetime(2010, 5, 31, 9, 30)), [
+            datetime(2010, 1, 31, 9, 30),
+            datetime(2010, 3, 31, 9, 30),
+            datetime(2010, 5, 31, 9, 30),
+        ])
+
+    def test_window_edges_are_inclusive(self):
+        rule = Rule(frequency="DAILY")
+        start = datetime(2010, 3, 1, 10, 0)
+        self.assertEqual(
+            expand(rule, start, datetime(2010, 3, 2, 10, 0), datetime(2010, 3, 4, 10, 0)),
+            dateutil_expand(rule, start, datetime(2010, 3, 2, 10, 0), datetime(2010, 3, 4, 10, 0)),
+        )
+
+    def test_differential(self):
+        rnd = random.Random(1)
+        base = datetime(2008, 1, 1)
+        for i in range(2000):
+            rule = _random_rule(rnd)
+            dtstart = _random_datetime(rnd, base, 1500)
+            start = _random_datetime(rnd, base, 1800)
+            end = _random_datetime(rnd, start, 400)
+            self.assertEqual(
+                expand(rule, dtstart, start, end),
+                dateutil_expand(rule, dtstart, start, end),
+                "%s %s from %s, between %s and %s" % (
+                    rule.frequency, rule.params, dtstart, start, end)
+            )
+
+    def test_differential_batch(self):
+        rnd = random.Random(2)
+        base = datetime(2008, 1, 1)
+        items = []
+        for i in range(300):
+            rule = _random_rule(rnd)
+            start = _random_datetime(rnd, base, 1000)
+            items.append((i, rule, _random_datetime(rnd, base, 900),
+                start, _random_datetime(rnd, start, 300)))
+        result = expand_batch(items)
+        for key, rule, dtstart, start, end in items:
+            self.assertEqual(result[key],
+                dateutil_expand(rule, dtstart, start, end))
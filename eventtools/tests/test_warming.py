@@ -0,0 +1,20 @@
+from datetime import datetime
+from unittest import TestCase
+
+from eventtools.warming import month_windows, ChunkReport
+
+
+class TestWarming(TestCase):
+
+    def test_month_windows(self):
+        self.assertEqual(month_windows(3, datetime(2010, 11, 20, 15, 30)), [
+            (datetime(2010, 11, 1), datetime(2010, 12, 1)),
+            (datetime(2010, 12, 1), datetime(2011, 1, 1)),
+            (datetime(2011, 1, 1), datetime(2011, 2, 1)),
+        ])
+        self.assertEqual(month_windows(0, datetime(2010, 11, 20)), [])
+        self.assertEqual(len(month_windows(2)), 2)
+
+    def test_chunk_report(self):
+        report = ChunkReport('tests.lecture', 2, 200, 1187, 13, 0.8412)
+        self.assertEqual(str(report), 'tests.lecture chunk 2: 200 events, 1200 windows (1187 cached, 13 already cached) in 0.84s')
@@ -1,5 +1,6 @@
 import datetime
 import heapq
+from itertools import islice
 from django.contrib.contenttypes.models import ContentType
 from django.http import HttpResponseRedirect
 from django.conf import settings
@@ -14,39 +15,53 @@ class EventListManager(object):
     def __init__(self, events):
         self.events = events
 
-    # Not used - needs fixing to work with monkeypatched occurence models.
-    # def occurrences_after(self, after=None):
-    #      """
-    #      It is often useful to know what the next occurrence is given a list of
-    #      events.  This function produces a generator that yields the
-    #      the most recent occurrence after the date ``after`` from any of the
-    #      events in ``self.events``
-    #      """
-    #      from events.models import Occurrence
-    #      if after is None:
-    #          after = datetime.datetime.now()
-    #      occ_replacer = OccurrenceReplacer(
-    #          Occurrence.objects.filter(event__in = self.events))
-    #      generators = [event._occurrences_after_generator(after) for event in self.events]
-    #      occurrences = []
-    # 
-    #      for generator in generators:
-    #          try:
-    #              heapq.heappush(occurrences, (generator.next(), generator))
-    #          except StopIteration:
-    #              pass
-    # 
-    #      while True:
-    #          if len(occurrences) == 0: raise StopIteration
-    # 
-    #          generator=occurrences[0][1]
-    # 
-    #          try:
-    #              next = heapq.heapreplace(occurrences, (generator.next(), generator))[0]
-    #          except StopIteration:
-    #              next = heapq.heappop(occurrences)[0]
-    #          yield occ_replacer.get_occurrence(next)
- 
+    def occurrences_after(self, after=None, limit=None, offset=0):
+        """
+        It is often useful to know what the next occurrence is given a list of
+        events.  This function produces a generator that yields the
+        the most recent occurrence after the date ``after`` from any of the
+        events in ``self.events``
+        """
+        if hasattr(self.events, 'occurrences_after'): # an EventQuerySetBase
+            return self.events.occurrences_after(after, limit, offset)
+        occurrences = merge_occurrences([
+            event.generators.occurrences_after(after) for event in self.events
+        ])
+        if limit is not None:
+            return islice(occurrences, offset, offset + limit)
+        return islice(occurrences, offset, None)
+
+
+def merge_occurrences(streams, key=None):
+    """
+    Lazily merges several iterables of occurrences, each in start order, into
+    one iterator in start order. Only one occurrence from each iterable is
+    held at a time. Occurrences with the same start come out in the order of
+    the iterables they came from.
+    
+    If the iterables are in the order of another ``key`` function (which
+    orders by start first), the merged occurrences are in that order.
+    """
+    if key is None:
+        key = lambda occurrence: occurrence.start
+    heap = []
+    for index, stream in enumerate(streams):
+        stream = iter(stream)
+        for occurrence in stream:
+            heap.append((key(occurrence), index, occurrence, stream))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        start, index, occurrence, stream = heap[0]
+        for next_occurrence in stream:
+            heapq.heapreplace(heap,
+                (key(next_occurrence), index, next_occurrence, stream))
+            break
+        else:
+            heapq.heappop(heap)
+        yield occurrence
+
 
 class OccurrenceReplacer(object):
     """
@@ -0,0 +1,307 @@
+"""
+A NumPy engine for expanding the common kinds of Rule.
+
+dateutil's rrule walks forward one Python datetime at a time, which dominates
+CPU time when DAILY/WEEKLY/MONTHLY generators are expanded over long windows.
+For those frequencies (and the ``interval``, ``count``, ``byweekday``,
+``bymonthday`` and ``bymonth`` params) the set of occurrence dates can be
+worked out on an array of days instead: lay out every day in the window as a
+datetime64 array, and keep the days that are in phase with dtstart and pass
+the by-filters, exactly as rrule would.
+
+Anything else (complex rules, other frequencies or params, or NumPy not being
+installed) falls back to dateutil, fast-forwarded to the window (see
+eventtools.fastforward), so callers can always use ``expand``:
+
+>>> expand(generator.rule, generator.start, window_start, window_end)
+[datetime(2010, 3, 1, 10, 0), datetime(2010, 3, 8, 10, 0), ...]
+
+Like ``rrule.between(start, end, inc=True)``, both ends of the window are
+inclusive.
+"""
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from eventtools.conf.settings import VECTORIZED_EXPANSION, SHARED_EXPANSION
+from eventtools.rrule_cache import get_rrule, rule_fingerprint
+from eventtools.signatures import expand_shared
+from eventtools import fastforward
+
+SUPPORTED_FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+SUPPORTED_PARAMS = ('interval', 'count', 'byweekday', 'bymonthday', 'bymonth')
+
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+class RuleSpec(object):
+    """
+    The parsed, validated parameters of a Rule the vectorized engine can
+    expand.
+    """
+    __slots__ = ('frequency', 'interval', 'count', 'byweekday', 'bymonthday',
+        'bymonth')
+
+    def __init__(self, frequency, interval=1, count=None, byweekday=None,
+        bymonthday=None, bymonth=None):
+        self.frequency = frequency
+        self.interval = interval
+        self.count = count
+        self.byweekday = byweekday
+        self.bymonthday = bymonthday
+        self.bymonth = bymonth
+
+
+def _as_tuple(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return (value,)
+
+
+def rule_spec(rule):
+    """
+    Returns a RuleSpec for ``rule``, or None if the vectorized engine can't
+    expand it (in which case dateutil should be used).
+    """
+    if numpy is None:
+        return None
+    return parse_rule_spec(rule)
+
+
+def parse_rule_spec(rule):
+    """
+    Returns a RuleSpec for ``rule``, or None if it uses a frequency, param or
+    value other than the supported ones. Doesn't need NumPy.
+    """
+    if rule is None or rule.complex_rule:
+        return None
+    if rule.frequency not in SUPPORTED_FREQUENCIES:
+        return None
+    try:
+        params = rule.get_params()
+    except ValueError:
+        return None
+    for key in params:
+        if key not in SUPPORTED_PARAMS:
+            return None
+
+    interval = params.get('interval', 1)
+    count = params.get('count')
+    byweekday = _as_tuple(params.get('byweekday'))
+    bymonthday = _as_tuple(params.get('bymonthday'))
+    bymonth = _as_tuple(params.get('bymonth'))
+
+    # Leave anything odd to dateutil, which knows how to complain about it.
+    if not isinstance(interval, int) or interval < 1:
+        return None
+    if count is not None and (not isinstance(count, int) or count < 1):
+        return None
+    if byweekday is not None and [d for d in byweekday if not 0 <= d <= 6]:
+        return None
+    if bymonthday is not None and \
+            [d for d in bymonthday if d == 0 or not -31 <= d <= 31]:
+        return None
+    if bymonth is not None and [m for m in bymonth if not 1 <= m <= 12]:
+        return None
+
+    return RuleSpec(rule.frequency, interval, count, byweekday, bymonthday,
+        bymonth)
+
+
+class DayGrid(object):
+    """
+    Every day between two dates (inclusive), with the calendar attributes
+    the by-filters need, as parallel arrays.
+    """
+
+    def __init__(self, first, last):
+        self.first = first
+        self.last = last
+        self.ordinals = numpy.arange(first.toordinal(), last.toordinal() + 1)
+        days = (self.ordinals - _EPOCH_ORDINAL).astype('datetime64[D]')
+        months = days.astype('datetime64[M]')
+        month_starts = months.astype('datetime64[D]')
+        next_month_starts = (months + 1).astype('datetime64[D]')
+        # ordinal 1 (1 January, year 1) was a Monday
+        self.weekdays = (self.ordinals - 1) % 7
+        # months since January 1970, which is all we need for phase
+        self.month_index = months.astype('int64')
+        self.months = self.month_index % 12 + 1
+        self.monthdays = (days - month_starts).astype('int64') + 1
+        self.month_lengths = (next_month_starts - month_starts).astype('int64')
+
+    def __len__(self):
+        return len(self.ordinals)
+
+
+def _isin(values, allowed):
+    result = numpy.zeros(len(values), dtype=bool)
+    for a in allowed:
+        result |= (values == a)
+    return result
+
+
+def _month_index(d):
+    return (d.year - 1970) * 12 + d.month - 1
+
+
+def _matching_days(spec, dtstart, grid):
+    """
+    Returns a boolean array, over ``grid``, of the days on which ``spec``
+    (starting at ``dtstart``) produces an occurrence, ignoring ``count``.
+    """
+    d0 = dtstart.toordinal()
+    ordinals = grid.ordinals
+    keep = ordinals >= d0
+
+    if spec.frequency == 'DAILY':
+        if spec.interval > 1:
+            keep &= (ordinals - d0) % spec.interval == 0
+    elif spec.frequency == 'WEEKLY':
+        if spec.interval > 1:
+            # weeks start on Monday (dateutil's default wkst)
+            week0 = d0 - dtstart.weekday()
+            weeks = (ordinals - grid.weekdays - week0) // 7
+            keep &= weeks % spec.interval == 0
+    elif spec.frequency == 'MONTHLY':
+        if spec.interval > 1:
+            months = grid.month_index - _month_index(dtstart)
+            keep &= months % spec.interval == 0
+
+    byweekday, bymonthday = spec.byweekday, spec.bymonthday
+    if byweekday is None and bymonthday is None:
+        # rrule's defaults are taken from dtstart
+        if spec.frequency == 'WEEKLY':
+            byweekday = (dtstart.weekday(),)
+        elif spec.frequency == 'MONTHLY':
+            bymonthday = (dtstart.day,)
+
+    if spec.bymonth:
+        keep &= _isin(grid.months, spec.bymonth)
+    if byweekday:
+        keep &= _isin(grid.weekdays, byweekday)
+    if bymonthday:
+        positive = [d for d in bymonthday if d > 0]
+        negative = [d for d in bymonthday if d < 0]
+        days = _isin(grid.monthdays, positive)
+        if negative:
+            days |= _isin(grid.monthdays - grid.month_lengths - 1, negative)
+        keep &= days
+    return keep
+
+
+def _in_window(ordinals, time, start, end):
+    """ start <= combine(ordinal, time) <= end, as a boolean array """
+    s, e = start.toordinal(), end.toordinal()
+    after = ordinals > s
+    if time >= start.time():
+        after |= ordinals == s
+    before = ordinals < e
+    if time <= end.time():
+        before |= ordinals == e
+    return after & before
+
+
+def expand_ordinals(spec, dtstart, start, end, grid=None):
+    """
+    Returns an array of the ordinals of the days (between ``start`` and
+    ``end``) on which ``spec``, starting at ``dtstart``, produces an
+    occurrence. Each occurrence starts at dtstart's time of day.
+
+    ``grid`` may be a DayGrid covering the window, shared between calls.
+    """
+    dtstart = dtstart.replace(microsecond=0)
+    if end < dtstart or end < start:
+        return numpy.zeros(0, dtype='int64')
+
+    first = max(start, dtstart).date()
+    if spec.count is not None:
+        # counting starts at dtstart, wherever the window is
+        first = dtstart.date()
+    if grid is None or grid.first > first or grid.last < end.date():
+        grid = DayGrid(first, end.date())
+
+    keep = _matching_days(spec, dtstart, grid)
+    if spec.count is not None:
+        keep &= numpy.cumsum(keep) <= spec.count
+    keep &= _in_window(grid.ordinals, dtstart.time(), start, end)
+    return grid.ordinals[keep]
+
+
+def _to_datetimes(ordinals, time):
+    fromordinal = datetime.fromordinal
+    combine = datetime.combine
+    return [combine(fromordinal(int(o)), time) for o in ordinals]
+
+
+def dateutil_expand(rule, dtstart, start, end):
+    """ The reference implementation. """
+    return get_rrule(rule, dtstart).between(start, end, inc=True)
+
+
+def expand(rule, dtstart, start, end, vectorized=None):
+    """
+    Returns the starts of the occurrences of ``rule`` (beginning at
+    ``dtstart``) that fall between ``start`` and ``end`` inclusive, using the
+    vectorized engine if it can handle the rule.
+    """
+    if vectorized is None:
+        vectorized = VECTORIZED_EXPANSION
+    spec = vectorized and rule_spec(rule)
+    if not spec:
+        return fastforward.between(rule, dtstart, start, end)
+    ordinals = expand_ordinals(spec, dtstart, start, end)
+    return _to_datetimes(ordinals, dtstart.replace(microsecond=0).time())
+
+
+def expand_batch(items, vectorized=None, shared=None):
+    """
+    Expands many rules at once. ``items`` is a sequence of
+    (key, rule, dtstart, start, end) tuples; returns a dict mapping each key
+    to the list of occurrence starts between its ``start`` and ``end``.
+
+    Items with the same rule signature are expanded once between them (see
+    eventtools.signatures). Otherwise rules are parsed once per batch and a
+    single day grid, covering the union of the windows, is shared by every
+    rule that doesn't use ``count``.
+    """
+    if vectorized is None:
+        vectorized = VECTORIZED_EXPANSION
+    if shared is None:
+        shared = SHARED_EXPANSION
+    result = {}
+    if shared:
+        result, items = expand_shared(items,
+            lambda rule, dtstart, start, end: expand(rule, dtstart, start, end, vectorized))
+    specs = {}
+    vector_items = []
+    for key, rule, dtstart, start, end in items:
+        spec = None
+        if vectorized and rule is not None:
+            rule_key = (rule.pk, rule_fingerprint(rule))
+            if rule_key not in specs:
+                specs[rule_key] = rule_spec(rule)
+            spec = specs[rule_key]
+        if spec:
+            vector_items.append((key, spec, dtstart, start, end))
+        else:
+            result[key] = fastforward.between(rule, dtstart, start, end)
+
+    windows = [(max(start, dtstart).date(), end.date())
+        for key, spec, dtstart, start, end in vector_items
+        if spec.count is None and end >= start and end >= dtstart]
+    grid = None
+    if windows:
+        grid = DayGrid(min([w[0] for w in windows]),
+            max([w[1] for w in windows]))
+
+    for key, spec, dtstart, start, end in vector_items:
+        ordinals = expand_ordinals(spec, dtstart, start, end, grid)
+        result[key] = _to_datetimes(ordinals,
+            dtstart.replace(microsecond=0).time())
+    return result
@@ -0,0 +1,180 @@
+"""
+Filling the occurrence cache ahead of time.
+
+After a deploy or a cache flush, the first visitor to each month page waits
+for every event on it to be expanded (see eventtools.occurrence_cache).
+``warm_occurrence_cache`` does that work up front: it caches each event's
+occurrences for the windows the month pages ask for (this month and the next
+few), as ``EventBase.get_occurrences`` would, so the pages are served from the
+cache from the start:
+
+>>> for report in warm_occurrence_cache(months=6, workers=4):
+...     print report
+lectures.lecture chunk 1: 200 events, 1200 windows (1187 cached, 13 already cached) in 0.84s
+...
+
+or, from the command line (or cron, after a deploy):
+
+    ./manage.py warm_occurrence_cache --months=6 --workers=4
+
+Events are taken ``chunk_size`` at a time. For each chunk, the windows that
+are already cached for the events' current schedule versions are skipped
+(their keys are looked up together), and the rest are expanded together, as
+``occurrences_between`` does: the generators, rules and exclusions are loaded
+once, the exceptions with one query a window, and the rules in one batch.
+
+With ``workers`` > 1, chunks are warmed by a pool of processes, as in
+eventtools.bulk. That only helps with a cache shared between processes (like
+memcached): with the default 'locmem://' backend, the chunks are warmed in
+this process.
+"""
+import time
+import datetime
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+from django.db import connection
+from django.db.models import get_model, get_models
+
+from eventtools.conf.settings import OCCURRENCE_CACHE_BACKEND, OCCURRENCE_CACHE_TIMEOUT
+from eventtools.models import EventBase
+from eventtools.models.occurrencegenerators import exceptions_between
+from eventtools.models.exclusions import exclusions_for
+from eventtools.occurrence_cache import get_occurrence_cache, schedule_versions, occurrences_key, cache_value
+from eventtools.vectorized import expand_batch
+
+CHUNK_SIZE = 200
+
+
+class ChunkReport(object):
+    """ What warming a chunk of events did, and how long it took. """
+    __slots__ = ('model', 'number', 'events', 'warmed', 'skipped', 'seconds')
+
+    def __init__(self, model, number, events, warmed, skipped, seconds):
+        self.model = model
+        self.number = number
+        self.events = events
+        self.warmed = warmed
+        self.skipped = skipped
+        self.seconds = seconds
+
+    def __str__(self):
+        return '%s chunk %d: %d events, %d windows (%d cached, %d already cached) in %.2fs' % (
+            self.model, self.number, self.events, self.warmed + self.skipped, self.warmed, self.skipped,
+            self.seconds)
+
+    def __repr__(self):
+        return '<ChunkReport: %s>' % self
+
+
+def month_windows(months, start=None):
+    """
+    The windows of the month pages (see eventtools.periods.Month) for ``months`` months, from the
+    month of ``start`` (default: now).
+    """
+    if start is None:
+        start = datetime.datetime.now()
+    windows = []
+    month_start = datetime.datetime(start.year, start.month, 1)
+    for i in range(months):
+        if month_start.month == 12:
+            month_end = month_start.replace(year=month_start.year + 1, month=1)
+        else:
+            month_end = month_start.replace(month=month_start.month + 1)
+        windows.append((month_start, month_end))
+        month_start = month_end
+    return windows
+
+
+def event_models():
+    """ All the installed EventBase models. """
+    return [model for model in get_models() if issubclass(model, EventBase)]
+
+
+def warm_chunk(app_label, model_name, pks, windows, hide_hidden=True):
+    """
+    Caches the occurrences of the events with ids ``pks`` for each of ``windows``, a list of
+    (start, end) datetimes, unless they are cached already. Returns the number of windows cached
+    and skipped, and the seconds it took. This is what the workers run.
+    """
+    began = time.time()
+    EventModel = get_model(app_label, model_name)
+    cache = get_occurrence_cache()
+    versions = schedule_versions(EventModel, pks)
+    keys = dict([((pk, window), occurrences_key(EventModel, pk, window[0], window[1], hide_hidden, versions[pk]))
+        for pk in pks for window in windows])
+    cached = cache.get_many(keys.values())
+    missing = set([entry for entry, key in keys.items() if key not in cached])
+    if missing:
+        GeneratorModel = get_model(app_label, EventModel._generator_model_name)
+        generators = list(GeneratorModel.objects.filter(event__in=set([pk for pk, window in missing]))
+            .select_related('rule'))
+        exclusions = exclusions_for(generators)
+        by_event = {}
+        for generator in generators:
+            by_event.setdefault(generator.event_id, []).append(generator)
+        for window in windows:
+            start, end = window
+            event_ids = [pk for pk in pks if (pk, window) in missing]
+            window_generators = [generator for pk in event_ids for generator in by_event.get(pk, [])]
+            starts = expand_batch([
+                (generator.pk, generator.rule, generator.start) + generator._expansion_window(start, end)
+                for generator in window_generators if generator.rule is not None
+            ])
+            exceptions = exceptions_between(window_generators, start, end)
+            values = {}
+            for pk in event_ids:
+                # as EventBase._get_occurrences
+                occurrences = []
+                for generator in by_event.get(pk, []):
+                    occurrences += generator.get_occurrences(start, end, hide_hidden,
+                        starts=starts.get(generator.pk), exceptional_occurrences=exceptions[generator.pk],
+                        exclusions=exclusions[generator.pk])
+                values[keys[(pk, window)]] = cache_value(sorted(occurrences))
+            cache.set_many(values, OCCURRENCE_CACHE_TIMEOUT)
+    return len(missing), len(keys) - len(missing), time.time() - began
+
+
+def _chunks(pks, chunk_size):
+    for i in range(0, len(pks), chunk_size):
+        yield pks[i:i + chunk_size]
+
+
+def warm_occurrence_cache(models=None, months=3, chunk_size=CHUNK_SIZE, workers=1, hide_hidden=True,
+    start=None):
+    """
+    Caches the occurrences of every event of ``models`` (default: all the EventBase models) for the
+    month pages of the next ``months`` months (see month_windows), in chunks of ``chunk_size``
+    events, warmed by ``workers`` processes. Returns an iterator of a ChunkReport for each chunk,
+    as it is finished.
+    """
+    windows = month_windows(months, start)
+    if models is None:
+        models = event_models()
+    for EventModel in models:
+        opts = EventModel._meta
+        label = '%s.%s' % (opts.app_label, opts.object_name.lower())
+        pks = list(EventModel.objects.order_by('pk').values_list('pk', flat=True))
+        chunks = list(_chunks(pks, chunk_size))
+        args = [(opts.app_label, opts.object_name, chunk, windows, hide_hidden) for chunk in chunks]
+
+        if ProcessPoolExecutor is None or workers == 1 or len(chunks) < 2 or \
+                OCCURRENCE_CACHE_BACKEND.startswith('locmem'):
+            for number, a in enumerate(args):
+                warmed, skipped, seconds = warm_chunk(*a)
+                yield ChunkReport(label, number + 1, len(a[2]), warmed, skipped, seconds)
+        else:
+            # the workers are forked from this process, and must each open
+            # their own connection rather than share this one
+            connection.close()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            try:
+                futures = [executor.submit(warm_chunk, *a) for a in args]
+                for number, future in enumerate(futures):
+                    warmed, skipped, seconds = future.result()
+                    yield ChunkReport(label, number + 1, len(args[number][2]), warmed, skipped, seconds)
+            finally:
+                executor.shutdown()